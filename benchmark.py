@@ -0,0 +1,349 @@
+import argparse
+import asyncio
+import io
+import json
+import platform
+import subprocess
+import time
+from datetime import datetime, timedelta, timezone
+import numpy as np
+import pandas as pd
+from asyncua import Client
+
+import server_aforo_abstraído as aforo
+from conexiones import GESTOR
+from modelo_panel import ModeloPanel
+from panel_headless import RenderizadorPanel
+import server_integracion_abstraído as integracion
+import server_intergracion as integracion_original
+import server_pluviometro_abstraido as pluviometro
+import server_temporal_abstraído as temporal
+from perfiles_suscripcion import PerfilSuscripcion, crear_suscripcion, monitorizar
+from prediccion import PronosticoCaudal, nucleo_por_defecto
+from sincronizacion import ETAPA_ESTACIONES, ETAPA_INTEGRACION, MODO_LIBRE, MODO_TIEMPO_REAL, SincronizacionTicks, registrar_consumidor
+
+TAMANOS_MICRO = [289, 2880, 28800]
+LONGITUDES_NUCLEO = [48, 288, 2880]
+# Muestras en el histórico del panel: un día y diez días a una muestra cada 5 min
+MUESTRAS_PANEL = [288, 2880]
+VELOCIDADES_TICKS = [1, 2, 5, 10, 20, 50]
+TICKS_POR_VELOCIDAD = 20
+# Ticks de la fase con el reloj en modo libre; junto a los de tiempo real deben caber en los datos (289 filas)
+TICKS_LIBRE = 100
+ESPERA_DRENAJE = 2.0
+# En tiempo real los bucles de las estaciones y de la integración sondean el reloj; con sus
+# intervalos por defecto (1 s el pluviómetro) se saltarían por construcción los ticks más
+# rápidos y la tasa máxima mediría el periodo de sondeo, no la capacidad de la cadena.
+# 5 ms queda muy por debajo del periodo del tick más rápido (20 ms a 50 ticks/s).
+INTERVALO_SONDEO = 0.005
+PUERTO_BASE = 4940
+INICIO_SIMULACION = datetime(2024, 10, 29, 0, 0)
+PASO = timedelta(minutes=5)
+# El observador es el instrumento de medida: no sigue el perfil de suscripción del despliegue
+PERFIL_OBSERVADOR = PerfilSuscripcion(10, 0, 100, True, None, 0.0)
+
+
+def crear_datos_pluviometro(filas):
+    horas = pd.date_range(INICIO_SIMULACION, periods=filas, freq="5min")
+    # El valor de cada fila es su índice, así se sabe qué tick ha llegado al final de la cadena
+    return pluviometro.fuente_en_memoria(
+        pd.DataFrame({"Hora": horas, "Precipitacion": np.arange(filas, dtype=float), "Calidad": 0}))
+
+
+def crear_datos_aforo(filas):
+    horas = pd.date_range(INICIO_SIMULACION, periods=filas, freq="5min")
+    return aforo.fuente_en_memoria(pd.DataFrame({
+        "Fecha": horas.strftime('%Y-%m-%d %H:%M:%S'),
+        "Caudal": np.arange(filas, dtype=float),
+        "Estado": "Validado",
+        "Calidad": 0,
+    }))
+
+
+def medir(funcion, repeticiones):
+    tiempos = np.empty(repeticiones)
+    for i in range(repeticiones):
+        inicio = time.perf_counter_ns()
+        funcion()
+        tiempos[i] = time.perf_counter_ns() - inicio
+    tiempos /= 1000.0
+    return {
+        "repeticiones": repeticiones,
+        "media_us": round(float(tiempos.mean()), 3),
+        "p50_us": round(float(np.percentile(tiempos, 50)), 3),
+        "p99_us": round(float(np.percentile(tiempos, 99)), 3),
+    }
+
+
+def _completar(corrutina):
+    """Ejecuta una corrutina que no llega a suspenderse, sin el coste de un bucle de eventos."""
+    try:
+        corrutina.send(None)
+    except StopIteration as fin:
+        return fin.value
+    corrutina.close()
+    raise RuntimeError("La corrutina se ha suspendido; no se puede medir sin bucle de eventos")
+
+
+def _medir_con_presupuesto(funcion, presupuesto):
+    # Una llamada de calibración decide cuántas repeticiones caben en el presupuesto
+    inicio = time.perf_counter()
+    funcion()
+    una = max(time.perf_counter() - inicio, 1e-7)
+    return medir(funcion, int(min(10000, max(5, presupuesto / una))))
+
+
+def crear_modelo_panel(muestras):
+    modelo = ModeloPanel()
+    for i in range(muestras):
+        hora = INICIO_SIMULACION + PASO * i
+        modelo.actualizar(float(i % 30), 50.0 + i % 100, hora.strftime('%Y-%m-%d %H:%M:%S'), i % 200 > 150)
+    return modelo
+
+
+def micro_benchmarks(tamanos=TAMANOS_MICRO, presupuesto=0.5, longitudes_nucleo=LONGITUDES_NUCLEO,
+                     muestras_panel=MUESTRAS_PANEL):
+    resultados = {}
+    for filas in tamanos:
+        fuente_pluvio = crear_datos_pluviometro(filas)
+        fuente_aforo = crear_datos_aforo(filas)
+        ultima_hora_dia = INICIO_SIMULACION + PASO * (min(filas, 288) - 1)
+        hora_sin_datos = INICIO_SIMULACION + timedelta(minutes=2)
+        ultima_fecha = INICIO_SIMULACION + PASO * (filas - 1)
+
+        # Se miden las corrutinas reales: con la fuente en memoria terminan sin suspenderse
+        casos = {
+            "buscar_precipitacion_por_hora/acierto": lambda: _completar(pluviometro.buscar_precipitacion_por_hora(fuente_pluvio, ultima_hora_dia)),
+            "buscar_precipitacion_por_hora/fallo": lambda: _completar(pluviometro.buscar_precipitacion_por_hora(fuente_pluvio, hora_sin_datos)),
+            "buscar_fila_aforo": lambda: _completar(aforo.buscar_fila_aforo(fuente_aforo, ultima_fecha)),
+            "calcular_estado_alerta": lambda: integracion.calcular_estado_alerta(12.5, 80.0),
+        }
+        for nombre, funcion in casos.items():
+            resultados[f"{nombre}[{filas}]"] = _medir_con_presupuesto(funcion, presupuesto)
+
+    # Acumulado horario del servidor de integración original: muestra dentro de la hora y
+    # muestra que abre una ventana nueva
+    hora = INICIO_SIMULACION + PASO * 6
+    casos = {
+        "acumular_precipitacion/misma_hora": lambda: integracion_original.acumular_precipitacion(
+            12.5, INICIO_SIMULACION, hora - PASO, hora, 3.2),
+        "acumular_precipitacion/hora_nueva": lambda: integracion_original.acumular_precipitacion(
+            12.5, INICIO_SIMULACION - timedelta(hours=1), hora - PASO, hora, 3.2),
+    }
+    for nombre, funcion in casos.items():
+        resultados[nombre] = _medir_con_presupuesto(funcion, presupuesto)
+
+    # El pronóstico por tick debe crecer con la longitud del núcleo, no con la del histórico
+    for longitud in longitudes_nucleo:
+        pronostico = PronosticoCaudal(nucleo_por_defecto(longitud))
+        def avanzar():
+            pronostico.avanzar(3.2)
+            pronostico.prevision()
+        resultados[f"PronosticoCaudal.avanzar[{longitud}]"] = _medir_con_presupuesto(avanzar, presupuesto)
+
+    # Un fotograma completo del panel sin pantalla (Agg): dibujo más codificación PNG
+    renderizador = RenderizadorPanel()
+    for muestras in muestras_panel:
+        instantanea = crear_modelo_panel(muestras).instantanea()
+        def renderizar():
+            renderizador.dibujar(instantanea)
+            renderizador.guardar(io.BytesIO(), "png")
+        resultados[f"RenderizadorPanel.dibujar[{muestras}]"] = _medir_con_presupuesto(renderizar, presupuesto)
+    return resultados
+
+
+class ObservadorIntegracion:
+    """Anota cuándo aparece en el servidor de integración el valor de cada tick."""
+
+    def __init__(self, nodo_precipitaciones, nodo_caudal):
+        self.nodos = {nodo_precipitaciones.nodeid: "precipitaciones", nodo_caudal.nodeid: "caudal"}
+        self.vistos = {"precipitaciones": {}, "caudal": {}}
+
+    def datachange_notification(self, node, val, data):
+        variable = self.nodos.get(node.nodeid)
+        if variable is not None:
+            self.vistos[variable].setdefault(int(val), time.perf_counter())
+
+    def publicado(self, tick):
+        tiempos = [self.vistos[variable].get(tick) for variable in self.vistos]
+        return None if None in tiempos else max(tiempos)
+
+
+async def medir_modo_libre(sincronizacion, hora_simulada, observador, primer_tick, ticks):
+    """Avanza el reloj tan rápido como confirma la cadena y mide la tasa sostenida."""
+    await sincronizacion.cambiar_modo(MODO_LIBRE)
+    # Los consumidores se enteran del cambio de modo por su suscripción
+    await asyncio.sleep(0.5)
+    inicio = time.perf_counter()
+    for tick in range(primer_tick, primer_tick + ticks):
+        await hora_simulada.write_value(INICIO_SIMULACION + PASO * tick)
+        await sincronizacion.publicar(tick)
+    duracion = time.perf_counter() - inicio
+    await sincronizacion.cambiar_modo(MODO_TIEMPO_REAL)
+    await asyncio.sleep(ESPERA_DRENAJE)
+
+    publicados = sum(observador.publicado(tick) is not None for tick in range(primer_tick, primer_tick + ticks))
+    resultado = {
+        "ticks": ticks,
+        "publicados": publicados,
+        "duracion_s": round(duracion, 3),
+        "ticks_por_segundo": round(ticks / duracion, 2),
+    }
+    print(f"modo libre: {publicados}/{ticks} publicados a {resultado['ticks_por_segundo']} ticks/s")
+    return resultado
+
+
+async def escenario(velocidades=VELOCIDADES_TICKS, ticks=TICKS_POR_VELOCIDAD, puerto_base=PUERTO_BASE, ticks_libre=TICKS_LIBRE):
+    url_temporal = f"opc.tcp://localhost:{puerto_base}/temporal/"
+    url_pluvio = f"opc.tcp://localhost:{puerto_base + 1}/pluviometro/"
+    url_aforo = f"opc.tcp://localhost:{puerto_base + 2}/estacion_aforo/"
+    url_integracion = f"opc.tcp://localhost:{puerto_base + 10}/integracion/"
+
+    tareas = []
+    servidores = []
+    clientes = []
+    try:
+        servidor_temporal, idx = await temporal.configurar_servidor(url_temporal, "http://www.epsa.upv.es/entornos/temporal")
+        hora_simulada = await temporal.agregar_variable_hora_simulada(servidor_temporal, idx, INICIO_SIMULACION)
+        # Empieza en tiempo real; sólo la última fase pasa a modo libre
+        sincronizacion = SincronizacionTicks(MODO_TIEMPO_REAL)
+        await sincronizacion.configurar(servidor_temporal, idx)
+        await servidor_temporal.start()
+        servidores.append(servidor_temporal)
+
+        fuente_pluvio = crear_datos_pluviometro(289)
+        servidor_pluvio, nodo_precipitaciones, nodo_hora, *_ = await pluviometro.iniciar_servidor_pluviometro(url_pluvio)
+        servidores.append(servidor_pluvio)
+        _, nodo_hora_pluvio = await pluviometro.conectar_servidor_temporal(url_temporal)
+        consumidor_pluvio = await registrar_consumidor(url_temporal, "pluviometro", ETAPA_ESTACIONES)
+        tareas.append(asyncio.create_task(pluviometro.ciclo_pluviometro(
+            fuente_pluvio, nodo_hora_pluvio, nodo_precipitaciones, nodo_hora, intervalo=INTERVALO_SONDEO,
+            sincronizacion=consumidor_pluvio)))
+
+        servidor_aforo, caudal_var, estado_var, hora_aforo, *_ = await aforo.configurar_servidor(url_aforo, aforo.URI)
+        await servidor_aforo.start()
+        servidores.append(servidor_aforo)
+        _, nodo_hora_aforo = await aforo.conectar_servidor_temporal(url_temporal)
+        consumidor_aforo = await registrar_consumidor(url_temporal, "aforo", ETAPA_ESTACIONES)
+        tareas.append(asyncio.create_task(aforo.ciclo_aforo(
+            nodo_hora_aforo, caudal_var, estado_var, hora_aforo, crear_datos_aforo(289), intervalo=INTERVALO_SONDEO,
+            sincronizacion=consumidor_aforo)))
+
+        clientes_integracion = {
+            'pluvio': await integracion.conectar_cliente(url_pluvio),
+            'aforo': await integracion.conectar_cliente(url_aforo),
+            'temporal': await integracion.conectar_cliente(url_temporal),
+        }
+        servidor_integracion, *variables_integracion, prediccion = await integracion.configurar_servidor_integracion(
+            url_integracion, integracion.URI_INTEGRACION)
+        servidores.append(servidor_integracion)
+        nodos = await integracion.configurar_nodos_clientes(clientes_integracion)
+        consumidor_integracion = await registrar_consumidor(url_temporal, "integracion", ETAPA_INTEGRACION)
+        tareas.append(asyncio.create_task(integracion.ciclo_integracion(
+            clientes_integracion, nodos, *variables_integracion, intervalo=INTERVALO_SONDEO, prediccion=prediccion,
+            sincronizacion=consumidor_integracion)))
+
+        observador_cliente = Client(url_integracion)
+        await observador_cliente.connect()
+        clientes.append(observador_cliente)
+        observador = ObservadorIntegracion(variables_integracion[0], variables_integracion[1])
+        subscription = await crear_suscripcion(observador_cliente, observador, PERFIL_OBSERVADOR)
+        await monitorizar(
+            subscription,
+            [observador_cliente.get_node(variables_integracion[0].nodeid), observador_cliente.get_node(variables_integracion[1].nodeid)],
+            PERFIL_OBSERVADOR)
+
+        resultados = []
+        tick = 0
+        for velocidad in velocidades:
+            escritos = {}
+            intervalo = 1.0 / velocidad
+            siguiente = time.perf_counter()
+            for _ in range(ticks):
+                tick += 1
+                escritos[tick] = time.perf_counter()
+                await hora_simulada.write_value(INICIO_SIMULACION + PASO * tick)
+                siguiente += intervalo
+                await asyncio.sleep(max(0.0, siguiente - time.perf_counter()))
+            await asyncio.sleep(ESPERA_DRENAJE)
+
+            latencias = []
+            for numero, escrito in escritos.items():
+                publicado = observador.publicado(numero)
+                if publicado is not None:
+                    latencias.append((publicado - escrito) * 1000)
+            resultados.append({
+                "ticks_por_segundo": velocidad,
+                "ticks": len(escritos),
+                "publicados": len(latencias),
+                "p50_ms": round(float(np.percentile(latencias, 50)), 2) if latencias else None,
+                "p99_ms": round(float(np.percentile(latencias, 99)), 2) if latencias else None,
+            })
+            print(f"{velocidad} ticks/s: {len(latencias)}/{len(escritos)} publicados")
+
+        sostenibles = [r["ticks_por_segundo"] for r in resultados if r["publicados"] >= 0.99 * r["ticks"]]
+        libre = await medir_modo_libre(sincronizacion, hora_simulada, observador, tick + 1, ticks_libre) if ticks_libre else None
+        return {"velocidades": resultados, "tasa_max_sostenible": max(sostenibles) if sostenibles else 0, "modo_libre": libre}
+    finally:
+        for tarea in tareas:
+            tarea.cancel()
+        await asyncio.gather(*tareas, return_exceptions=True)
+        # Las sesiones de los servidores son del gestor compartido; el observador es propio
+        await GESTOR.cerrar()
+        for cliente in clientes:
+            await cliente.disconnect()
+        for servidor in servidores:
+            await servidor.stop()
+
+
+def commit_actual():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def comparar(actual, anterior):
+    for nombre, medida in actual.get("micro", {}).items():
+        previa = anterior.get("micro", {}).get(nombre)
+        if previa:
+            print(f"{nombre}: {previa['p50_us']} -> {medida['p50_us']} us (x{medida['p50_us'] / previa['p50_us']:.2f})")
+    if "escenario" in actual and "escenario" in anterior:
+        print(f"tasa_max_sostenible: {anterior['escenario']['tasa_max_sostenible']} -> {actual['escenario']['tasa_max_sostenible']} ticks/s")
+        libre_actual, libre_anterior = actual["escenario"].get("modo_libre"), anterior["escenario"].get("modo_libre")
+        if libre_actual and libre_anterior:
+            print(f"modo libre: {libre_anterior['ticks_por_segundo']} -> {libre_actual['ticks_por_segundo']} ticks/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmarks y escenario de latencia extremo a extremo.")
+    parser.add_argument("--solo-micro", action="store_true", help="No arrancar los servidores del escenario")
+    parser.add_argument("--ticks", type=int, default=TICKS_POR_VELOCIDAD, help="Ticks por velocidad en el escenario")
+    parser.add_argument("--ticks-libre", type=int, default=TICKS_LIBRE, help="Ticks con el reloj en modo libre (0 para omitir)")
+    parser.add_argument("--puerto-base", type=int, default=PUERTO_BASE)
+    parser.add_argument("--salida", default="resultados_benchmark.json", help="Archivo JSON de resultados")
+    parser.add_argument("--comparar", default=None, help="JSON de una ejecución anterior con el que comparar")
+    args = parser.parse_args()
+
+    resultados = {
+        "commit": commit_actual(),
+        "fecha": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "plataforma": platform.platform(),
+        "micro": micro_benchmarks(),
+    }
+    if not args.solo_micro:
+        resultados["escenario"] = asyncio.run(escenario(ticks=args.ticks, puerto_base=args.puerto_base,
+                                                        ticks_libre=args.ticks_libre))
+
+    with open(args.salida, "w", encoding="utf-8") as archivo:
+        json.dump(resultados, archivo, indent=2, ensure_ascii=False)
+    print(f"Resultados guardados en {args.salida}")
+
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as archivo:
+            comparar(resultados, json.load(archivo))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,350 @@
+import asyncio
+import bisect
+import collections
+import csv
+import io
+import logging
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timezone
+
+# pandas se importa dentro de las funciones: cuesta más de 0,3 s y los servidores
+# deben escuchar antes de que termine la carga de datos.
+
+# Una semana de datos cincominutales por bloque
+FILAS_POR_BLOQUE = 2016
+BLOQUES_PREVIOS = 1
+BLOQUES_SIGUIENTES = 2
+
+# Valores de la variable EstadoCarga que publican los servidores de estación
+ESTADO_CARGANDO = "Cargando"
+ESTADO_LISTO = "Listo"
+
+_logger = logging.getLogger("carga_streaming")
+
+# Rango temporal de un bloque del archivo y dónde empieza (byte) dentro de él. Si el lector
+# usa contexto, `desplazamiento` apunta a las `filas_contexto` filas anteriores al bloque.
+Bloque = collections.namedtuple("Bloque", ["inicio", "fin", "desplazamiento", "filas", "filas_contexto"], defaults=[0])
+
+
+async def agregar_estado_carga(objeto, idx):
+    return await objeto.add_variable(idx, "EstadoCarga", ESTADO_CARGANDO)
+
+
+async def cargar_en_segundo_plano(estado_carga, funcion, *args):
+    """Ejecuta `funcion(*args)` en un hilo mientras el servidor ya atiende clientes.
+
+    El progreso queda en la variable EstadoCarga: "Cargando", "Listo" o "Error: ...".
+    """
+    inicio = time.perf_counter()
+    await estado_carga.write_value(ESTADO_CARGANDO)
+    try:
+        resultado = await asyncio.get_running_loop().run_in_executor(None, funcion, *args)
+    except Exception as e:
+        await estado_carga.write_value(f"Error: {e}")
+        raise
+    await estado_carga.write_value(ESTADO_LISTO)
+    _logger.info("Datos cargados en %.2f s", time.perf_counter() - inicio)
+    return resultado
+
+
+def _convertir_fechas(valores, formato=None):
+    import pandas as pd
+
+    return pd.to_datetime(pd.Series(valores, dtype=object), format=formato, errors="coerce")
+
+
+def _marca_temporal(hora):
+    """`hora` sin zona horaria (pasada a UTC), la forma en que se indexan las fuentes.
+
+    Se llama en cada consulta, así que no usa pandas: un datetime sirve igual para .loc.
+    """
+    if hora.tzinfo is not None:
+        hora = hora.astimezone(timezone.utc).replace(tzinfo=None)
+    return hora
+
+
+def _indexar_por_fecha(df, columna_fecha, formato_fecha=None):
+    import pandas as pd
+
+    fecha = df.iloc[:, columna_fecha] if isinstance(columna_fecha, int) else df[columna_fecha]
+    df = df.set_axis(pd.DatetimeIndex(_convertir_fechas(fecha.tolist(), formato_fecha)), axis=0)
+    # Orden estable: las filas con la misma fecha conservan su orden en el archivo
+    return df.sort_index(kind="mergesort")
+
+
+class LectorCSV:
+    """Lee un CSV por bloques de filas con acceso directo por desplazamiento en bytes.
+
+    Supone una fila por línea (sin saltos de línea dentro de campos entrecomillados).
+    `preparar` se aplica a cada bloque leído, igual que se haría con el archivo completo;
+    con `contexto` > 0 recibe además esas filas vecinas a cada lado (para controles que
+    miran a las muestras de alrededor), que se descartan después.
+    """
+
+    def __init__(self, ruta, columna_fecha, preparar=None, formato_fecha=None,
+                 filas_por_bloque=FILAS_POR_BLOQUE, separador=",", codificacion="utf-8", contexto=0):
+        self.ruta = ruta
+        self.columna_fecha = columna_fecha
+        self.preparar = preparar
+        self.formato_fecha = formato_fecha
+        self.filas_por_bloque = filas_por_bloque
+        self.contexto = contexto
+        self.separador = separador
+        self.codificacion = codificacion
+        self.columnas = None
+
+    def _campo_fecha(self, linea, posicion):
+        campos = next(csv.reader([linea.decode(self.codificacion)], delimiter=self.separador))
+        return campos[posicion] if posicion < len(campos) else None
+
+    def indexar(self):
+        """Recorre el archivo una vez y devuelve la lista de Bloque, sin guardar las filas."""
+        bloques = []
+        with open(self.ruta, "rb") as archivo:
+            cabecera = archivo.readline()
+            self.columnas = next(csv.reader([cabecera.decode(self.codificacion).lstrip("\ufeff")], delimiter=self.separador))
+            posicion = self.columna_fecha if isinstance(self.columna_fecha, int) else self.columnas.index(self.columna_fecha)
+            desplazamiento = len(cabecera)
+
+            def cerrar_bloque(inicio_bloque, filas_contexto, fechas):
+                convertidas = _convertir_fechas(fechas, self.formato_fecha)
+                if convertidas.notna().any():
+                    bloques.append(Bloque(convertidas.min(), convertidas.max(), inicio_bloque, len(fechas), filas_contexto))
+
+            fechas = []
+            inicio_bloque = desplazamiento
+            filas_contexto = 0
+            # Desplazamientos de las últimas filas, para empezar cada bloque con su contexto
+            anteriores = collections.deque(maxlen=self.contexto or 1)
+            for linea in archivo:
+                if linea.strip():
+                    if not fechas:
+                        filas_contexto = len(anteriores) if self.contexto else 0
+                        inicio_bloque = anteriores[0] if filas_contexto else desplazamiento
+                    fechas.append(self._campo_fecha(linea, posicion))
+                    anteriores.append(desplazamiento)
+                    if len(fechas) == self.filas_por_bloque:
+                        cerrar_bloque(inicio_bloque, filas_contexto, fechas)
+                        fechas = []
+                desplazamiento += len(linea)
+            if fechas:
+                cerrar_bloque(inicio_bloque, filas_contexto, fechas)
+
+        if any(siguiente.inicio < anterior.fin for anterior, siguiente in zip(bloques, bloques[1:])):
+            _logger.warning("'%s' no está ordenado por fecha; la búsqueda por bloques puede fallar", self.ruta)
+        _logger.info("Indexados %d bloques de '%s'", len(bloques), self.ruta)
+        return bloques
+
+    def leer_bloque(self, bloque):
+        import pandas as pd
+
+        with open(self.ruta, "rb") as archivo:
+            archivo.seek(bloque.desplazamiento)
+            lineas = []
+            total = bloque.filas_contexto + bloque.filas + self.contexto
+            while len(lineas) < total:
+                linea = archivo.readline()
+                if not linea:
+                    break
+                if linea.strip():
+                    lineas.append(linea)
+        df = pd.read_csv(io.BytesIO(b"".join(lineas)), names=self.columnas, header=None,
+                         sep=self.separador, encoding=self.codificacion)
+        return self._indexar_por_fecha(df, bloque.filas_contexto, bloque.filas)
+
+    def vacio(self):
+        import pandas as pd
+
+        return self._indexar_por_fecha(pd.DataFrame(columns=self.columnas))
+
+    def _indexar_por_fecha(self, df, filas_contexto=0, filas=None):
+        if self.preparar is not None:
+            df = self.preparar(df)
+        if filas is not None:
+            df = df.iloc[filas_contexto:filas_contexto + filas]
+        return _indexar_por_fecha(df, self.columna_fecha, self.formato_fecha)
+
+    def cerrar(self):
+        pass
+
+
+class LectorExcel:
+    """Lee una hoja Excel por bloques.
+
+    openpyxl no permite saltar a una fila sin recorrer las anteriores, así que al indexar
+    se vuelca la hoja (en modo de sólo lectura, fila a fila) a un CSV temporal y los bloques
+    se leen de ahí con acceso directo.
+    """
+
+    def __init__(self, ruta, columna_fecha=0, preparar=None, skiprows=0, usecols=None,
+                 filas_por_bloque=FILAS_POR_BLOQUE, contexto=0):
+        self.ruta = ruta
+        self.columna_fecha = columna_fecha
+        self.preparar = preparar
+        self.skiprows = skiprows
+        self.usecols = usecols
+        self.filas_por_bloque = filas_por_bloque
+        self.contexto = contexto
+        self._csv = None
+
+    def _volcar_a_csv(self):
+        import openpyxl
+
+        descriptor, ruta_csv = tempfile.mkstemp(prefix="entornos_", suffix=".csv")
+        libro = openpyxl.load_workbook(self.ruta, read_only=True, data_only=True)
+        try:
+            with os.fdopen(descriptor, "w", encoding="utf-8", newline="") as archivo:
+                escritor = csv.writer(archivo)
+                # Como pandas: la fila tras las saltadas es la cabecera
+                for fila in libro.active.iter_rows(min_row=self.skiprows + 1, values_only=True):
+                    if self.usecols is not None:
+                        fila = [fila[i] if i < len(fila) else None for i in self.usecols]
+                    if all(valor is None for valor in fila):
+                        continue
+                    escritor.writerow(["" if valor is None else valor for valor in fila])
+        finally:
+            libro.close()
+        return ruta_csv
+
+    def indexar(self):
+        ruta_csv = self._volcar_a_csv()
+        self._csv = LectorCSV(ruta_csv, self.columna_fecha, self.preparar,
+                              filas_por_bloque=self.filas_por_bloque, contexto=self.contexto)
+        return self._csv.indexar()
+
+    @property
+    def columnas(self):
+        return self._csv.columnas
+
+    def leer_bloque(self, bloque):
+        return self._csv.leer_bloque(bloque)
+
+    def vacio(self):
+        return self._csv.vacio()
+
+    def cerrar(self):
+        if self._csv is not None:
+            try:
+                os.remove(self._csv.ruta)
+            except OSError:
+                pass
+            self._csv = None
+
+
+class FuenteEnMemoria:
+    """Datos ya cargados por completo, con la misma interfaz de consulta que CargadorVentana.
+
+    Para archivos pequeños y para el benchmark: filas() nunca lee del disco, así que
+    buscar() no necesita salir del bucle de eventos.
+    """
+
+    def __init__(self, df, columna_fecha, formato_fecha=None):
+        self.df = _indexar_por_fecha(df, columna_fecha, formato_fecha)
+
+    def filas(self, hora):
+        """Filas con fecha exactamente igual a `hora` (DataFrame vacío si no hay)."""
+        hora = _marca_temporal(hora)
+        return self.df.loc[hora:hora]
+
+    async def buscar(self, hora):
+        return self.filas(hora)
+
+    def cerrar(self):
+        pass
+
+
+class CargadorVentana:
+    """Datos de un archivo largo con sólo una ventana de bloques en memoria.
+
+    Se mantienen residentes el bloque de la hora consultada, `bloques_previos` anteriores y
+    `bloques_siguientes` posteriores; los siguientes se precargan en un hilo aparte. Mover
+    el reloj a cualquier fecha cuesta una búsqueda binaria en el índice y la lectura de un
+    bloque. Desde el bucle de publicación se consulta con buscar(), que espera esa lectura
+    sin bloquear el bucle de eventos; filas() es la versión síncrona.
+    """
+
+    def __init__(self, lector, bloques_previos=BLOQUES_PREVIOS, bloques_siguientes=BLOQUES_SIGUIENTES):
+        self.lector = lector
+        self.bloques_previos = bloques_previos
+        self.bloques_siguientes = bloques_siguientes
+        self.bloques = lector.indexar()
+        self._inicios = [bloque.inicio for bloque in self.bloques]
+        self._vacio = lector.vacio()
+        self.ventana = collections.OrderedDict()
+        self._pendientes = {}
+        self._ejecutor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="precarga")
+
+    @property
+    def rango(self):
+        if not self.bloques:
+            return None, None
+        return self.bloques[0].inicio, self.bloques[-1].fin
+
+    def indice_bloque(self, hora):
+        i = bisect.bisect_right(self._inicios, hora) - 1
+        if i < 0 or hora > self.bloques[i].fin:
+            return None
+        return i
+
+    def _bloque(self, i):
+        df = self.ventana.get(i)
+        if df is None:
+            pendiente = self._pendientes.pop(i, None)
+            df = pendiente.result() if pendiente is not None else self.lector.leer_bloque(self.bloques[i])
+            self.ventana[i] = df
+        return df
+
+    async def _bloque_async(self, i):
+        df = self.ventana.get(i)
+        if df is None:
+            pendiente = self._pendientes.pop(i, None)
+            if pendiente is not None:
+                df = await asyncio.wrap_future(pendiente)
+            else:
+                # Salto a un bloque no precargado: se lee en otro hilo, no en el de precarga,
+                # para no esperar detrás de precargas que el salto deja sin uso
+                df = await asyncio.to_thread(self.lector.leer_bloque, self.bloques[i])
+            self.ventana[i] = df
+        return df
+
+    def _ajustar_ventana(self, i):
+        desde, hasta = i - self.bloques_previos, i + self.bloques_siguientes
+        for j in [j for j in self.ventana if not desde <= j <= hasta]:
+            del self.ventana[j]
+        for j in [j for j in self._pendientes if not i < j <= hasta]:
+            self._pendientes.pop(j).cancel()
+        for j in range(i + 1, min(hasta, len(self.bloques) - 1) + 1):
+            if j not in self.ventana and j not in self._pendientes:
+                self._pendientes[j] = self._ejecutor.submit(self.lector.leer_bloque, self.bloques[j])
+
+    def filas(self, hora):
+        """Filas con fecha exactamente igual a `hora` (DataFrame vacío si no hay).
+
+        Si el bloque no está en memoria lo lee en el hilo que llama: no usar desde el bucle de eventos.
+        """
+        hora = _marca_temporal(hora)
+        i = self.indice_bloque(hora)
+        if i is None:
+            return self._vacio
+        df = self._bloque(i)
+        self._ajustar_ventana(i)
+        return df.loc[hora:hora]
+
+    async def buscar(self, hora):
+        """Como filas(), pero la lectura de un bloque que no está en memoria no bloquea el bucle."""
+        hora = _marca_temporal(hora)
+        i = self.indice_bloque(hora)
+        if i is None:
+            return self._vacio
+        df = await self._bloque_async(i)
+        self._ajustar_ventana(i)
+        return df.loc[hora:hora]
+
+    def cerrar(self):
+        self._ejecutor.shutdown(wait=True, cancel_futures=True)
+        self._pendientes.clear()
+        self.ventana.clear()
+        self.lector.cerrar()
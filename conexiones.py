@@ -0,0 +1,166 @@
+import asyncio
+import logging
+from asyncua import Client, ua
+from perfiles_suscripcion import crear_suscripcion, monitorizar, obtener_perfil
+
+INTERVALO_KEEPALIVE = 1.0
+TIEMPO_MAXIMO_KEEPALIVE = 2.0
+# La espera entre intentos se duplica desde aquí hasta el intervalo de keepalive: un servidor
+# que vuelve se recupera en un intervalo, sin reiniciar la cadena
+ESPERA_INICIAL_RECONEXION = 0.5
+
+# Errores que indican que la sesión se ha perdido; los bucles de lectura los capturan
+# y siguen en el siguiente ciclo mientras el gestor reconecta por debajo.
+ERRORES_CONEXION = (ConnectionError, OSError, asyncio.TimeoutError, ua.UaError)
+
+_logger = logging.getLogger("conexiones")
+
+
+class SuscripcionGestionada:
+    """Suscripción que el gestor vuelve a crear, con sus elementos monitorizados, tras reconectar.
+
+    Sin `perfil` se usa el elegido con ENTORNOS_PERFIL_SUSCRIPCION.
+    """
+
+    def __init__(self, handler, nodos, perfil=None, banda_muerta=False):
+        self.handler = handler
+        self.nodos = list(nodos)
+        self.perfil = perfil or obtener_perfil()
+        self.banda_muerta = banda_muerta
+        self.subscription = None
+
+    async def crear(self, cliente):
+        self.subscription = await crear_suscripcion(cliente, self.handler, self.perfil)
+        await monitorizar(self.subscription, self.nodos, self.perfil, self.banda_muerta)
+
+    async def anadir_nodos(self, nodos):
+        nodos = list(nodos)
+        self.nodos.extend(nodos)
+        if self.subscription is not None:
+            await monitorizar(self.subscription, nodos, self.perfil, self.banda_muerta)
+
+
+class ConexionGestionada:
+    """Una sesión por endpoint, compartida por todos los consumidores del proceso.
+
+    Un vigilante lee el estado del servidor cada `intervalo_keepalive`; si falla, reconecta
+    el mismo Client (los Node obtenidos de él siguen valiendo) con espera exponencial, como
+    mucho de un intervalo, y restaura las suscripciones registradas. La primera conexión se
+    reintenta igual, así que un servicio puede arrancar antes que el servidor al que se conecta.
+    """
+
+    def __init__(self, endpoint, intervalo_keepalive=INTERVALO_KEEPALIVE):
+        self.endpoint = endpoint
+        self.intervalo_keepalive = intervalo_keepalive
+        self.cliente = Client(endpoint)
+        self.suscripciones = []
+        self.usuarios = 0
+        self.reconexiones = 0
+        self.conectada = asyncio.Event()
+        self._vigilante = None
+
+    async def conectar(self):
+        await self._conectar_con_espera("conectar")
+        self._vigilante = asyncio.create_task(self._vigilar())
+        _logger.info("Conectado a servidor OPC UA en: %s", self.endpoint)
+
+    async def esperar_conexion(self):
+        await self.conectada.wait()
+
+    async def suscribir(self, handler, nodos, perfil=None, banda_muerta=False):
+        suscripcion = SuscripcionGestionada(handler, nodos, perfil, banda_muerta)
+        self.suscripciones.append(suscripcion)
+        await self.conectada.wait()
+        await suscripcion.crear(self.cliente)
+        return suscripcion
+
+    async def _vigilar(self):
+        nodo_estado = self.cliente.get_node(ua.ObjectIds.Server_ServerStatus_State)
+        while True:
+            await asyncio.sleep(self.intervalo_keepalive)
+            try:
+                await asyncio.wait_for(nodo_estado.read_value(), TIEMPO_MAXIMO_KEEPALIVE)
+            except ERRORES_CONEXION as e:
+                _logger.warning("Conexión perdida con %s (%s), reconectando", self.endpoint, e)
+                self.conectada.clear()
+                await self._conectar_con_espera("reconectar")
+                self.reconexiones += 1
+                _logger.info("Reconectado a %s y restauradas %d suscripciones", self.endpoint, len(self.suscripciones))
+
+    async def _conectar_con_espera(self, accion):
+        espera = 0.0
+        espera_maxima = max(ESPERA_INICIAL_RECONEXION, self.intervalo_keepalive)
+        while True:
+            if espera:
+                await asyncio.sleep(espera)
+            try:
+                await self._desconectar_en_silencio()
+                await self.cliente.connect()
+                for suscripcion in self.suscripciones:
+                    await suscripcion.crear(self.cliente)
+            except ERRORES_CONEXION as e:
+                espera = min(max(espera * 2, ESPERA_INICIAL_RECONEXION), espera_maxima)
+                _logger.warning("No se pudo %s con %s (%s), reintento en %.1f s", accion, self.endpoint, e, espera)
+                continue
+            self.conectada.set()
+            return
+
+    async def _desconectar_en_silencio(self):
+        try:
+            await self.cliente.disconnect()
+        except ERRORES_CONEXION:
+            pass
+
+    async def cerrar(self):
+        if self._vigilante is not None:
+            self._vigilante.cancel()
+            await asyncio.gather(self._vigilante, return_exceptions=True)
+        self.conectada.clear()
+        await self._desconectar_en_silencio()
+
+
+class GestorConexiones:
+    """Reparte una ConexionGestionada por endpoint; se libera cuando la suelta su último usuario.
+
+    Cada llamada a obtener() o suscribir() cuenta como un usuario y debe ir emparejada con liberar().
+    """
+
+    def __init__(self, intervalo_keepalive=INTERVALO_KEEPALIVE):
+        self.intervalo_keepalive = intervalo_keepalive
+        self.conexiones = {}
+        self._candado = None
+
+    async def obtener(self, endpoint):
+        if self._candado is None:
+            self._candado = asyncio.Lock()
+        async with self._candado:
+            conexion = self.conexiones.get(endpoint)
+            if conexion is None:
+                conexion = ConexionGestionada(endpoint, self.intervalo_keepalive)
+                await conexion.conectar()
+                self.conexiones[endpoint] = conexion
+            conexion.usuarios += 1
+            return conexion
+
+    async def suscribir(self, endpoint, handler, nodos, perfil=None, banda_muerta=False):
+        conexion = await self.obtener(endpoint)
+        return await conexion.suscribir(handler, nodos, perfil, banda_muerta)
+
+    async def liberar(self, endpoint):
+        conexion = self.conexiones.get(endpoint)
+        if conexion is None:
+            return
+        conexion.usuarios -= 1
+        if conexion.usuarios <= 0:
+            del self.conexiones[endpoint]
+            await conexion.cerrar()
+
+    async def cerrar(self):
+        conexiones = list(self.conexiones.values())
+        self.conexiones.clear()
+        for conexion in conexiones:
+            await conexion.cerrar()
+
+
+# Gestor compartido por todos los módulos del proceso
+GESTOR = GestorConexiones()
@@ -0,0 +1,89 @@
+# numpy se importa dentro de las funciones: este módulo lo importan los servidores de
+# estación, que no deben cargarlo antes de abrir su endpoint.
+
+# Códigos de calidad por muestra: máscara de bits, 0 = dato correcto.
+# Se publican con el valor en la variable Calidad (UInt16) de cada estación.
+CALIDAD_OK = 0
+FALTANTE = 1
+NEGATIVO = 2
+PICO = 4
+PLANO = 8
+HUECO = 16  # falta al menos un instante entre la muestra anterior y ésta
+DUPLICADO = 32  # fecha repetida o anterior a la de la muestra previa
+
+NOMBRES_CALIDAD = {
+    FALTANTE: "faltante",
+    NEGATIVO: "negativo",
+    PICO: "pico",
+    PLANO: "plano",
+    HUECO: "hueco",
+    DUPLICADO: "duplicado",
+}
+
+# Datos cincominutales
+PASO_ESPERADO_MINUTOS = 5
+# Una hora con exactamente el mismo valor se considera sensor bloqueado
+MUESTRAS_PLANO = 12
+
+
+def evaluar_calidad(valores, fechas=None, umbral_pico=None, paso_minutos=PASO_ESPERADO_MINUTOS,
+                    muestras_plano=MUESTRAS_PLANO, valores_planos_validos=()):
+    """Calcula el código de calidad de cada muestra en una sola pasada vectorizada.
+
+    `valores` no se modifica ni se compacta: los faltantes se marcan en su posición.
+    Un pico es una muestra que se separa más de `umbral_pico` de sus dos vecinas en el
+    mismo sentido. Las rachas de `valores_planos_validos` (p. ej. 0 mm/h sin lluvia) no
+    cuentan como planas.
+    """
+    import numpy as np
+
+    valores = np.asarray(valores, dtype=float)
+    codigos = np.zeros(len(valores), dtype=np.uint16)
+    if len(valores) == 0:
+        return codigos
+
+    faltantes = np.isnan(valores)
+    codigos[faltantes] |= FALTANTE
+    with np.errstate(invalid="ignore"):
+        codigos[valores < 0] |= NEGATIVO
+
+        if umbral_pico is not None and len(valores) > 2:
+            salto_anterior = valores[1:-1] - valores[:-2]
+            salto_siguiente = valores[1:-1] - valores[2:]
+            picos = ((np.abs(salto_anterior) > umbral_pico) & (np.abs(salto_siguiente) > umbral_pico)
+                     & (np.sign(salto_anterior) == np.sign(salto_siguiente)))
+            codigos[1:-1][picos] |= PICO
+
+    if muestras_plano:
+        # Rachas de valores iguales consecutivos (NaN nunca es igual, así que corta la racha)
+        inicio_racha = np.ones(len(valores), dtype=bool)
+        inicio_racha[1:] = valores[1:] != valores[:-1]
+        racha = np.cumsum(inicio_racha) - 1
+        planos = np.bincount(racha)[racha] >= muestras_plano
+        planos &= ~faltantes & ~np.isin(valores, valores_planos_validos)
+        codigos[planos] |= PLANO
+
+    if fechas is not None and len(valores) > 1:
+        fechas = np.asarray(fechas, dtype="datetime64[ns]")
+        validas = ~np.isnat(fechas)
+        ambas_validas = validas[1:] & validas[:-1]
+        diferencias = np.diff(fechas)
+        codigos[1:][ambas_validas & (diferencias > np.timedelta64(paso_minutos, "m"))] |= HUECO
+        codigos[1:][ambas_validas & (diferencias <= np.timedelta64(0, "ns"))] |= DUPLICADO
+
+    return codigos
+
+
+def describir_calidad(codigo):
+    codigo = int(codigo)
+    if codigo == CALIDAD_OK:
+        return "ok"
+    return "|".join(nombre for bit, nombre in NOMBRES_CALIDAD.items() if codigo & bit)
+
+
+def resumen_calidad(codigos):
+    """Número de muestras con cada indicador activo."""
+    import numpy as np
+
+    codigos = np.asarray(codigos)
+    return {nombre: int(np.count_nonzero(codigos & bit)) for bit, nombre in NOMBRES_CALIDAD.items()}
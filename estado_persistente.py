@@ -0,0 +1,101 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+from datetime import datetime
+
+# Directorio de los puntos de control; con ENTORNOS_ESTADO="" no se guarda ni se restaura nada
+DIRECTORIO_ESTADO = os.environ.get("ENTORNOS_ESTADO", "estado")
+INTERVALO_PUNTO_CONTROL = 5.0
+
+_logger = logging.getLogger("estado_persistente")
+
+
+def ruta_estado(nombre, directorio=DIRECTORIO_ESTADO):
+    """Archivo de punto de control de un servicio, o None si están desactivados."""
+    if not directorio:
+        return None
+    return os.path.join(directorio, f"{nombre}.json")
+
+
+def a_texto(hora):
+    return None if hora is None else hora.isoformat()
+
+
+def de_texto(texto):
+    return None if texto is None else datetime.fromisoformat(texto)
+
+
+def guardar_estado(ruta, estado):
+    """Escritura atómica: o queda el punto de control anterior o el nuevo completo, nunca uno a medias."""
+    directorio = os.path.dirname(ruta)
+    if directorio:
+        os.makedirs(directorio, exist_ok=True)
+    # Un temporal por proceso e hilo: dos escrituras simultáneas no comparten archivo
+    temporal = f"{ruta}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temporal, "w", encoding="utf-8") as archivo:
+        json.dump({"guardado": datetime.now().astimezone().isoformat(), "estado": estado}, archivo,
+                  indent=2, ensure_ascii=False)
+        archivo.flush()
+        os.fsync(archivo.fileno())
+    os.replace(temporal, ruta)
+
+
+def cargar_estado(ruta):
+    """Estado guardado con guardar_estado, o None si no hay (o no se puede leer)."""
+    if not ruta:
+        return None
+    try:
+        with open(ruta, encoding="utf-8") as archivo:
+            datos = json.load(archivo)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        _logger.warning("Punto de control '%s' ilegible (%s); se arranca en frío", ruta, e)
+        return None
+    _logger.info("Estado restaurado de '%s' (guardado %s)", ruta, datos.get("guardado"))
+    return datos.get("estado")
+
+
+class PuntoControl:
+    """Guarda periódicamente el último estado recibido con actualizar().
+
+    actualizar() sólo guarda una referencia, así que se puede llamar en cada tick; la tarea
+    ejecutar() lo escribe en un hilo cada `intervalo` si ha cambiado, y cerrar() escribe el
+    último al apagar. Pensada para lanzarse como tarea: asyncio.create_task(punto.ejecutar()).
+    Cancelar la tarea no detiene un guardado que ya esté en su hilo; el cerrojo hace que
+    cerrar() espere a que termine en vez de escribir a la vez.
+    """
+
+    def __init__(self, ruta, intervalo=INTERVALO_PUNTO_CONTROL):
+        self.ruta = ruta
+        self.intervalo = intervalo
+        self.estado = None
+        self._guardado = None
+        self._cerrojo = threading.Lock()
+
+    def actualizar(self, estado):
+        self.estado = estado
+
+    def _guardar(self):
+        with self._cerrojo:
+            estado = self.estado
+            if self.ruta is None or estado is None or estado is self._guardado:
+                return
+            guardar_estado(self.ruta, estado)
+            self._guardado = estado
+
+    async def ejecutar(self):
+        while True:
+            await asyncio.sleep(self.intervalo)
+            try:
+                await asyncio.to_thread(self._guardar)
+            except (OSError, TypeError, ValueError) as e:
+                _logger.warning("No se pudo guardar el punto de control '%s': %s", self.ruta, e)
+
+    def cerrar(self):
+        try:
+            self._guardar()
+        except (OSError, TypeError, ValueError) as e:
+            _logger.warning("No se pudo guardar el punto de control '%s': %s", self.ruta, e)
@@ -0,0 +1,198 @@
+import csv
+import gzip
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+
+# Directorio de exportación; con ENTORNOS_EXPORTACION="" no se exporta nada
+DIRECTORIO_EXPORTACION = os.environ.get("ENTORNOS_EXPORTACION", "exportacion")
+CAPACIDAD_COLA = 10000
+# Filas por grupo de filas (Parquet) o por bloque comprimido (CSV)
+FILAS_POR_GRUPO = 1000
+# Un grupo incompleto se escribe igualmente pasado este tiempo
+INTERVALO_VOLCADO = 5.0
+ROTACION_SEGUNDOS = 3600
+ROTACION_BYTES = 64 * 1024 * 1024
+
+FORMATO_PARQUET = "parquet"
+FORMATO_CSV = "csv.gz"
+
+# Tipos de columna admitidos: "timestamp", "float64", "bool", "string"
+TIPOS_COLUMNA = ("timestamp", "float64", "bool", "string")
+
+_logger = logging.getLogger("exportador")
+
+
+def formato_disponible():
+    """Parquet si está instalado pyarrow; si no, CSV comprimido con gzip."""
+    try:
+        import pyarrow.parquet  # noqa: F401
+    except ImportError:
+        return FORMATO_CSV
+    return FORMATO_PARQUET
+
+
+class _EscritorParquet:
+    """Un grupo de filas por lote; el archivo sólo es legible una vez cerrado (pie de Parquet)."""
+
+    def __init__(self, ruta, columnas):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        tipos = {"timestamp": pa.timestamp("us", tz="UTC"), "float64": pa.float64(), "bool": pa.bool_(), "string": pa.string()}
+        self._pa = pa
+        self.esquema = pa.schema([(nombre, tipos[tipo]) for nombre, tipo in columnas])
+        self.escritor = pq.ParquetWriter(ruta, self.esquema, compression="zstd")
+
+    def escribir(self, lote):
+        columnas = list(zip(*lote))
+        tabla = self._pa.Table.from_arrays(
+            [self._pa.array(valores, type=campo.type) for valores, campo in zip(columnas, self.esquema)],
+            schema=self.esquema)
+        self.escritor.write_table(tabla)
+
+    def cerrar(self):
+        self.escritor.close()
+
+
+class _EscritorCSV:
+    """CSV con gzip; cada lote se vacía con un punto de sincronización de zlib."""
+
+    def __init__(self, ruta, columnas):
+        self.archivo = gzip.open(ruta, "wt", encoding="utf-8", newline="")
+        self.escritor = csv.writer(self.archivo)
+        self.escritor.writerow([nombre for nombre, _ in columnas])
+
+    def escribir(self, lote):
+        self.escritor.writerows(
+            ["" if valor is None else valor.isoformat() if isinstance(valor, datetime) else valor for valor in fila]
+            for fila in lote)
+        self.archivo.flush()
+
+    def cerrar(self):
+        self.archivo.close()
+
+
+class ExportadorColumnar:
+    """Exporta registros a archivos por columnas desde un hilo aparte.
+
+    exportar() sólo encola (put_nowait): si la cola está llena el registro se descarta y se
+    cuenta, pero el bucle de publicación nunca espera. El hilo escritor agrupa los registros
+    en lotes de `filas_por_grupo`, rota de archivo por tiempo o por tamaño y vacía lo
+    pendiente al cerrar. Los archivos se escriben con extensión .tmp y se renombran al
+    cerrarlos, así que todo archivo con su extensión final está completo.
+    """
+
+    def __init__(self, directorio, prefijo, columnas, formato=None, capacidad=CAPACIDAD_COLA,
+                 filas_por_grupo=FILAS_POR_GRUPO, intervalo_volcado=INTERVALO_VOLCADO,
+                 rotacion_segundos=ROTACION_SEGUNDOS, rotacion_bytes=ROTACION_BYTES):
+        for nombre, tipo in columnas:
+            if tipo not in TIPOS_COLUMNA:
+                raise ValueError(f"Tipo de columna desconocido '{tipo}' en '{nombre}'")
+        self.directorio = directorio
+        self.prefijo = prefijo
+        self.columnas = list(columnas)
+        self.formato = formato or formato_disponible()
+        self.filas_por_grupo = filas_por_grupo
+        self.intervalo_volcado = intervalo_volcado
+        self.rotacion_segundos = rotacion_segundos
+        self.rotacion_bytes = rotacion_bytes
+        self.cola = queue.Queue(maxsize=capacidad)
+        self.exportados = 0
+        self.descartados = 0
+        self.archivos = 0
+        self._parar = threading.Event()
+        self._hilo = None
+        self._escritor = None
+        self._ruta = None
+        self._apertura = 0.0
+
+    def iniciar(self):
+        os.makedirs(self.directorio, exist_ok=True)
+        self._hilo = threading.Thread(target=self._ejecutar, name=f"exportador-{self.prefijo}", daemon=True)
+        self._hilo.start()
+        _logger.info("Exportando %s a '%s' en formato %s", self.prefijo, self.directorio, self.formato)
+        return self
+
+    def exportar(self, registro):
+        try:
+            self.cola.put_nowait(registro)
+        except queue.Full:
+            self.descartados += 1
+            # Con la cola llena se descarta en ráfagas: se avisa sólo en 1, 2, 4, 8... descartes
+            if self.descartados & (self.descartados - 1) == 0:
+                _logger.warning("Cola de exportación llena: %d registros descartados", self.descartados)
+
+    def pendientes(self):
+        return self.cola.qsize()
+
+    def cerrar(self):
+        """Vacía la cola, escribe el último lote y cierra el archivo en curso (bloquea hasta terminar)."""
+        if self._hilo is None:
+            return
+        self._parar.set()
+        self._hilo.join()
+        self._hilo = None
+        _logger.info("Exportación de %s cerrada: %d registros en %d archivos, %d descartados",
+                     self.prefijo, self.exportados, self.archivos, self.descartados)
+
+    def _ejecutar(self):
+        lote = []
+        ultimo_volcado = time.monotonic()
+        try:
+            while not (self._parar.is_set() and self.cola.empty()):
+                try:
+                    lote.append(self.cola.get(timeout=min(self.intervalo_volcado, 0.5)))
+                except queue.Empty:
+                    pass
+                if len(lote) >= self.filas_por_grupo or (lote and time.monotonic() - ultimo_volcado >= self.intervalo_volcado):
+                    self._escribir(lote)
+                    lote = []
+                    ultimo_volcado = time.monotonic()
+            if lote:
+                self._escribir(lote)
+        except Exception:
+            _logger.exception("Error en el hilo de exportación de %s; se detiene la exportación", self.prefijo)
+        finally:
+            self._cerrar_archivo()
+
+    def _escribir(self, lote):
+        if self._escritor is not None and self._toca_rotar():
+            self._cerrar_archivo()
+        if self._escritor is None:
+            self._abrir_archivo()
+        self._escritor.escribir(lote)
+        self.exportados += len(lote)
+
+    def _toca_rotar(self):
+        if time.monotonic() - self._apertura >= self.rotacion_segundos:
+            return True
+        try:
+            return os.path.getsize(self._ruta) >= self.rotacion_bytes
+        except OSError:
+            return False
+
+    def _abrir_archivo(self):
+        marca = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+        self.archivos += 1
+        self._ruta = os.path.join(self.directorio, f"{self.prefijo}_{marca}_{self.archivos:04d}.{self.formato}.tmp")
+        clase = _EscritorParquet if self.formato == FORMATO_PARQUET else _EscritorCSV
+        self._escritor = clase(self._ruta, self.columnas)
+        self._apertura = time.monotonic()
+
+    def _cerrar_archivo(self):
+        if self._escritor is None:
+            return
+        self._escritor.cerrar()
+        os.replace(self._ruta, self._ruta[:-len(".tmp")])
+        self._escritor = None
+
+
+def crear_exportador(prefijo, columnas, directorio=DIRECTORIO_EXPORTACION, **opciones):
+    """ExportadorColumnar ya iniciado, o None si la exportación está desactivada."""
+    if not directorio:
+        return None
+    return ExportadorColumnar(directorio, prefijo, columnas, **opciones).iniciar()
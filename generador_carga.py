@@ -0,0 +1,202 @@
+import argparse
+import asyncio
+import math
+import time
+from datetime import datetime, timezone
+import numpy as np
+from asyncua import Server, Client, ua
+from perfiles_suscripcion import PerfilSuscripcion, crear_suscripcion, monitorizar
+
+URI = "http://www.epsa.upv.es/entornos"
+PUERTO_BASE = 4900
+PERIODO_SUSCRIPCION_MS = 100
+
+
+class GeneradorValores:
+    """Genera un valor por estación en cada actualización según la distribución elegida."""
+
+    def __init__(self, distribucion, estaciones, maximo, semilla=None):
+        self.distribucion = distribucion
+        self.estaciones = estaciones
+        self.maximo = maximo
+        self.rng = np.random.default_rng(semilla)
+        # Estado de tormenta por estación: intensidad actual de la ráfaga
+        self.rafaga = np.zeros(estaciones)
+
+    def siguientes(self):
+        if self.distribucion == "uniforme":
+            return self.rng.uniform(0.0, self.maximo, self.estaciones)
+        if self.distribucion == "normal":
+            valores = self.rng.normal(self.maximo / 2, self.maximo / 6, self.estaciones)
+            return np.clip(valores, 0.0, None)
+        # tormenta: llovizna de fondo y ráfagas que empiezan al azar y decaen
+        inicio = self.rng.random(self.estaciones) < 0.02
+        self.rafaga = self.rafaga * 0.9 + inicio * self.rng.exponential(self.maximo, self.estaciones)
+        return self.rng.exponential(self.maximo * 0.01, self.estaciones) + self.rafaga
+
+
+async def crear_servidor_carga(tipo, numero, puerto, estaciones):
+    servidor = Server()
+    await servidor.init()
+    endpoint = f"opc.tcp://localhost:{puerto}/es/upv/epsa/entornos/bla/{tipo}_{numero}/"
+    servidor.set_endpoint(endpoint)
+    idx = await servidor.register_namespace(URI)
+
+    variables = []
+    for estacion in range(estaciones):
+        if tipo == "pluviometro":
+            obj = await servidor.nodes.objects.add_object(idx, f"Pluviometro_{estacion:03d}")
+            valor = await obj.add_variable(idx, "Precipitaciones_mm_h", 0.0)
+            await obj.add_variable(idx, "Hora", "")
+        else:
+            obj = await servidor.nodes.objects.add_object(idx, f"EstacionAforo_{estacion:03d}")
+            valor = await obj.add_variable(idx, "Caudal_m3_s", 0.0)
+            await obj.add_variable(idx, "Estado", "Desconocido")
+            await obj.add_variable(idx, "Hora", "")
+        variables.append(valor)
+
+    await servidor.start()
+    return servidor, endpoint, variables
+
+
+async def publicar(variables, generador, tasa, fin, contadores):
+    intervalo = 1.0 / tasa
+    siguiente = time.monotonic()
+    while time.monotonic() < fin:
+        valores = generador.siguientes()
+        ahora = datetime.now(timezone.utc)
+        for variable, valor in zip(variables, valores):
+            # La marca de origen permite al consumidor medir el retraso de la notificación
+            await variable.write_value(ua.DataValue(ua.Variant(float(valor), ua.VariantType.Double), SourceTimestamp=ahora))
+        contadores["publicadas"] += len(variables)
+
+        siguiente += intervalo
+        espera = siguiente - time.monotonic()
+        if espera > 0:
+            await asyncio.sleep(espera)
+        else:
+            # No se alcanza la tasa pedida: se registra y se sigue sin acumular retraso
+            contadores["retrasos"] += 1
+            siguiente = time.monotonic()
+            await asyncio.sleep(0)
+
+
+class ManejadorMedicion:
+    def __init__(self):
+        self.recibidas = 0
+        self.retrasos = []
+        # Las notificaciones del valor inicial (anteriores a la carga) no cuentan
+        self.desde = None
+
+    def datachange_notification(self, node, val, data):
+        origen = data.monitored_item.Value.SourceTimestamp
+        if origen is None:
+            return
+        if origen.tzinfo is None:
+            origen = origen.replace(tzinfo=timezone.utc)
+        if self.desde is None or origen < self.desde:
+            return
+        self.recibidas += 1
+        self.retrasos.append((datetime.now(timezone.utc) - origen).total_seconds())
+
+
+async def suscribir_consumidor(endpoint, variables, tasa, manejador):
+    cliente = Client(endpoint)
+    await cliente.connect()
+    # Cola suficiente para no perder valores entre dos publicaciones de la suscripción
+    # (perfil propio: la prueba de carga mide al servidor, no a la configuración del despliegue)
+    cola = max(1, math.ceil(tasa * PERIODO_SUSCRIPCION_MS / 1000) + 1)
+    perfil = PerfilSuscripcion(PERIODO_SUSCRIPCION_MS, 0, cola, True, None, 0.0)
+    subscription = await crear_suscripcion(cliente, manejador, perfil)
+    await monitorizar(subscription, [cliente.get_node(variable.nodeid) for variable in variables], perfil)
+    return cliente
+
+
+def percentil(valores, p):
+    if not valores:
+        return math.nan
+    return float(np.percentile(valores, p))
+
+
+def informe(contadores, manejadores, duracion, estaciones_totales):
+    recibidas = sum(m.recibidas for m in manejadores)
+    retrasos = [r for m in manejadores for r in m.retrasos]
+    perdidas = max(0, contadores["publicadas"] - recibidas)
+    return {
+        "estaciones": estaciones_totales,
+        "duracion_s": round(duracion, 3),
+        "publicadas": contadores["publicadas"],
+        "recibidas": recibidas,
+        "perdidas": perdidas,
+        "perdidas_pct": round(100 * perdidas / contadores["publicadas"], 3) if contadores["publicadas"] else 0.0,
+        "tasa_publicacion": round(contadores["publicadas"] / duracion, 1),
+        "ciclos_retrasados": contadores["retrasos"],
+        "retraso_p50_ms": round(percentil(retrasos, 50) * 1000, 2),
+        "retraso_p99_ms": round(percentil(retrasos, 99) * 1000, 2),
+        "retraso_max_ms": round(max(retrasos) * 1000, 2) if retrasos else math.nan,
+    }
+
+
+async def ejecutar_carga(pluviometros, aforos, estaciones, tasa, distribucion, duracion, puerto_base=PUERTO_BASE, semilla=None):
+    servidores = []
+    clientes = []
+    manejadores = []
+    contadores = {"publicadas": 0, "retrasos": 0}
+    try:
+        tipos = ["pluviometro"] * pluviometros + ["aforo"] * aforos
+        for numero, tipo in enumerate(tipos):
+            servidor, endpoint, variables = await crear_servidor_carga(tipo, numero, puerto_base + numero, estaciones)
+            servidores.append((servidor, endpoint, variables, tipo))
+            print(f"Servidor de carga {tipo} con {estaciones} estaciones en {endpoint}")
+
+        for _, endpoint, variables, _ in servidores:
+            manejador = ManejadorMedicion()
+            clientes.append(await suscribir_consumidor(endpoint, variables, tasa, manejador))
+            manejadores.append(manejador)
+
+        # Se deja pasar la notificación inicial de cada variable antes de empezar
+        await asyncio.sleep(3 * PERIODO_SUSCRIPCION_MS / 1000)
+        desde = datetime.now(timezone.utc)
+        for manejador in manejadores:
+            manejador.desde = desde
+
+        inicio = time.monotonic()
+        fin = inicio + duracion
+        maximo = {"pluviometro": 50.0, "aforo": 150.0}
+        await asyncio.gather(*[
+            publicar(variables, GeneradorValores(distribucion, estaciones, maximo[tipo],
+                                                 None if semilla is None else semilla + n),
+                     tasa, fin, contadores)
+            for n, (_, _, variables, tipo) in enumerate(servidores)
+        ])
+        duracion_real = time.monotonic() - inicio
+        # Margen para que lleguen las últimas notificaciones antes de contar pérdidas
+        await asyncio.sleep(3 * PERIODO_SUSCRIPCION_MS / 1000)
+        return informe(contadores, manejadores, duracion_real, len(servidores) * estaciones)
+    finally:
+        for cliente in clientes:
+            await cliente.disconnect()
+        for servidor, *_ in servidores:
+            await servidor.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generador de carga sintética para servidores OPC UA de estaciones.")
+    parser.add_argument("--pluviometros", type=int, default=1, help="Número de servidores de pluviómetros")
+    parser.add_argument("--aforos", type=int, default=1, help="Número de servidores de aforo")
+    parser.add_argument("--estaciones", type=int, default=100, help="Estaciones por servidor")
+    parser.add_argument("--tasa", type=float, default=10.0, help="Actualizaciones por estación y segundo")
+    parser.add_argument("--distribucion", choices=["uniforme", "normal", "tormenta"], default="tormenta")
+    parser.add_argument("--duracion", type=float, default=10.0, help="Segundos de carga")
+    parser.add_argument("--puerto-base", type=int, default=PUERTO_BASE)
+    parser.add_argument("--semilla", type=int, default=None)
+    args = parser.parse_args()
+
+    resultado = asyncio.run(ejecutar_carga(args.pluviometros, args.aforos, args.estaciones, args.tasa,
+                                           args.distribucion, args.duracion, args.puerto_base, args.semilla))
+    for clave, valor in resultado.items():
+        print(f"{clave}: {valor}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+import argparse
+import asyncio
+import math
+import struct
+import time
+from datetime import datetime, timezone
+from asyncua import ua
+from conexiones import GESTOR
+from perfiles_suscripcion import obtener_perfil
+from resolucion_nodos import resolver_nodos
+
+URL_SERVIDOR_TEMPORAL = "opc.tcp://localhost:4840/es/upv/epsa/entornos/bla/temporal/"
+URL_SERVIDOR_PLUVIOMETRO = "opc.tcp://localhost:4841/es/upv/epsa/entornos/bla/pluviometro/"
+URL_SERVIDOR_AFORO = "opc.tcp://localhost:4842/es/upv/epsa/entornos/bla/estacion_aforo/"
+URI_TEMPORAL = "http://www.epsa.upv.es/entornos/temporal"
+URI_ESTACIONES = "http://www.epsa.upv.es/entornos"
+ARCHIVO_REGISTRO = "registro_opcua.bin"
+INTERVALO_VOLCADO = 1.0
+
+# Disposición de nodos grabada: (servidor, endpoint, uri, objeto, variables).
+# El orden es el mismo en el que los servidores crean sus nodos, así el
+# reproductor genera los mismos NodeId numéricos (ns=2;i=2, ...).
+DISPOSICION = [
+    ("temporal", URL_SERVIDOR_TEMPORAL, URI_TEMPORAL, "HoraSimulada", ["HoraSimulada"]),
+    ("pluviometro", URL_SERVIDOR_PLUVIOMETRO, URI_ESTACIONES, "Pluviometro", ["Precipitaciones_mm_h", "Hora"]),
+    ("aforo", URL_SERVIDOR_AFORO, URI_ESTACIONES, "EstacionAforo", ["Caudal_m3_s", "Estado", "Hora"]),
+]
+
+# Formato del registro binario:
+#   cabecera MAGICO
+#   registros: <tipo:B> ...
+#     TIPO_CANAL: <canal:H> <tipo_valor:B> <longitud:H> nombre utf-8 ("servidor/Objeto/Variable")
+#     TIPO_MUESTRA: <hora_real:d> <hora_simulada:d> <canal:H> <tipo_valor:B> valor
+# Las horas son segundos POSIX; la hora simulada es NaN hasta recibir la primera.
+MAGICO = b"ENTREC1\n"
+TIPO_CANAL = 0
+TIPO_MUESTRA = 1
+
+VALOR_DOUBLE = 1
+VALOR_STRING = 2
+VALOR_DATETIME = 3
+VALOR_BOOLEAN = 4
+VALOR_INT64 = 5
+# Canales a los que se aplica la banda muerta del perfil de suscripción
+VALORES_NUMERICOS = (VALOR_DOUBLE, VALOR_INT64)
+
+VARIANT_POR_TIPO = {
+    VALOR_DOUBLE: ua.VariantType.Double,
+    VALOR_STRING: ua.VariantType.String,
+    VALOR_DATETIME: ua.VariantType.DateTime,
+    VALOR_BOOLEAN: ua.VariantType.Boolean,
+    VALOR_INT64: ua.VariantType.Int64,
+}
+
+_CABECERA_CANAL = struct.Struct("<BHBH")
+_CABECERA_MUESTRA = struct.Struct("<BddHB")
+_DOUBLE = struct.Struct("<d")
+_INT64 = struct.Struct("<q")
+_LONGITUD = struct.Struct("<H")
+
+
+def a_segundos(hora):
+    if hora.tzinfo is None:
+        hora = hora.replace(tzinfo=timezone.utc)
+    return hora.timestamp()
+
+
+def tipo_de_valor(valor):
+    if isinstance(valor, bool):
+        return VALOR_BOOLEAN
+    if isinstance(valor, datetime):
+        return VALOR_DATETIME
+    if isinstance(valor, int):
+        return VALOR_INT64
+    if isinstance(valor, float):
+        return VALOR_DOUBLE
+    return VALOR_STRING
+
+
+def codificar_valor(tipo, valor):
+    if tipo == VALOR_DOUBLE:
+        return _DOUBLE.pack(float(valor))
+    if tipo == VALOR_DATETIME:
+        return _DOUBLE.pack(a_segundos(valor))
+    if tipo == VALOR_BOOLEAN:
+        return b"\x01" if valor else b"\x00"
+    if tipo == VALOR_INT64:
+        return _INT64.pack(int(valor))
+    datos = str(valor).encode("utf-8")
+    return _LONGITUD.pack(len(datos)) + datos
+
+
+def _leer_exacto(archivo, n):
+    datos = archivo.read(n)
+    if len(datos) < n:
+        raise EOFError
+    return datos
+
+
+def decodificar_valor(tipo, archivo):
+    if tipo == VALOR_DOUBLE:
+        return _DOUBLE.unpack(_leer_exacto(archivo, 8))[0]
+    if tipo == VALOR_DATETIME:
+        segundos = _DOUBLE.unpack(_leer_exacto(archivo, 8))[0]
+        return datetime.fromtimestamp(segundos, timezone.utc)
+    if tipo == VALOR_BOOLEAN:
+        return _leer_exacto(archivo, 1) != b"\x00"
+    if tipo == VALOR_INT64:
+        return _INT64.unpack(_leer_exacto(archivo, 8))[0]
+    longitud = _LONGITUD.unpack(_leer_exacto(archivo, 2))[0]
+    return _leer_exacto(archivo, longitud).decode("utf-8")
+
+
+class EscritorRegistro:
+    def __init__(self, ruta):
+        self.archivo = open(ruta, "wb")
+        self.archivo.write(MAGICO)
+        self.canales = {}
+        self.tipos = {}
+        self.hora_simulada = math.nan
+        self.muestras = 0
+
+    def definir_canal(self, nombre, tipo):
+        canal = len(self.canales)
+        datos = nombre.encode("utf-8")
+        self.archivo.write(_CABECERA_CANAL.pack(TIPO_CANAL, canal, tipo, len(datos)) + datos)
+        self.canales[nombre] = canal
+        self.tipos[canal] = tipo
+        return canal
+
+    def escribir_muestra(self, canal, valor, hora_real=None):
+        if hora_real is None:
+            hora_real = time.time()
+        tipo = self.tipos[canal]
+        if tipo == VALOR_DATETIME and canal == 0:
+            # El canal 0 es la hora del servidor temporal: marca la hora simulada
+            self.hora_simulada = a_segundos(valor)
+        self.archivo.write(_CABECERA_MUESTRA.pack(TIPO_MUESTRA, hora_real, self.hora_simulada, canal, tipo))
+        self.archivo.write(codificar_valor(tipo, valor))
+        self.muestras += 1
+
+    def volcar(self):
+        self.archivo.flush()
+
+    def cerrar(self):
+        self.archivo.close()
+
+
+def leer_registro(ruta):
+    """Devuelve (canales, muestras); las muestras se generan de forma perezosa."""
+    archivo = open(ruta, "rb")
+    if archivo.read(len(MAGICO)) != MAGICO:
+        archivo.close()
+        raise ValueError(f"'{ruta}' no es un registro OPC UA válido.")
+
+    canales = []
+    # Las definiciones de canal se escriben todas al principio del registro
+    while True:
+        posicion = archivo.tell()
+        tipo_registro = archivo.read(1)
+        if tipo_registro != bytes([TIPO_CANAL]):
+            archivo.seek(posicion)
+            break
+        canal, tipo, longitud = _CABECERA_CANAL.unpack(tipo_registro + _leer_exacto(archivo, _CABECERA_CANAL.size - 1))[1:]
+        nombre = _leer_exacto(archivo, longitud).decode("utf-8")
+        canales.append((canal, nombre, tipo))
+
+    def muestras():
+        with archivo:
+            while True:
+                cabecera = archivo.read(_CABECERA_MUESTRA.size)
+                if len(cabecera) < _CABECERA_MUESTRA.size:
+                    return
+                _, hora_real, hora_simulada, canal, tipo = _CABECERA_MUESTRA.unpack(cabecera)
+                try:
+                    valor = decodificar_valor(tipo, archivo)
+                except EOFError:
+                    # Registro truncado (p. ej. grabador detenido a mitad de escritura)
+                    return
+                yield hora_real, hora_simulada, canal, valor
+
+    return canales, muestras()
+
+
+class ManejadorGrabacion:
+    def __init__(self, escritor, canales_por_nodo):
+        self.escritor = escritor
+        self.canales_por_nodo = canales_por_nodo
+
+    def datachange_notification(self, node, val, data):
+        canal = self.canales_por_nodo.get(node.nodeid)
+        if canal is not None:
+            self.escritor.escribir_muestra(canal, val)
+
+
+async def preparar_servidor(escritor, servidor, endpoint, uri, objeto, variables):
+    conexion = await GESTOR.obtener(endpoint)
+    nodos = await resolver_nodos(conexion.cliente, uri, [f"{objeto}/{variable}" for variable in variables])
+
+    canales_por_nodo = {}
+    for variable in variables:
+        nodo = nodos[f"{objeto}/{variable}"]
+        valor = await nodo.read_value()
+        tipo = tipo_de_valor(valor)
+        canal = escritor.definir_canal(f"{servidor}/{objeto}/{variable}", tipo)
+        canales_por_nodo[nodo.nodeid] = (canal, nodo, tipo in VALORES_NUMERICOS)
+    print(f"Grabando {len(variables)} variables de {endpoint}")
+    return conexion, canales_por_nodo
+
+
+async def grabar(ruta, duracion=None):
+    escritor = EscritorRegistro(ruta)
+    try:
+        preparados = []
+        for servidor, endpoint, uri, objeto, variables in DISPOSICION:
+            conexion, canales_por_nodo = await preparar_servidor(escritor, servidor, endpoint, uri, objeto, variables)
+            preparados.append((conexion, canales_por_nodo))
+
+        # Las suscripciones se crean cuando todos los canales están definidos; las gestiona
+        # la conexión, así que se restauran solas si algún servidor se reinicia. Los nodos
+        # numéricos y los demás van en suscripciones distintas: sólo a los primeros se les
+        # puede aplicar banda muerta.
+        perfil = obtener_perfil()
+        for conexion, canales_por_nodo in preparados:
+            handler = ManejadorGrabacion(escritor, {nodeid: canal for nodeid, (canal, _, _) in canales_por_nodo.items()})
+            for numericos in (True, False):
+                nodos = [nodo for _, nodo, numerico in canales_por_nodo.values() if numerico == numericos]
+                if nodos:
+                    await conexion.suscribir(handler, nodos, perfil, banda_muerta=numericos)
+
+        inicio = time.monotonic()
+        while duracion is None or time.monotonic() - inicio < duracion:
+            await asyncio.sleep(INTERVALO_VOLCADO)
+            escritor.volcar()
+    finally:
+        await GESTOR.cerrar()
+        escritor.cerrar()
+        print(f"Grabación finalizada: {escritor.muestras} muestras en {ruta}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Graba las notificaciones de los servidores temporal, pluviómetro y aforo.")
+    parser.add_argument("archivo", nargs="?", default=ARCHIVO_REGISTRO)
+    parser.add_argument("--duracion", type=float, default=None, help="Segundos de grabación (por defecto, hasta Ctrl+C)")
+    args = parser.parse_args()
+    try:
+        asyncio.run(grabar(args.archivo, args.duracion))
+    except KeyboardInterrupt:
+        print("Grabación detenida por el usuario.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+import asyncio
+import collections
+import logging
+import threading
+import numpy as np
+from conexiones import ERRORES_CONEXION, GESTOR
+from resolucion_nodos import resolver_nodos
+
+URL_INTEGRACION = "opc.tcp://localhost:4850/integracion"
+URI_INTEGRACION = "http://www.epsa.upv.es/entornos/integracion"
+RUTAS_INTEGRACION = [
+    "Integracion/Precipitaciones_mm_h", "Integracion/Caudal_m3_s",
+    "Integracion/HoraSimulada", "Integracion/EstadoAlerta",
+]
+# Segundos entre lecturas del servidor de integración
+INTERVALO_MUESTREO = 2.0
+PUNTOS_TIEMPO_REAL = 10
+# Con una muestra cada 2 s, algo más de dos días de histórico
+PUNTOS_HISTORICO = 100000
+
+_logger = logging.getLogger("panel")
+
+
+class Instantanea(collections.namedtuple("Instantanea", [
+        "version", "precipitacion", "caudal", "hora_simulada", "estado_alerta", "alerta_desde", "activaciones",
+        "primera_muestra", "precipitaciones", "caudales"])):
+    """Copia inmutable del modelo: se puede dibujar desde otro hilo sin bloquear al que lo alimenta."""
+
+    __slots__ = ()
+
+    def muestras(self):
+        return range(self.primera_muestra, self.primera_muestra + len(self.precipitaciones))
+
+    def tiempo_real(self, puntos=PUNTOS_TIEMPO_REAL):
+        """(muestras, precipitaciones, caudales) de las últimas `puntos` muestras."""
+        return self.muestras()[-puntos:], self.precipitaciones[-puntos:], self.caudales[-puntos:]
+
+
+class ModeloPanel:
+    """Lado de datos del panel: últimos valores, histórico acotado y estado de la alerta.
+
+    No depende de Tk ni de matplotlib. actualizar() e instantanea() se pueden llamar desde
+    hilos distintos (el del cliente OPC UA y el de la interfaz o el renderizador); `version`
+    cambia con cada muestra y se puede leer sin el candado, así quien dibuja sabe si hay algo
+    nuevo antes de pedir una instantánea, que copia todo el histórico.
+    """
+
+    def __init__(self, puntos_historico=PUNTOS_HISTORICO):
+        self._candado = threading.Lock()
+        self.version = 0
+        self.precipitacion = 0.0
+        self.caudal = 0.0
+        self.hora_simulada = ""
+        self.estado_alerta = False
+        # Hora simulada en que se activó la alerta en curso, y cuántas veces se ha activado
+        self.alerta_desde = None
+        self.activaciones = 0
+        self.muestras = 0
+        self.precipitaciones = collections.deque(maxlen=puntos_historico)
+        self.caudales = collections.deque(maxlen=puntos_historico)
+
+    def actualizar(self, precipitacion, caudal, hora_simulada, estado_alerta):
+        with self._candado:
+            if estado_alerta and not self.estado_alerta:
+                self.activaciones += 1
+                self.alerta_desde = hora_simulada
+            elif not estado_alerta:
+                self.alerta_desde = None
+            self.precipitacion = precipitacion
+            self.caudal = caudal
+            self.hora_simulada = hora_simulada
+            self.estado_alerta = bool(estado_alerta)
+            self.precipitaciones.append(precipitacion)
+            self.caudales.append(caudal)
+            self.muestras += 1
+            self.version += 1
+
+    def instantanea(self):
+        with self._candado:
+            return Instantanea(self.version, self.precipitacion, self.caudal, self.hora_simulada, self.estado_alerta,
+                               self.alerta_desde, self.activaciones, self.muestras - len(self.precipitaciones),
+                               list(self.precipitaciones), list(self.caudales))
+
+
+def diezmar(muestras, valores, columnas):
+    """Reduce una serie a su mínimo y su máximo por cada una de `columnas` columnas de píxeles.
+
+    Más puntos que píxeles no cambian la imagen pero sí el coste de dibujarla; quedarse con los
+    extremos de cada columna, en su orden, conserva los picos visibles.
+    """
+    total = len(valores)
+    paso = -(-total // max(1, columnas))
+    if paso <= 2:
+        return muestras, valores
+    completos = total - total % paso
+    serie = np.asarray(valores, dtype=float)
+    bloques = serie[:completos].reshape(-1, paso)
+    extremos = np.sort(np.stack([bloques.argmin(axis=1), bloques.argmax(axis=1)], axis=1), axis=1)
+    indices = np.concatenate([(extremos + np.arange(0, completos, paso)[:, None]).ravel(),
+                              np.arange(completos, total)])
+    return muestras[0] + indices, serie[indices]
+
+
+async def alimentar_modelo(modelo, url=URL_INTEGRACION, intervalo=INTERVALO_MUESTREO):
+    """Lee los cuatro valores del servidor de integración en una sola petición cada `intervalo`."""
+    # Sesión compartida: si el servidor se reinicia, el gestor reconecta y los nodos siguen valiendo
+    conexion = await GESTOR.obtener(url)
+    try:
+        resueltos = await resolver_nodos(conexion.cliente, URI_INTEGRACION, RUTAS_INTEGRACION)
+        nodos = [resueltos[ruta] for ruta in RUTAS_INTEGRACION]
+        while True:
+            try:
+                modelo.actualizar(*await conexion.cliente.read_values(nodos))
+            except ERRORES_CONEXION as e:
+                _logger.warning("Sin conexión con el servidor de integración: %s", e)
+            await asyncio.sleep(intervalo)
+    finally:
+        await GESTOR.liberar(url)
+
+
+def iniciar_alimentacion(modelo, url=URL_INTEGRACION, intervalo=INTERVALO_MUESTREO):
+    """Alimenta el modelo desde un hilo aparte con su propio bucle de eventos (para interfaces Tk)."""
+    hilo = threading.Thread(target=lambda: asyncio.run(alimentar_modelo(modelo, url, intervalo)),
+                            name="cliente-opcua", daemon=True)
+    hilo.start()
+    return hilo
@@ -1,20 +1,37 @@
 import time
-import pandas as pd
 import math
 import asyncio
-from asyncua import Server, Client
+import logging
+from asyncua import Server
+from carga_streaming import agregar_estado_carga, cargar_en_segundo_plano
+from conexiones import ERRORES_CONEXION, GESTOR
+from perfilado import configurar_logging
+from resolucion_nodos import resolver_nodos
+
+_logger = logging.getLogger("pluviometro")
 
 # Ruta del archivo Excel
 archivo_excel = r"/home/alopalm/entornos/trabajo_final/Pluvi_metroChiva_29octubre2024.xlsx"
 
-# Leer las columnas A (hora) y B (precipitaciones) desde la fila 8
-df = pd.read_excel(archivo_excel, usecols=[0, 1], skiprows=7, nrows=289, engine='openpyxl')
+def cargar_datos(ruta_excel):
+    """Lee el Excel del pluviómetro (se ejecuta en un hilo, con el servidor ya iniciado)."""
+    import pandas as pd
+
+    # Leer las columnas A (hora) y B (precipitaciones) desde la fila 8
+    df = pd.read_excel(ruta_excel, usecols=[0, 1], skiprows=7, nrows=289, engine='openpyxl')
+
+    # Convertir la columna B (precipitaciones) en una lista de valores numéricos; las celdas
+    # vacías quedan como NaN en su posición para que el índice siga siendo el de la fila de df
+    precipitaciones_lista = pd.to_numeric(df.iloc[:, 1], errors='coerce').tolist()
 
-# Convertir la columna B (precipitaciones) en una lista de valores numéricos
-precipitaciones_lista = pd.to_numeric(df.iloc[:, 1], errors='coerce').dropna().tolist()
+    # Redondear los valores de precipitaciones hacia arriba y mantener solo un decimal
+    precipitaciones_lista = [valor if math.isnan(valor) else round(math.ceil(valor * 10) / 10, 1)
+                             for valor in precipitaciones_lista]
 
-# Redondear los valores de precipitaciones hacia arriba y mantener solo un decimal
-precipitaciones_lista = [round(math.ceil(valor * 10) / 10, 1) for valor in precipitaciones_lista]
+    # Hora del día de cada fila (al minuto), convertida aquí una vez; None si la celda no es una hora
+    horas = pd.to_datetime(df.iloc[:, 0], errors='coerce').dt.floor('min')
+    horas_lista = [None if pd.isna(hora) else hora.time() for hora in horas]
+    return horas_lista, precipitaciones_lista
 
 # Crear el servidor OPC UA para el pluviómetro
 servidor = Server()
@@ -37,34 +54,46 @@ async def iniciar_servidor():
     hora_variable = await pluviometro.add_variable(idx, "Hora", "")
     await hora_variable.set_writable()  # Permitir que los clientes modifiquen el valor
 
+    # Crear una variable con el estado de la carga de datos ("Cargando" hasta que estén listos)
+    estado_carga = await agregar_estado_carga(pluviometro, idx)
+
     # Iniciar el servidor
     await servidor.start()
-    print("Servidor OPC UA del Pluviómetro iniciado en:")
-    print(servidor.endpoint)
+    _logger.info("Servidor OPC UA del Pluviómetro iniciado en: %s", servidor.endpoint)
 
-    return precipitaciones, hora_variable
+    return precipitaciones, hora_variable, estado_carga
 
 # URL del servidor temporal al cual nos conectaremos como cliente
 url_servidor_temporal = "opc.tcp://localhost:4840/es/upv/epsa/entornos/bla/temporal/"
 
 # Conectar como cliente al servidor temporal
 async def main():
-    precipitaciones, hora_variable = await iniciar_servidor()
-    client_temporal = Client(url_servidor_temporal)
+    configurar_logging()
+    precipitaciones, hora_variable, estado_carga = await iniciar_servidor()
 
     try:
-        # Conectar al servidor temporal
-        await client_temporal.connect()
-        print("Conectado al servidor temporal en:", url_servidor_temporal)
-
-        # Obtener el nodo de la hora simulada
-        nodo_hora_simulada = client_temporal.get_node("ns=2;i=2")
-        print("Nodo de hora simulada obtenido:", nodo_hora_simulada)
+        # El servidor ya acepta conexiones; los datos se cargan en un hilo aparte
+        horas_lista, precipitaciones_lista = await cargar_en_segundo_plano(estado_carga, cargar_datos, archivo_excel)
+        # Conectar al servidor temporal con una sesión gestionada: si se reinicia, el gestor
+        # reconecta por debajo y el nodo sigue valiendo
+        conexion = await GESTOR.obtener(url_servidor_temporal)
+        _logger.info("Conectado al servidor temporal en: %s", url_servidor_temporal)
+
+        # Obtener el nodo de la hora simulada por su ruta
+        nodos = await resolver_nodos(conexion.cliente, "http://www.epsa.upv.es/entornos/temporal", ["HoraSimulada/HoraSimulada"])
+        nodo_hora_simulada = nodos["HoraSimulada/HoraSimulada"]
+        _logger.info("Nodo de hora simulada obtenido: %s", nodo_hora_simulada)
 
         while True:
             # Leer la hora simulada del servidor temporal
-            hora_simulada = await nodo_hora_simulada.read_value()
-            print(f"Hora simulada leída: {hora_simulada}")
+            try:
+                hora_simulada = await nodo_hora_simulada.read_value()
+            except ERRORES_CONEXION as e:
+                # Se reintenta en el siguiente ciclo
+                _logger.warning("Sin conexión con el servidor temporal: %s", e)
+                await asyncio.sleep(1)
+                continue
+            _logger.debug("Hora simulada leída: %s", hora_simulada)
 
             # Eliminar la zona horaria de la hora simulada (si la tiene)
             hora_simulada = hora_simulada.replace(tzinfo=None)
@@ -72,41 +101,36 @@ async def main():
 
             # Buscar el valor de precipitaciones correspondiente en el DataFrame
             encontrado = False
-            for i, fila in df.iterrows():
-                hora_fila = fila.iloc[0]
-                # Convertir la hora del DataFrame a datetime para comparar
-                if isinstance(hora_fila, pd.Timestamp):
-                    hora_fila = hora_fila.replace(second=0, microsecond=0)  
-                else:
-                    hora_fila = pd.to_datetime(hora_fila).replace(second=0, microsecond=0)
-
-                        
-                if hora_fila.time() == hora_simulada.time():
+            for i, hora_fila in enumerate(horas_lista):
+                if hora_fila == hora_simulada.time():
                     valor_precipitacion = precipitaciones_lista[i]
+                    if math.isnan(valor_precipitacion):
+                        _logger.warning("Dato de precipitaciones faltante para la hora simulada: %s", hora_simulada)
+                        encontrado = True
+                        break
 
                     # Asignar los valores al servidor del pluviómetro
                     await precipitaciones.write_value(valor_precipitacion)
                     await hora_variable.write_value(hora_simulada.strftime('%H:%M:%S'))
 
-                    print(f"Actualizando precipitaciones a: {valor_precipitacion} mm/h")
-                    print(f"Hora actualizada a: {hora_simulada.strftime('%H:%M:%S')}")
+                    _logger.debug("Actualizando precipitaciones a: %s mm/h, hora: %s", valor_precipitacion, hora_simulada)
                     
                     encontrado = True
                     break
 
             if not encontrado:
-                print("No se encontró una coincidencia para la hora simulada.")
+                _logger.warning("No se encontró una coincidencia para la hora simulada.")
 
             # Esperar un segundo antes de volver a leer la hora simulada
             await asyncio.sleep(1)
 
     except KeyboardInterrupt:
-        print("Servidor detenido.")
+        _logger.info("Servidor detenido.")
     finally:
-        # Desconectar el cliente y detener el servidor
-        await client_temporal.disconnect()
+        # Cerrar la sesión con el servidor temporal y detener el servidor
+        await GESTOR.cerrar()
         await servidor.stop()
-        print("Servidor del Pluviómetro detenido.")
+        _logger.info("Servidor del Pluviómetro detenido.")
 
 # Ejecutar la función principal
 if __name__ == "__main__":
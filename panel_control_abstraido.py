@@ -1,87 +1,48 @@
 import tkinter as tk
 from tkinter import ttk
-import asyncio
-from asyncua import Client
-import matplotlib.pyplot as plt
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-import threading
-
-async def obtener_datos_opcua():
-    url_integracion = "opc.tcp://localhost:4850/integracion"
-
-    async with Client(url_integracion) as client_integracion:
-        nodos = {
-            'precipitaciones': client_integracion.get_node("ns=2;i=2"),
-            'caudal': client_integracion.get_node("ns=2;i=3"),
-            'hora_simulada': client_integracion.get_node("ns=2;i=4"),
-            'estado_alerta': client_integracion.get_node("ns=2;i=5")
-        }
-
-        while True:
-            datos = await leer_datos(nodos)
-            actualizar_interfaz(**datos)
-            await asyncio.sleep(2)
-
-async def leer_datos(nodos):
-    precipitacion = await nodos['precipitaciones'].read_value()
-    caudal = await nodos['caudal'].read_value()
-    hora_simulada = await nodos['hora_simulada'].read_value()
-    estado_alerta = await nodos['estado_alerta'].read_value()
-
-    return {
-        'precipitacion': precipitacion,
-        'caudal': caudal,
-        'hora_simulada': hora_simulada,
-        'estado_alerta': estado_alerta
-    }
-
-def actualizar_interfaz(precipitacion, caudal, hora_simulada, estado_alerta):
-    label_precipitacion.config(text=f"Precipitaciones: {precipitacion} mm/h")
-    label_caudal.config(text=f"Caudal: {caudal} m\u00b3/s")
-    label_hora_simulada.config(text=f"Hora Simulada: {hora_simulada}")
-    
-    estado_alerta_str = "Alerta" if estado_alerta else "No Alerta"
-    label_estado_alerta.config(text=f"Estado de Alerta: {estado_alerta_str}")
-
-    alerta_color = "red" if estado_alerta else "green"
-    canvas_alerta.itemconfig(circle_alerta, fill=alerta_color)
-
-    update_realtime_graph(precipitacion, caudal)
-    update_historical_graph(precipitacion, caudal)
-
-def update_realtime_graph(precipitacion, caudal):
-    x_data.append(len(x_data))
-    y_precipitacion_data.append(precipitacion)
-    y_caudal_data.append(caudal)
-
-    if len(x_data) > 10:
-        x_data.pop(0)
-        y_precipitacion_data.pop(0)
-        y_caudal_data.pop(0)
-
-    ax_realtime.clear()
-    ax_realtime.plot(x_data, y_precipitacion_data, label="Precipitaciones")
-    ax_realtime.plot(x_data, y_caudal_data, label="Caudal", linestyle="--")
-    ax_realtime.legend(loc="upper left")
-    ax_realtime.set_title("Datos en Tiempo Real")
-    ax_realtime.set_xlabel("Tiempo (s)")
-    ax_realtime.set_ylabel("Valor")
-    
-    canvas_realtime.draw()
-
-def update_historical_graph(precipitacion, caudal):
-    historical_precipitacion.append(precipitacion)
-    historical_caudal.append(caudal)
-
-    ax_historical.clear()
-    ax_historical.plot(range(len(historical_precipitacion)), historical_precipitacion, label="Precipitaciones")
-    ax_historical.plot(range(len(historical_caudal)), historical_caudal, label="Caudal", linestyle="--")
-    ax_historical.legend(loc="upper left")
-    ax_historical.set_title("Datos Históricos")
-    ax_historical.set_xlabel("Tiempo (mediciones)")
-    ax_historical.set_ylabel("Valor")
-    
-    canvas_historical.draw()
+from matplotlib.figure import Figure
+from modelo_panel import PUNTOS_TIEMPO_REAL, ModeloPanel, diezmar, iniciar_alimentacion
+
+INTERVALO_REFRESCO_MS = 500
+
+def actualizar_interfaz(widgets, instantanea):
+    widgets['precipitacion'].config(text=f"Precipitaciones: {instantanea.precipitacion} mm/h")
+    widgets['caudal'].config(text=f"Caudal: {instantanea.caudal} m³/s")
+    widgets['hora_simulada'].config(text=f"Hora Simulada: {instantanea.hora_simulada}")
+
+    estado_alerta_str = "Alerta" if instantanea.estado_alerta else "No Alerta"
+    widgets['estado_alerta'].config(text=f"Estado de Alerta: {estado_alerta_str}")
+
+    alerta_color = "red" if instantanea.estado_alerta else "green"
+    widgets['canvas_alerta'].itemconfig(widgets['circulo_alerta'], fill=alerta_color)
+
+    actualizar_grafico(widgets['tiempo_real'], *instantanea.tiempo_real(PUNTOS_TIEMPO_REAL))
+    actualizar_grafico(widgets['historico'], instantanea.muestras(), instantanea.precipitaciones, instantanea.caudales)
+
+def actualizar_grafico(grafico, muestras, precipitaciones, caudales):
+    ax, canvas, (linea_precipitacion, linea_caudal) = grafico
+    columnas = int(ax.bbox.width)
+    linea_precipitacion.set_data(*diezmar(muestras, precipitaciones, columnas))
+    linea_caudal.set_data(*diezmar(muestras, caudales, columnas))
+    ax.relim()
+    ax.autoscale_view()
+    canvas.draw_idle()
+
+def crear_grafico(root, fila, titulo):
+    figura = Figure(figsize=(5, 3))
+    ax = figura.add_subplot()
+    lineas = (ax.plot([], [], label="Precipitaciones")[0],
+              ax.plot([], [], label="Caudal", linestyle="--")[0])
+    ax.legend(loc="upper left")
+    ax.set_title(titulo)
+    ax.set_xlabel("Tiempo (mediciones)")
+    ax.set_ylabel("Valor")
+    figura.tight_layout()
+
+    canvas = FigureCanvasTkAgg(figura, master=root)
+    canvas.get_tk_widget().grid(row=fila, column=0, padx=10, pady=10)
+    return ax, canvas, lineas
 
 def crear_ventana_principal():
     root = tk.Tk()
@@ -90,49 +51,40 @@ def crear_ventana_principal():
     frame = ttk.Frame(root, padding="10")
     frame.grid(row=0, column=0, sticky="nsew")
 
-    global label_precipitacion, label_caudal, label_hora_simulada, label_estado_alerta
-    label_precipitacion = ttk.Label(frame, text="Precipitaciones: 0.0 mm/h", font=("Arial", 14))
-    label_precipitacion.grid(row=0, column=0, padx=10, pady=10)
-
-    label_caudal = ttk.Label(frame, text="Caudal: 0.0 m\u00b3/s", font=("Arial", 14))
-    label_caudal.grid(row=1, column=0, padx=10, pady=10)
-
-    label_hora_simulada = ttk.Label(frame, text="Hora Simulada: ", font=("Arial", 14))
-    label_hora_simulada.grid(row=2, column=0, padx=10, pady=10)
-
-    label_estado_alerta = ttk.Label(frame, text="Estado de Alerta: No Alerta", font=("Arial", 14))
-    label_estado_alerta.grid(row=3, column=0, padx=10, pady=10)
-
-    global canvas_alerta, circle_alerta
-    canvas_alerta = tk.Canvas(frame, width=50, height=50)
-    canvas_alerta.grid(row=4, column=0, padx=10, pady=10)
-    circle_alerta = canvas_alerta.create_oval(10, 10, 40, 40, fill="green")
-
-    global ax_realtime, ax_historical, canvas_realtime, canvas_historical
-    fig_realtime, ax_realtime = plt.subplots(figsize=(5, 3))
-    fig_historical, ax_historical = plt.subplots(figsize=(5, 3))
-
-    global x_data, y_precipitacion_data, y_caudal_data, historical_precipitacion, historical_caudal
-    x_data = []
-    y_precipitacion_data = []
-    y_caudal_data = []
-    historical_precipitacion = []
-    historical_caudal = []
+    widgets = {}
+    textos_iniciales = {
+        'precipitacion': "Precipitaciones: 0.0 mm/h",
+        'caudal': "Caudal: 0.0 m³/s",
+        'hora_simulada': "Hora Simulada: ",
+        'estado_alerta': "Estado de Alerta: No Alerta",
+    }
+    for fila, (nombre, texto) in enumerate(textos_iniciales.items()):
+        widgets[nombre] = ttk.Label(frame, text=texto, font=("Arial", 14))
+        widgets[nombre].grid(row=fila, column=0, padx=10, pady=10)
 
-    canvas_realtime = FigureCanvasTkAgg(fig_realtime, master=root)
-    canvas_realtime.get_tk_widget().grid(row=5, column=0, padx=10, pady=10)
+    widgets['canvas_alerta'] = tk.Canvas(frame, width=50, height=50)
+    widgets['canvas_alerta'].grid(row=4, column=0, padx=10, pady=10)
+    widgets['circulo_alerta'] = widgets['canvas_alerta'].create_oval(10, 10, 40, 40, fill="green")
 
-    canvas_historical = FigureCanvasTkAgg(fig_historical, master=root)
-    canvas_historical.get_tk_widget().grid(row=6, column=0, padx=10, pady=10)
+    widgets['tiempo_real'] = crear_grafico(root, 5, "Datos en Tiempo Real")
+    widgets['historico'] = crear_grafico(root, 6, "Datos Históricos")
 
-    return root
+    return root, widgets
 
-def iniciar_cliente_opcua():
-    threading.Thread(target=lambda: asyncio.run(obtener_datos_opcua())).start()
+def refrescar(root, widgets, modelo, ultima_version=None):
+    # Los widgets sólo se tocan desde el hilo de Tk; el cliente OPC UA sólo escribe en el modelo
+    # Leer la versión es barato; la instantánea copia todo el histórico
+    if modelo.version != ultima_version:
+        instantanea = modelo.instantanea()
+        actualizar_interfaz(widgets, instantanea)
+        ultima_version = instantanea.version
+    root.after(INTERVALO_REFRESCO_MS, refrescar, root, widgets, modelo, ultima_version)
 
 def ejecutar_aplicacion():
-    root = crear_ventana_principal()
-    iniciar_cliente_opcua()
+    root, widgets = crear_ventana_principal()
+    modelo = ModeloPanel()
+    iniciar_alimentacion(modelo)
+    refrescar(root, widgets, modelo)
     root.mainloop()
 
 if __name__ == "__main__":
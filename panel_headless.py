@@ -0,0 +1,157 @@
+import argparse
+import asyncio
+import logging
+import os
+import time
+from diagnostico import Diagnostico
+from modelo_panel import INTERVALO_MUESTREO, PUNTOS_TIEMPO_REAL, URL_INTEGRACION, ModeloPanel, alimentar_modelo, diezmar
+from perfilado import configurar_logging
+
+# matplotlib se importa al crear el renderizador, y nunca pyplot: la figura se dibuja con
+# el lienzo Agg directamente, sin backend de ventanas ni pantalla.
+
+FPS_OBJETIVO = 1.0
+ARCHIVO_INSTANTANEA = "panel.png"
+FORMATOS = ("png", "svg")
+# Cada cuántos fotogramas se escribe en el log el coste de renderizado
+FOTOGRAMAS_POR_RESUMEN = 60
+
+_logger = logging.getLogger("panel_headless")
+
+
+class RenderizadorPanel:
+    """Dibuja el panel (valores, alerta, gráfico en tiempo real e histórico) en una figura Agg.
+
+    Las líneas y los textos se crean una vez y en cada fotograma sólo se actualizan sus datos.
+    """
+
+    def __init__(self, puntos_tiempo_real=PUNTOS_TIEMPO_REAL, tamano=(6, 8), dpi=80):
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        from matplotlib.figure import Figure
+
+        self.puntos_tiempo_real = puntos_tiempo_real
+        # Márgenes fijos: el reparto automático (constrained/tight) recalculado en cada fotograma
+        # costaba más de la mitad del tiempo de renderizado
+        self.figura = Figure(figsize=tamano, dpi=dpi)
+        FigureCanvasAgg(self.figura)
+        ax_estado, self.ax_tiempo_real, self.ax_historico = self.figura.subplots(3, 1, height_ratios=[1, 2, 2])
+        self.figura.subplots_adjust(left=0.12, right=0.96, top=0.97, bottom=0.07, hspace=0.45)
+
+        ax_estado.set_axis_off()
+        ax_estado.set_xlim(0, 1)
+        ax_estado.set_ylim(0, 1)
+        self.texto = ax_estado.text(0.02, 0.5, "", va="center", fontsize=12, family="monospace")
+        self.circulo_alerta, = ax_estado.plot([0.9], [0.5], "o", markersize=30, color="green")
+
+        self.lineas_tiempo_real = self._configurar_grafico(self.ax_tiempo_real, "Datos en Tiempo Real", "Tiempo (mediciones)")
+        self.lineas_historico = self._configurar_grafico(self.ax_historico, "Datos Históricos", "Tiempo (mediciones)")
+
+    @staticmethod
+    def _configurar_grafico(ax, titulo, etiqueta_x):
+        precipitacion, = ax.plot([], [], label="Precipitaciones")
+        caudal, = ax.plot([], [], label="Caudal", linestyle="--")
+        ax.legend(loc="upper left")
+        ax.set_title(titulo)
+        ax.set_xlabel(etiqueta_x)
+        ax.set_ylabel("Valor")
+        return precipitacion, caudal
+
+    @staticmethod
+    def _actualizar_grafico(ax, lineas, muestras, precipitaciones, caudales):
+        columnas = int(ax.bbox.width)
+        lineas[0].set_data(*diezmar(muestras, precipitaciones, columnas))
+        lineas[1].set_data(*diezmar(muestras, caudales, columnas))
+        ax.relim()
+        ax.autoscale_view()
+
+    def dibujar(self, instantanea):
+        alerta = "Alerta" if instantanea.estado_alerta else "No Alerta"
+        if instantanea.alerta_desde:
+            alerta += f" desde {instantanea.alerta_desde}"
+        self.texto.set_text(
+            f"Precipitaciones: {instantanea.precipitacion} mm/h\n"
+            f"Caudal: {instantanea.caudal} m³/s\n"
+            f"Hora Simulada: {instantanea.hora_simulada}\n"
+            f"Estado de Alerta: {alerta} ({instantanea.activaciones} activaciones)")
+        self.circulo_alerta.set_color("red" if instantanea.estado_alerta else "green")
+        self._actualizar_grafico(self.ax_tiempo_real, self.lineas_tiempo_real, *instantanea.tiempo_real(self.puntos_tiempo_real))
+        self._actualizar_grafico(self.ax_historico, self.lineas_historico, instantanea.muestras(),
+                                 instantanea.precipitaciones, instantanea.caudales)
+
+    def guardar(self, destino, formato="png"):
+        """`destino` puede ser una ruta o un archivo abierto en modo binario (p. ej. io.BytesIO)."""
+        self.figura.savefig(destino, format=formato)
+
+    def exportar(self, ruta, formato="png"):
+        # Escritura atómica: quien sirva o muestre el archivo nunca ve una imagen a medias
+        temporal = f"{ruta}.{os.getpid()}.tmp"
+        self.guardar(temporal, formato)
+        os.replace(temporal, ruta)
+
+
+def formato_de(ruta):
+    formato = os.path.splitext(ruta)[1].lstrip(".").lower()
+    return formato if formato in FORMATOS else "png"
+
+
+async def ejecutar_headless(modelo, salida=ARCHIVO_INSTANTANEA, fps=FPS_OBJETIVO, directorio_fotogramas=None,
+                            formato=None, diagnostico=None):
+    """Renderiza el modelo a como mucho `fps` fotogramas por segundo, y sólo si ha cambiado.
+
+    Sin `directorio_fotogramas` se sobrescribe siempre la misma instantánea `salida`; con él
+    se escribe una secuencia numerada de fotogramas.
+    """
+    formato = formato or formato_de(salida)
+    diagnostico = diagnostico or Diagnostico(["renderizado"])
+    renderizador = RenderizadorPanel()
+    periodo = 1.0 / fps
+    ultima_version = None
+    fotogramas = 0
+    if directorio_fotogramas:
+        os.makedirs(directorio_fotogramas, exist_ok=True)
+
+    def renderizar(instantanea, ruta):
+        with diagnostico.medir("renderizado"):
+            renderizador.dibujar(instantanea)
+            renderizador.exportar(ruta, formato)
+
+    while True:
+        inicio = time.monotonic()
+        # Leer la versión es barato; la instantánea copia todo el histórico
+        if modelo.version != ultima_version:
+            instantanea = modelo.instantanea()
+            ruta = (os.path.join(directorio_fotogramas, f"panel_{fotogramas:06d}.{formato}")
+                    if directorio_fotogramas else salida)
+            # En un hilo: el dibujo no retrasa las lecturas del servidor de integración
+            await asyncio.to_thread(renderizar, instantanea, ruta)
+            ultima_version = instantanea.version
+            fotogramas += 1
+            if fotogramas % FOTOGRAMAS_POR_RESUMEN == 0:
+                resumen = diagnostico.histograma("renderizado").resumen()
+                _logger.info("%d fotogramas, renderizado p50 %.1f ms, p99 %.1f ms",
+                             fotogramas, resumen["p50"] * 1000, resumen["p99"] * 1000)
+        await asyncio.sleep(max(0.0, inicio + periodo - time.monotonic()))
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Panel de control sin pantalla: exporta el panel a PNG o SVG.")
+    parser.add_argument("--url", default=URL_INTEGRACION, help="Servidor de integración")
+    parser.add_argument("--salida", default=ARCHIVO_INSTANTANEA, help="Instantánea que se sobrescribe (.png o .svg)")
+    parser.add_argument("--fotogramas", default=None, help="Directorio para guardar la secuencia de fotogramas")
+    parser.add_argument("--formato", choices=FORMATOS, default=None, help="Por defecto, el de la extensión de --salida")
+    parser.add_argument("--fps", type=float, default=FPS_OBJETIVO, help="Fotogramas por segundo como máximo")
+    parser.add_argument("--intervalo-muestreo", type=float, default=INTERVALO_MUESTREO)
+    args = parser.parse_args()
+
+    configurar_logging()
+    modelo = ModeloPanel()
+    alimentacion = asyncio.create_task(alimentar_modelo(modelo, args.url, args.intervalo_muestreo))
+    try:
+        await ejecutar_headless(modelo, args.salida, args.fps, args.fotogramas, args.formato)
+    finally:
+        alimentacion.cancel()
+        await asyncio.gather(alimentacion, return_exceptions=True)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,178 @@
+import asyncio
+import collections
+import functools
+import logging
+import os
+import sys
+import threading
+import time
+from diagnostico import Diagnostico
+
+# Perfilado opcional: se activa con el argumento --perfil o con ENTORNOS_PERFIL=1
+ARGUMENTO_PERFIL = "--perfil"
+VARIABLE_ENTORNO_PERFIL = "ENTORNOS_PERFIL"
+VARIABLE_ENTORNO_NIVEL_LOG = "ENTORNOS_LOG"
+VENTANA_PERFIL = 60.0
+INTERVALO_MUESTREO = 0.005
+UMBRAL_CALLBACK_LENTO = 0.05
+PROFUNDIDAD_PILA = 12
+MENSAJES_POR_INTERVALO = 5
+INTERVALO_LIMITE_LOG = 10.0
+
+_logger = logging.getLogger("perfilado")
+# Referencias a las tareas de cierre para que no se recolecten antes de terminar
+_tareas = set()
+
+
+def perfilado_activo():
+    if ARGUMENTO_PERFIL in sys.argv[1:]:
+        return True
+    return os.environ.get(VARIABLE_ENTORNO_PERFIL, "").lower() in ("1", "true", "si", "sí")
+
+
+# Tiempos por corrutina; sólo se rellenan con el perfilado activo
+TIEMPOS_CORRUTINAS = Diagnostico()
+
+
+def cronometrar(funcion):
+    """Registra la duración de cada llamada en TIEMPOS_CORRUTINAS si el perfilado está activo.
+
+    Sin perfilado devuelve la función original, así que no añade coste en el camino caliente.
+    """
+    if not perfilado_activo():
+        return funcion
+    histograma = TIEMPOS_CORRUTINAS.histograma(funcion.__qualname__)
+
+    if asyncio.iscoroutinefunction(funcion):
+        @functools.wraps(funcion)
+        async def envoltura_asincrona(*args, **kwargs):
+            inicio = time.perf_counter()
+            try:
+                return await funcion(*args, **kwargs)
+            finally:
+                histograma.registrar(time.perf_counter() - inicio)
+        return envoltura_asincrona
+
+    @functools.wraps(funcion)
+    def envoltura(*args, **kwargs):
+        inicio = time.perf_counter()
+        try:
+            return funcion(*args, **kwargs)
+        finally:
+            histograma.registrar(time.perf_counter() - inicio)
+    return envoltura
+
+
+class FiltroFrecuencia(logging.Filter):
+    """Deja pasar como mucho `maximo` mensajes iguales (mismo formato) por intervalo.
+
+    Al abrirse un nuevo intervalo se informa de cuántos se han descartado.
+    """
+
+    def __init__(self, maximo=MENSAJES_POR_INTERVALO, intervalo=INTERVALO_LIMITE_LOG):
+        super().__init__()
+        self.maximo = maximo
+        self.intervalo = intervalo
+        self.contadores = {}
+
+    def filter(self, record):
+        clave = (record.name, record.levelno, record.msg)
+        ahora = time.monotonic()
+        inicio, emitidos, descartados = self.contadores.get(clave, (ahora, 0, 0))
+        if ahora - inicio >= self.intervalo:
+            if descartados:
+                record.msg = f"{record.msg} ({descartados} mensajes similares descartados)"
+            inicio, emitidos, descartados = ahora, 0, 0
+        if emitidos >= self.maximo:
+            self.contadores[clave] = (inicio, emitidos, descartados + 1)
+            return False
+        self.contadores[clave] = (inicio, emitidos + 1, descartados)
+        return True
+
+
+def configurar_logging(nivel=None):
+    """Logging con nivel configurable (ENTORNOS_LOG, INFO por defecto) y limitado en frecuencia."""
+    if nivel is None:
+        nivel = os.environ.get(VARIABLE_ENTORNO_NIVEL_LOG, "INFO").upper()
+    logging.basicConfig(level=nivel, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    for manejador in logging.getLogger().handlers:
+        if not any(isinstance(filtro, FiltroFrecuencia) for filtro in manejador.filters):
+            manejador.addFilter(FiltroFrecuencia())
+
+
+class MuestreadorPilas(threading.Thread):
+    """Perfil estadístico: muestrea la pila del hilo observado a intervalos fijos."""
+
+    def __init__(self, hilo_id, ventana=VENTANA_PERFIL, intervalo=INTERVALO_MUESTREO, profundidad=PROFUNDIDAD_PILA):
+        super().__init__(name="muestreador-pilas", daemon=True)
+        self.hilo_id = hilo_id
+        self.ventana = ventana
+        self.intervalo = intervalo
+        self.profundidad = profundidad
+        self.pilas = collections.Counter()
+        self.muestras = 0
+
+    def run(self):
+        fin = time.monotonic() + self.ventana
+        while time.monotonic() < fin:
+            marco = sys._current_frames().get(self.hilo_id)
+            if marco is not None:
+                pila = []
+                while marco is not None and len(pila) < self.profundidad:
+                    codigo = marco.f_code
+                    pila.append(f"{codigo.co_name} ({os.path.basename(codigo.co_filename)}:{marco.f_lineno})")
+                    marco = marco.f_back
+                self.pilas[tuple(reversed(pila))] += 1
+                self.muestras += 1
+            time.sleep(self.intervalo)
+
+    def funciones_mas_frecuentes(self, n=15):
+        propias = collections.Counter()
+        for pila, cuenta in self.pilas.items():
+            propias[pila[-1]] += cuenta
+        return propias.most_common(n)
+
+    def guardar_pilas(self, ruta):
+        # Formato de pilas colapsadas, compatible con flamegraph.pl y speedscope
+        with open(ruta, "w", encoding="utf-8") as archivo:
+            for pila, cuenta in self.pilas.most_common():
+                archivo.write(";".join(pila) + f" {cuenta}\n")
+
+
+async def iniciar_perfilado(nombre_servidor, ventana=VENTANA_PERFIL):
+    """Activa el perfilado si procede y devuelve la tarea que lo cierra (o None).
+
+    Durante `ventana` segundos: modo debug de asyncio con aviso de callbacks lentos,
+    muestreo estadístico del hilo del bucle y tiempos por corrutina (@cronometrar).
+    Al terminar se vuelca el resumen al log y las pilas a perfil_<servidor>.txt.
+    """
+    if not perfilado_activo():
+        return None
+
+    bucle = asyncio.get_running_loop()
+    bucle.set_debug(True)
+    bucle.slow_callback_duration = UMBRAL_CALLBACK_LENTO
+    logging.getLogger("asyncio").setLevel(logging.WARNING)
+
+    muestreador = MuestreadorPilas(threading.get_ident(), ventana)
+    muestreador.start()
+    _logger.warning("Perfilado activo durante %.0f s en %s", ventana, nombre_servidor)
+
+    async def finalizar():
+        await asyncio.to_thread(muestreador.join)
+        bucle.set_debug(False)
+        ruta = f"perfil_{nombre_servidor}.txt"
+        muestreador.guardar_pilas(ruta)
+        # Un único mensaje multilínea, para que el filtro de frecuencia no lo recorte
+        lineas = [f"Perfil de {nombre_servidor}: {muestreador.muestras} muestras, pilas en {ruta}"]
+        for funcion, cuenta in muestreador.funciones_mas_frecuentes():
+            lineas.append(f"  {100 * cuenta / max(muestreador.muestras, 1):5.1f}%  {funcion}")
+        for nombre, resumen in TIEMPOS_CORRUTINAS.resumen().items():
+            lineas.append(f"  {nombre}: {resumen['cuenta']} llamadas, p50 {resumen['p50'] * 1000:.3f} ms, "
+                          f"p99 {resumen['p99'] * 1000:.3f} ms")
+        _logger.warning("\n".join(lineas))
+
+    tarea = asyncio.create_task(finalizar())
+    _tareas.add(tarea)
+    tarea.add_done_callback(_tareas.discard)
+    return tarea
@@ -0,0 +1,108 @@
+import collections
+import itertools
+import os
+from asyncua import ua
+
+# Perfiles de suscripción, para elegir por despliegue entre latencia y carga del servidor:
+#   predeterminado:   lo que usaban los clientes hasta ahora (publicación cada 100 ms, muestreo de 50 ms)
+#   baja_latencia:    publicación cada 10 ms y muestreo tan rápido como pueda el servidor
+#   bajo_ancho_banda: publicación cada segundo, una muestra por elemento y banda muerta absoluta
+#   reproduccion:     colas largas para no perder valores al reproducir grabaciones a máxima velocidad
+PERFIL_PREDETERMINADO = "predeterminado"
+PERFIL_BAJA_LATENCIA = "baja_latencia"
+PERFIL_BAJO_ANCHO_BANDA = "bajo_ancho_banda"
+PERFIL_REPRODUCCION = "reproduccion"
+
+BANDA_ABSOLUTA = "absoluta"
+# La porcentual se calcula sobre la propiedad EURange del nodo, que nuestros servidores no
+# definen; además los servidores de asyncua no la aplican (dejan pasar todos los cambios)
+BANDA_PORCENTUAL = "porcentual"
+TIPOS_BANDA = {
+    None: ua.DeadbandType.None_,
+    BANDA_ABSOLUTA: ua.DeadbandType.Absolute,
+    BANDA_PORCENTUAL: ua.DeadbandType.Percent,
+}
+
+# Manejadores de cliente propios: asyncua numera los suyos desde 200, así que empezando
+# en 2**31 nunca coinciden aunque se mezclen en la misma suscripción
+_MANEJADORES = itertools.count(1 << 31)
+
+
+class PerfilSuscripcion(collections.namedtuple("PerfilSuscripcion", [
+        "periodo_publicacion", "muestreo", "cola", "descartar_antiguos", "tipo_banda", "banda_muerta"])):
+    """Parámetros de una suscripción y de sus elementos monitorizados.
+
+    `periodo_publicacion` y `muestreo` van en milisegundos (muestreo 0: lo más rápido que
+    admita el servidor). La banda muerta sólo se aplica a los nodos numéricos que se
+    suscriban con banda_muerta=True. Para variar un campo: perfil._replace(cola=50).
+    """
+
+    __slots__ = ()
+
+    def filtro(self):
+        if self.tipo_banda is None:
+            return None
+        filtro = ua.DataChangeFilter()
+        filtro.Trigger = ua.DataChangeTrigger.StatusValue
+        filtro.DeadbandType = TIPOS_BANDA[self.tipo_banda]
+        filtro.DeadbandValue = float(self.banda_muerta)
+        return filtro
+
+
+PERFILES = {
+    PERFIL_PREDETERMINADO: PerfilSuscripcion(100, 50, 1, True, None, 0.0),
+    PERFIL_BAJA_LATENCIA: PerfilSuscripcion(10, 0, 10, True, None, 0.0),
+    PERFIL_BAJO_ANCHO_BANDA: PerfilSuscripcion(1000, 500, 1, True, BANDA_ABSOLUTA, 0.1),
+    PERFIL_REPRODUCCION: PerfilSuscripcion(100, 0, 1000, True, None, 0.0),
+}
+
+PERFIL_SUSCRIPCION = os.environ.get("ENTORNOS_PERFIL_SUSCRIPCION", PERFIL_PREDETERMINADO)
+
+
+def obtener_perfil(nombre=None):
+    """Perfil por nombre; sin nombre, el elegido con ENTORNOS_PERFIL_SUSCRIPCION."""
+    nombre = nombre or PERFIL_SUSCRIPCION
+    if nombre not in PERFILES:
+        raise ValueError(f"Perfil de suscripción desconocido '{nombre}', debe ser uno de {tuple(PERFILES)}")
+    return PERFILES[nombre]
+
+
+async def crear_suscripcion(cliente, handler, perfil=None):
+    perfil = perfil or obtener_perfil()
+    return await cliente.create_subscription(perfil.periodo_publicacion, handler)
+
+
+async def monitorizar(subscription, nodos, perfil=None, banda_muerta=False):
+    """Añade los nodos a la suscripción con el muestreo, la cola y el filtro del perfil.
+
+    subscribe_data_change no admite filtro ni política de descarte, así que las peticiones
+    se construyen aquí. La banda muerta sólo tiene sentido en variables numéricas (en texto
+    o fechas el servidor falla al restar), por eso hay que pedirla con banda_muerta=True.
+    Si el servidor rechaza algún elemento se lanza su código de estado.
+    """
+    perfil = perfil or obtener_perfil()
+    filtro = perfil.filtro() if banda_muerta else None
+    peticiones = []
+    for nodo in nodos:
+        elemento = ua.ReadValueId()
+        elemento.NodeId = nodo.nodeid
+        elemento.AttributeId = ua.AttributeIds.Value
+        parametros = ua.MonitoringParameters()
+        parametros.ClientHandle = next(_MANEJADORES)
+        parametros.SamplingInterval = float(perfil.muestreo)
+        parametros.QueueSize = perfil.cola
+        parametros.DiscardOldest = perfil.descartar_antiguos
+        if filtro is not None:
+            parametros.Filter = filtro
+        peticion = ua.MonitoredItemCreateRequest()
+        peticion.ItemToMonitor = elemento
+        peticion.MonitoringMode = ua.MonitoringMode.Reporting
+        peticion.RequestedParameters = parametros
+        peticiones.append(peticion)
+    if not peticiones:
+        return []
+    resultados = await subscription.create_monitored_items(peticiones)
+    for resultado in resultados:
+        if isinstance(resultado, ua.StatusCode):
+            resultado.check()
+    return resultados
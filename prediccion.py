@@ -0,0 +1,232 @@
+import argparse
+import json
+import logging
+import math
+import os
+from datetime import timedelta
+import numpy as np
+from estado_persistente import a_texto, de_texto
+
+ARCHIVO_NUCLEO = os.environ.get("ENTORNOS_NUCLEO", "nucleo_caudal.json")
+PASO_MINUTOS = 5
+# Cuatro horas de respuesta de la cuenca
+LONGITUD_NUCLEO = 48
+ANTICIPACIONES_MIN = (30, 60, 120)
+REGULARIZACION = 1e-3
+# Muestras comunes mínimas para ajustar, en longitudes de núcleo: con menos, la correlación
+# cruzada a los retardos largos se estima con muy pocos pares
+MUESTRAS_MINIMAS_POR_PASO = 4
+UMBRAL_CAUDAL_PREVISTO = 150
+
+_logger = logging.getLogger("prediccion")
+
+
+def nucleo_por_defecto(longitud=LONGITUD_NUCLEO, embalses=3, constante=4.0, ganancia=1.0):
+    """Hidrograma unitario de Nash (cascada de embalses lineales) con área `ganancia`.
+
+    Sólo sirve hasta que se ajuste un núcleo con datos históricos (ajustar_nucleo).
+    """
+    t = np.arange(longitud) + 0.5
+    forma = t ** (embalses - 1) * np.exp(-t / constante) / (math.gamma(embalses) * constante ** embalses)
+    return ganancia * forma / forma.sum()
+
+
+def ajustar_nucleo(lluvia, caudal, longitud=LONGITUD_NUCLEO, regularizacion=REGULARIZACION):
+    """Ajusta la respuesta lluvia-caudal por deconvolución de Wiener en el dominio de la frecuencia.
+
+    La correlación cruzada lluvia-caudal y la autocorrelación de la lluvia se obtienen con
+    FFT (con relleno de ceros para que no sea circular); el núcleo es su cociente regularizado.
+    Devuelve (nucleo, base) con caudal ≈ base + convolución(lluvia, nucleo). Lanza ValueError
+    si las series son demasiado cortas para la longitud pedida o si no hay lluvia.
+    """
+    lluvia = np.asarray(lluvia, dtype=float)
+    caudal = np.asarray(caudal, dtype=float)
+    if len(lluvia) < MUESTRAS_MINIMAS_POR_PASO * longitud:
+        raise ValueError(f"{len(lluvia)} muestras comunes de lluvia y caudal; un núcleo de {longitud} pasos "
+                         f"necesita al menos {MUESTRAS_MINIMAS_POR_PASO * longitud}")
+    media_lluvia, media_caudal = lluvia.mean(), caudal.mean()
+    if not np.any(lluvia != media_lluvia):
+        raise ValueError("La lluvia es constante en el periodo común; no hay respuesta que ajustar")
+    n = 1 << int(len(lluvia) + longitud - 1).bit_length()
+
+    espectro_lluvia = np.fft.rfft(lluvia - media_lluvia, n)
+    espectro_caudal = np.fft.rfft(caudal - media_caudal, n)
+    autoespectro = np.abs(espectro_lluvia) ** 2
+    espectro_cruzado = np.conj(espectro_lluvia) * espectro_caudal
+    respuesta = espectro_cruzado / (autoespectro + regularizacion * autoespectro.max())
+    nucleo = np.fft.irfft(respuesta, n)[:longitud]
+    base = media_caudal - nucleo.sum() * media_lluvia
+    return nucleo, float(base)
+
+
+def guardar_nucleo(ruta, nucleo, base):
+    with open(ruta, "w", encoding="utf-8") as archivo:
+        json.dump({"paso_minutos": PASO_MINUTOS, "base": base, "nucleo": [float(v) for v in nucleo]}, archivo, indent=2)
+
+
+def cargar_nucleo(ruta=ARCHIVO_NUCLEO):
+    """(nucleo, base) guardados con guardar_nucleo; si no hay archivo, el núcleo por defecto."""
+    try:
+        with open(ruta, encoding="utf-8") as archivo:
+            datos = json.load(archivo)
+        return np.asarray(datos["nucleo"], dtype=float), float(datos["base"])
+    except (OSError, ValueError, KeyError):
+        _logger.warning("Sin núcleo ajustado en '%s'; se usa el hidrograma unitario por defecto", ruta)
+        return nucleo_por_defecto(), 0.0
+
+
+class PronosticoCaudal:
+    """Convolución en streaming de la lluvia con el núcleo, sobre un buffer circular.
+
+    `futuro[(posicion + k) % L]` acumula el caudal que la lluvia ya observada aporta dentro
+    de k pasos. Cada paso suma lluvia * nucleo a ese buffer (O(L)) y el pronóstico a
+    cualquier anticipación es una lectura. La lluvia futura se toma como nula, así que
+    cada anticipación es el caudal comprometido por la lluvia caída hasta ahora.
+    """
+
+    def __init__(self, nucleo, base=0.0, anticipaciones_min=ANTICIPACIONES_MIN, paso_minutos=PASO_MINUTOS):
+        self.nucleo = np.asarray(nucleo, dtype=float)
+        self.base = base
+        self.anticipaciones_min = tuple(anticipaciones_min)
+        self.pasos = [round(minutos / paso_minutos) for minutos in self.anticipaciones_min]
+        self.futuro = np.zeros(len(self.nucleo))
+        self.posicion = 0
+
+    def avanzar(self, lluvia, pasos=1):
+        """Incorpora `pasos` pasos: `lluvia` en el último y nada en los anteriores.
+
+        Si el reloj salta varios pasos de golpe, la lluvia de los saltados no se ha observado y
+        se toma como nula; esos pasos sólo vacían su casilla, así que el coste sigue siendo O(L).
+        """
+        longitud = len(self.nucleo)
+        saltados = pasos - 1
+        if saltados > 0:
+            # Con más saltados que el núcleo, todo lo acumulado ya habría salido de la ventana
+            self.futuro[(self.posicion + np.arange(min(saltados, longitud))) % longitud] = 0.0
+            self.posicion = (self.posicion + saltados) % longitud
+        corte = longitud - self.posicion
+        self.futuro[self.posicion:] += lluvia * self.nucleo[:corte]
+        self.futuro[:self.posicion] += lluvia * self.nucleo[corte:]
+        self.futuro[self.posicion] = 0.0
+        self.posicion = (self.posicion + 1) % longitud
+
+    def prevision(self):
+        """Caudal previsto para cada anticipación, en el mismo orden que anticipaciones_min."""
+        longitud = len(self.nucleo)
+        return [self.base + (self.futuro[(self.posicion + paso - 1) % longitud] if 0 < paso <= longitud else 0.0)
+                for paso in self.pasos]
+
+    def estado(self):
+        return {"futuro": self.futuro.tolist(), "posicion": self.posicion}
+
+    def restaurar(self, estado):
+        """Recupera el buffer guardado con estado(); False si no encaja con el núcleo actual."""
+        futuro = np.asarray(estado["futuro"], dtype=float)
+        if len(futuro) != len(self.nucleo):
+            return False
+        self.futuro = futuro
+        self.posicion = int(estado["posicion"]) % len(futuro)
+        return True
+
+
+class PrediccionIntegracion:
+    """Publica el pronóstico en el servidor de integración, avanzando una vez por instante simulado."""
+
+    def __init__(self, pronostico, variables, alerta_prevista, umbral=UMBRAL_CAUDAL_PREVISTO):
+        self.pronostico = pronostico
+        self.variables = variables
+        self.alerta_prevista = alerta_prevista
+        self.umbral = umbral
+        self.ultima_hora = None
+
+    async def actualizar(self, hora_simulada, precipitaciones, hora_lluvia=None):
+        """Avanza el pronóstico hasta `hora_simulada`; devuelve la previsión, o None si no avanza.
+
+        `hora_lluvia` es la hora ('%H:%M:%S') que publica el pluviómetro junto a su último valor.
+        Si no es la del reloj, la lluvia de este instante aún no ha llegado: el último paso espera
+        a una lectura posterior en vez de avanzar con la lluvia del instante anterior.
+        """
+        if self.ultima_hora is None:
+            pasos = 1
+        else:
+            pasos = int((hora_simulada - self.ultima_hora).total_seconds() // (PASO_MINUTOS * 60))
+            if pasos <= 0:
+                # Mismo instante (se lee más rápido de lo que avanza el reloj) o reloj hacia atrás
+                return None
+        if hora_lluvia is not None and hora_lluvia != hora_simulada.strftime('%H:%M:%S'):
+            if pasos == 1 or self.ultima_hora is None:
+                return None
+            # Los pasos saltados anteriores sí se pueden cerrar ya, sin lluvia
+            self.ultima_hora += timedelta(minutes=PASO_MINUTOS * (pasos - 1))
+            self.pronostico.avanzar(0.0, pasos - 1)
+        else:
+            self.ultima_hora = hora_simulada
+            self.pronostico.avanzar(0.0 if math.isnan(precipitaciones) else precipitaciones, pasos)
+        prevision = self.pronostico.prevision()
+        await self._publicar(prevision)
+        return prevision
+
+    async def _publicar(self, prevision):
+        for variable, valor in zip(self.variables, prevision):
+            await variable.write_value(float(valor))
+        await self.alerta_prevista.write_value(bool(max(prevision) > self.umbral))
+
+    def estado(self):
+        return {"ultima_hora": a_texto(self.ultima_hora), "pronostico": self.pronostico.estado()}
+
+    async def restaurar(self, estado):
+        """Arranque en caliente: sigue con la lluvia ya convolucionada en vez de empezar de cero."""
+        if not self.pronostico.restaurar(estado["pronostico"]):
+            _logger.warning("El núcleo ha cambiado desde el último punto de control; el pronóstico empieza de cero")
+            return
+        self.ultima_hora = de_texto(estado["ultima_hora"])
+        await self._publicar(self.pronostico.prevision())
+
+
+async def configurar_prediccion(objeto, idx, nucleo, base, anticipaciones_min=ANTICIPACIONES_MIN):
+    variables = [await objeto.add_variable(idx, f"CaudalPrevisto_{minutos}min", 0.0) for minutos in anticipaciones_min]
+    alerta_prevista = await objeto.add_variable(idx, "AlertaPrevista", False)
+    return PrediccionIntegracion(PronosticoCaudal(nucleo, base, anticipaciones_min), variables, alerta_prevista)
+
+
+def series_historicas(ruta_pluviometro, ruta_aforo):
+    """Lluvia y caudal alineados por fecha, en pasos de PASO_MINUTOS, con el archivo completo."""
+    import importlib
+    import pandas as pd
+    import server_pluviometro_abstraido as pluviometro
+    aforo = importlib.import_module("server_aforo_abstraído")
+
+    # La estación sólo lee un día; el ajuste usa toda la hoja
+    df_lluvia = pluviometro.cargar_datos_excel(ruta_pluviometro, filas=None)
+    lluvia = pd.Series(df_lluvia['Precipitacion'].to_numpy(), index=pd.to_datetime(df_lluvia.iloc[:, 0], errors='coerce'))
+    df_caudal = aforo.cargar_datos_csv(ruta_aforo)
+    caudal = pd.Series(df_caudal['Caudal'].to_numpy(), index=pd.to_datetime(df_caudal['Fecha'], errors='coerce'))
+
+    lluvia = lluvia[lluvia.index.notna()].groupby(level=0).first().resample(f"{PASO_MINUTOS}min").mean()
+    caudal = caudal[caudal.index.notna()].groupby(level=0).first().resample(f"{PASO_MINUTOS}min").mean()
+    comunes = lluvia.index.intersection(caudal.index)
+    # Sin lluvia registrada se asume que no llovió; los huecos de caudal se interpolan
+    return lluvia[comunes].fillna(0.0).to_numpy(), caudal[comunes].interpolate(limit_direction="both").to_numpy()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ajusta el núcleo lluvia-caudal con las series históricas.")
+    parser.add_argument("pluviometro", help="Excel del pluviómetro")
+    parser.add_argument("aforo", help="CSV de la estación de aforo")
+    parser.add_argument("--salida", default=ARCHIVO_NUCLEO)
+    parser.add_argument("--longitud", type=int, default=LONGITUD_NUCLEO, help="Pasos de 5 minutos del núcleo")
+    parser.add_argument("--regularizacion", type=float, default=REGULARIZACION)
+    args = parser.parse_args()
+
+    lluvia, caudal = series_historicas(args.pluviometro, args.aforo)
+    try:
+        nucleo, base = ajustar_nucleo(lluvia, caudal, args.longitud, args.regularizacion)
+    except ValueError as e:
+        parser.error(str(e))
+    guardar_nucleo(args.salida, nucleo, base)
+    print(f"Núcleo de {len(nucleo)} pasos ajustado con {len(lluvia)} muestras: base {base:.2f} m³/s, "
+          f"ganancia {nucleo.sum():.3f}, pico a los {int(np.argmax(nucleo)) * PASO_MINUTOS} min -> {args.salida}")
+
+
+if __name__ == "__main__":
+    main()
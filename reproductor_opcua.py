@@ -0,0 +1,103 @@
+import argparse
+import asyncio
+import time
+from datetime import datetime, timezone
+from asyncua import Server, ua
+from grabador_opcua import ARCHIVO_REGISTRO, DISPOSICION, VARIANT_POR_TIPO, leer_registro
+
+VALOR_INICIAL = {
+    ua.VariantType.Double: 0.0,
+    ua.VariantType.String: "",
+    ua.VariantType.Boolean: False,
+    ua.VariantType.Int64: 0,
+}
+
+
+def interpretar_velocidad(texto):
+    """'1', '10', '10x' o 'max'; devuelve None para reproducir sin esperas."""
+    texto = texto.strip().lower()
+    if texto == "max":
+        return None
+    texto = texto.rstrip("x×")
+    velocidad = float(texto)
+    if velocidad <= 0:
+        raise argparse.ArgumentTypeError("La velocidad debe ser positiva o 'max'.")
+    return velocidad
+
+
+async def configurar_servidores(canales):
+    tipos = {nombre: tipo for _, nombre, tipo in canales}
+    servidores = []
+    variables = {}
+
+    for servidor_nombre, endpoint, uri, objeto, nombres_variables in DISPOSICION:
+        servidor = Server()
+        await servidor.init()
+        servidor.set_endpoint(endpoint)
+        idx = await servidor.register_namespace(uri)
+        obj = await servidor.nodes.objects.add_object(idx, objeto)
+
+        for variable in nombres_variables:
+            nombre = f"{servidor_nombre}/{objeto}/{variable}"
+            varianttype = VARIANT_POR_TIPO[tipos[nombre]] if nombre in tipos else ua.VariantType.String
+            inicial = VALOR_INICIAL.get(varianttype, datetime.now(timezone.utc))
+            nodo = await obj.add_variable(idx, variable, inicial, varianttype=varianttype)
+            await nodo.set_writable()
+            variables[nombre] = (nodo, varianttype)
+
+        await servidor.start()
+        print(f"Servidor de reproducción '{servidor_nombre}' iniciado en {endpoint}")
+        servidores.append(servidor)
+
+    nodos_por_canal = {canal: variables[nombre] for canal, nombre, _ in canales if nombre in variables}
+    return servidores, nodos_por_canal
+
+
+async def reproducir(ruta, velocidad):
+    canales, muestras = leer_registro(ruta)
+    servidores, nodos_por_canal = await configurar_servidores(canales)
+
+    publicadas = 0
+    inicio_real = time.monotonic()
+    try:
+        primera_hora = None
+        for hora_real, _, canal, valor in muestras:
+            if primera_hora is None:
+                primera_hora = hora_real
+            if velocidad is not None:
+                espera = inicio_real + (hora_real - primera_hora) / velocidad - time.monotonic()
+                if espera > 0:
+                    await asyncio.sleep(espera)
+            elif publicadas % 1000 == 0:
+                # A velocidad máxima se cede el bucle de vez en cuando para atender a los clientes
+                await asyncio.sleep(0)
+
+            destino = nodos_por_canal.get(canal)
+            if destino is None:
+                continue
+            nodo, varianttype = destino
+            await nodo.write_value(ua.DataValue(ua.Variant(valor, varianttype)))
+            publicadas += 1
+
+        duracion = time.monotonic() - inicio_real
+        tasa = publicadas / duracion if duracion > 0 else float("inf")
+        print(f"Reproducción finalizada: {publicadas} muestras en {duracion:.2f} s ({tasa:.0f} muestras/s)")
+    finally:
+        for servidor in servidores:
+            await servidor.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Republica un registro grabado con grabador_opcua.py.")
+    parser.add_argument("archivo", nargs="?", default=ARCHIVO_REGISTRO)
+    parser.add_argument("--velocidad", type=interpretar_velocidad, default=1.0,
+                        help="Factor de velocidad (1, 10, 10x...) o 'max'")
+    args = parser.parse_args()
+    try:
+        asyncio.run(reproducir(args.archivo, args.velocidad))
+    except KeyboardInterrupt:
+        print("Reproducción detenida por el usuario.")
+
+
+if __name__ == "__main__":
+    main()
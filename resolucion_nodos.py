@@ -0,0 +1,132 @@
+import hashlib
+import json
+import logging
+import os
+from asyncua import ua
+
+# Caché en disco de NodeId resueltos; se puede cambiar con ENTORNOS_CACHE_NODOS
+ARCHIVO_CACHE = os.environ.get("ENTORNOS_CACHE_NODOS", "cache_nodos.json")
+
+_logger = logging.getLogger("resolucion_nodos")
+
+
+def version_espacio_nombres(espacio_nombres):
+    # Si el servidor registra otros espacios de nombres, cambian los índices y la caché deja de valer
+    return hashlib.sha1("\n".join(espacio_nombres).encode("utf-8")).hexdigest()[:16]
+
+
+def _leer_cache(ruta):
+    try:
+        with open(ruta, encoding="utf-8") as archivo:
+            return json.load(archivo)
+    except (OSError, ValueError):
+        return {}
+
+
+def _guardar_cache(ruta, cache):
+    temporal = f"{ruta}.{os.getpid()}.tmp"
+    with open(temporal, "w", encoding="utf-8") as archivo:
+        json.dump(cache, archivo, indent=2, ensure_ascii=False)
+    os.replace(temporal, ruta)
+
+
+def _ruta_navegacion(idx, ruta):
+    elementos = []
+    for nombre in ruta.split("/"):
+        elemento = ua.RelativePathElement()
+        elemento.ReferenceTypeId = ua.NodeId(ua.ObjectIds.HierarchicalReferences)
+        elemento.IsInverse = False
+        elemento.IncludeSubtypes = True
+        elemento.TargetName = ua.QualifiedName(nombre, idx)
+        elementos.append(elemento)
+    ruta_navegacion = ua.BrowsePath()
+    ruta_navegacion.StartingNode = ua.NodeId(ua.ObjectIds.ObjectsFolder)
+    ruta_navegacion.RelativePath = ua.RelativePath()
+    ruta_navegacion.RelativePath.Elements = elementos
+    return ruta_navegacion
+
+
+async def _leer_en_lote(cliente, nodos_atributos):
+    parametros = ua.ReadParameters()
+    for nodeid, atributo in nodos_atributos:
+        leer = ua.ReadValueId()
+        leer.NodeId = nodeid
+        leer.AttributeId = atributo
+        parametros.NodesToRead.append(leer)
+    return await cliente.uaclient.read(parametros)
+
+
+async def resolver_nodos(cliente, uri, rutas, archivo_cache=ARCHIVO_CACHE):
+    """Resuelve rutas relativas a Objects ("Objeto/Variable", todas en el espacio `uri`) a nodos.
+
+    Con caché válida basta una lectura en lote (NamespaceArray + BrowseName y NodeClass de cada
+    nodo guardado, para comprobar que siguen siendo los mismos: en el servidor temporal el
+    objeto y la variable se llaman los dos HoraSimulada). Si no, se lee el NamespaceArray, se
+    traducen todas las rutas con una única llamada TranslateBrowsePathsToNodeIds y se lee la
+    NodeClass de los nodos encontrados para la siguiente validación.
+    Devuelve un diccionario ruta -> Node.
+    """
+    rutas = list(rutas)
+    endpoint = cliente.server_url.geturl()
+    clave = f"{endpoint}|{uri}"
+    cache = _leer_cache(archivo_cache) if archivo_cache else {}
+    entrada = cache.get(clave, {})
+    guardados = entrada.get("nodos", {})
+    clases = entrada.get("clases", {})
+
+    nodo_espacio_nombres = ua.NodeId(ua.ObjectIds.Server_NamespaceArray)
+    if all(ruta in guardados and ruta in clases for ruta in rutas):
+        nodeids = [ua.NodeId.from_string(guardados[ruta]) for ruta in rutas]
+        atributos = [(nodeid, atributo) for nodeid in nodeids
+                     for atributo in (ua.AttributeIds.BrowseName, ua.AttributeIds.NodeClass)]
+        resultados = await _leer_en_lote(cliente, [(nodo_espacio_nombres, ua.AttributeIds.Value)] + atributos)
+        espacio_nombres = resultados[0].Value.Value
+        idx = espacio_nombres.index(uri) if uri in espacio_nombres else None
+        # Si cambia el índice del espacio de nombres, los NodeId guardados apuntan a otro espacio
+        valida = (
+            idx is not None
+            and entrada.get("indice") == idx
+            and entrada.get("version") == version_espacio_nombres(espacio_nombres)
+            and all(
+                nombre.StatusCode.is_good() and clase.StatusCode.is_good()
+                and nombre.Value.Value == ua.QualifiedName(ruta.split("/")[-1], idx)
+                and clase.Value.Value == clases[ruta]
+                for ruta, nombre, clase in zip(rutas, resultados[1::2], resultados[2::2])
+            )
+        )
+        if valida:
+            return {ruta: cliente.get_node(nodeid) for ruta, nodeid in zip(rutas, nodeids)}
+        _logger.info("Caché de nodos obsoleta para %s, se vuelve a resolver", endpoint)
+    else:
+        espacio_nombres = await cliente.get_namespace_array()
+
+    if uri not in espacio_nombres:
+        raise Exception(f"Espacio de nombres '{uri}' no registrado en {endpoint}.")
+    idx = espacio_nombres.index(uri)
+
+    resultados = await cliente.uaclient.translate_browsepaths_to_nodeids([_ruta_navegacion(idx, ruta) for ruta in rutas])
+    nodos = {}
+    for ruta, resultado in zip(rutas, resultados):
+        if not resultado.StatusCode.is_good() or not resultado.Targets:
+            raise Exception(f"Nodo '{ruta}' no encontrado en {endpoint}.")
+        destino = resultado.Targets[0].TargetId
+        nodos[ruta] = cliente.get_node(ua.NodeId(destino.Identifier, destino.NamespaceIndex))
+
+    if archivo_cache:
+        resultados = await _leer_en_lote(cliente, [(nodo.nodeid, ua.AttributeIds.NodeClass) for nodo in nodos.values()])
+        leidas = {ruta: int(resultado.Value.Value) for ruta, resultado in zip(nodos, resultados)
+                  if resultado.StatusCode.is_good()}
+        # Se relee justo antes de escribir por si otro proceso ha guardado sus rutas entretanto
+        cache = _leer_cache(archivo_cache)
+        version = version_espacio_nombres(espacio_nombres)
+        entrada = cache.get(clave, {})
+        misma = entrada.get("version") == version and entrada.get("indice") == idx
+        guardados = entrada.get("nodos", {}) if misma else {}
+        clases = entrada.get("clases", {}) if misma else {}
+        guardados.update({ruta: nodo.nodeid.to_string() for ruta, nodo in nodos.items()})
+        for ruta in nodos:
+            clases.pop(ruta, None)
+        clases.update(leidas)
+        cache[clave] = {"version": version, "indice": idx, "nodos": guardados, "clases": clases}
+        _guardar_cache(archivo_cache, cache)
+    return nodos
@@ -1,30 +1,38 @@
-import pandas as pd
 import asyncio
 import logging
-from asyncua import Server, Client, Node, ua
+from asyncua import Server, Node, ua
 from datetime import datetime, timezone
+from carga_streaming import agregar_estado_carga, cargar_en_segundo_plano
+from conexiones import GESTOR
+from perfilado import configurar_logging
+from resolucion_nodos import resolver_nodos
 
-logging.basicConfig(level=logging.INFO)
 _logger = logging.getLogger("estacion_aforo")
 
 # Ruta del archivo CSV
 archivo_csv = "/home/alopalm/entornos/trabajo_final/cincominutales-rambla-poyo-29102024.csv"
 
-# Leer y preparar los datos del archivo CSV
-df = pd.read_csv(archivo_csv)
 
-# Convertir las fechas del archivo a datetime UTC
-df['Fecha'] = pd.to_datetime(df['Fecha']).dt.tz_localize(timezone.utc)
+def cargar_datos(ruta_csv):
+    """Lee y prepara los datos del archivo CSV (se ejecuta en un hilo, con el servidor ya iniciado)."""
+    import pandas as pd
 
-# Limpiar y preparar los datos
-df['Caudal'] = df['Caudal'].replace(',', '.', regex=True)  
-df['Caudal'] = pd.to_numeric(df['Caudal'], errors='coerce')   se puede
-df['Estado'] = df['Estado'].fillna('Desconocido') 
+    df = pd.read_csv(ruta_csv)
+
+    # Convertir las fechas del archivo a datetime UTC
+    df['Fecha'] = pd.to_datetime(df['Fecha']).dt.tz_localize(timezone.utc)
+
+    # Limpiar y preparar los datos
+    df['Caudal'] = df['Caudal'].replace(',', '.', regex=True)
+    df['Caudal'] = pd.to_numeric(df['Caudal'], errors='coerce')
+    df['Estado'] = df['Estado'].fillna('Desconocido')
+    return df
 
 
 class SubscriptionHandler:
 
-    def __init__(self, caudal, estado, hora_variable):
+    def __init__(self, df, caudal, estado, hora_variable):
+        self.df = df
         self.caudal = caudal
         self.estado = estado
         self.hora_variable = hora_variable
@@ -40,7 +48,7 @@ class SubscriptionHandler:
         await self.hora_variable.write_value(hora_simulada)
 
         # Buscar la fila correspondiente en el DataFrame
-        fila = df[df['Fecha'] == hora_simulada]
+        fila = self.df[self.df['Fecha'] == hora_simulada]
 
         if not fila.empty:
             caudal_valor = fila['Caudal'].iloc[0]
@@ -50,9 +58,10 @@ class SubscriptionHandler:
             await self.caudal.write_value(caudal_valor)
             await self.estado.write_value(estado_valor)
 
-            _logger.info(f"Actualizado: Hora={hora_simulada}, Caudal={caudal_valor}, Estado={estado_valor}")
+            # Una vez por tick: en DEBUG, y con argumentos para que el filtro de frecuencia los agrupe
+            _logger.debug("Actualizado: Hora=%s, Caudal=%s, Estado=%s", hora_simulada, caudal_valor, estado_valor)
         else:
-            _logger.warning(f"No se encontraron datos para la hora simulada: {hora_simulada}")
+            _logger.warning("No se encontraron datos para la hora simulada: %s", hora_simulada)
 
 
 async def iniciar_servidor():
@@ -73,40 +82,47 @@ async def iniciar_servidor():
     hora_variable = await estacion_aforo.add_variable(
         idx, "Hora", datetime.now(timezone.utc), varianttype=ua.VariantType.DateTime
     )
+    # "Cargando" hasta que los datos del CSV estén listos
+    estado_carga = await agregar_estado_carga(estacion_aforo, idx)
 
     await servidor.start()
-    _logger.info(f"Servidor OPC UA iniciado en {servidor.endpoint}")
+    _logger.info("Servidor OPC UA iniciado en %s", servidor.endpoint)
 
-    return servidor, caudal, estado, hora_variable
+    return servidor, caudal, estado, hora_variable, estado_carga
 
 
 async def main():
-    servidor, caudal, estado, hora_variable = await iniciar_servidor()
+    configurar_logging()
+    servidor, caudal, estado, hora_variable, estado_carga = await iniciar_servidor()
 
     # Conectar al servidor temporal
     url_servidor_temporal = "opc.tcp://localhost:4840/freeopcua/server/"
-    cliente_temporal = Client(url_servidor_temporal)
 
     try:
-        async with cliente_temporal:
-            
+        # El servidor ya acepta conexiones; los datos se cargan en un hilo aparte
+        df = await cargar_en_segundo_plano(estado_carga, cargar_datos, archivo_csv)
+
+        # Sesión gestionada: si el servidor temporal se reinicia, el gestor reconecta y
+        # vuelve a crear la suscripción
+        conexion = await GESTOR.obtener(url_servidor_temporal)
 
-            # Obtener el nodo de hora simulada
-            nodo_hora_simulada = cliente_temporal.get_node("ns=2;i=2")
-            _logger.info(f"Nodo de hora simulada obtenido: {nodo_hora_simulada}")
+        # Obtener el nodo de hora simulada por su ruta
+        nodos = await resolver_nodos(conexion.cliente, "http://www.epsa.upv.es/entornos/temporal", ["HoraSimulada/HoraSimulada"])
+        nodo_hora_simulada = nodos["HoraSimulada/HoraSimulada"]
+        _logger.info("Nodo de hora simulada obtenido: %s", nodo_hora_simulada)
 
-            # Crear el manejador de suscripciones
-            handler = SubscriptionHandler(caudal, estado, hora_variable)
+        # Crear el manejador de suscripciones
+        handler = SubscriptionHandler(df, caudal, estado, hora_variable)
 
-            # Crear una suscripción y suscribirse al nodo de hora simulada
-            subscription = await cliente_temporal.create_subscription(100, handler)
-            await subscription.subscribe_data_change(nodo_hora_simulada)
+        # Suscribirse al nodo de hora simulada (según ENTORNOS_PERFIL_SUSCRIPCION)
+        await conexion.suscribir(handler, [nodo_hora_simulada])
 
-            await asyncio.Future()  # Esperar indefinidamente
+        await asyncio.Future()  # Esperar indefinidamente
 
     except KeyboardInterrupt:
         _logger.info("Servidor detenido manualmente.")
     finally:
+        await GESTOR.cerrar()
         await servidor.stop()
         _logger.info("Servidor OPC UA de la estación de aforo detenido.")
 
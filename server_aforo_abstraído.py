@@ -1,19 +1,53 @@
-import pandas as pd
 import asyncio
-from asyncua import Server, Client
+import logging
+from asyncua import Server, ua
+from carga_streaming import CargadorVentana, FuenteEnMemoria, LectorCSV, agregar_estado_carga, cargar_en_segundo_plano
+from conexiones import ERRORES_CONEXION, GESTOR
+from control_calidad import MUESTRAS_PLANO, describir_calidad, evaluar_calidad, resumen_calidad
+from diagnostico import SIN_DIAGNOSTICO, Diagnostico, publicar_diagnostico, segundos_desde
+from perfilado import configurar_logging, cronometrar, iniciar_perfilado
+from resolucion_nodos import resolver_nodos
+from sincronizacion import ETAPA_ESTACIONES, SIN_SINCRONIZACION, registrar_consumidor
 
 ARCHIVO_CSV = "/home/alopalm/entornos/trabajo_final/cincominutales-rambla-poyo-29102024.csv"
 ENDPOINT_OPC_UA = "opc.tcp://localhost:4842/es/upv/epsa/entornos/bla/estacion_aforo/"
 URI = "http://www.epsa.upv.es/entornos"
+URI_TEMPORAL = "http://www.epsa.upv.es/entornos/temporal"
 URL_SERVIDOR_TEMPORAL = "opc.tcp://localhost:4840/freeopcua/server/"
+INTERVALO_LECTURA = 0.2
+# Saltos mayores que éste respecto a las dos muestras vecinas se marcan como pico
+UMBRAL_PICO_CAUDAL = 200.0
+
+_logger = logging.getLogger("estacion_aforo")
+
+# pandas se importa al usarse, para que el servidor escuche cuanto antes
+
+def preparar_datos_aforo(df):
+    import pandas as pd
 
-def cargar_datos_csv(ruta_csv):
-    df = pd.read_csv(ruta_csv)
     df['Caudal'] = df['Caudal'].replace(',', '.', regex=True)
     df['Caudal'] = pd.to_numeric(df['Caudal'], errors='coerce')
     df['Estado'] = df['Estado'].fillna('Desconocido')
+    df['Calidad'] = evaluar_calidad(df['Caudal'].to_numpy(), pd.to_datetime(df['Fecha'], errors='coerce').to_numpy(),
+                                    umbral_pico=UMBRAL_PICO_CAUDAL)
     return df
 
+def cargar_datos_csv(ruta_csv):
+    import pandas as pd
+
+    df = preparar_datos_aforo(pd.read_csv(ruta_csv))
+    _logger.info("Control de calidad: %s", resumen_calidad(df['Calidad']))
+    return df
+
+def fuente_en_memoria(df):
+    """Consulta por hora de un DataFrame ya cargado (cargar_datos_csv o datos sintéticos)."""
+    return FuenteEnMemoria(df, 'Fecha')
+
+def abrir_datos_csv(ruta_csv):
+    # Para archivos de varios años: sólo una ventana de bloques alrededor de la hora simulada en memoria;
+    # el contexto da al control de calidad las muestras vecinas de cada bloque
+    return CargadorVentana(LectorCSV(ruta_csv, 'Fecha', preparar=preparar_datos_aforo, contexto=MUESTRAS_PLANO))
+
 async def configurar_servidor(endpoint, uri):
     servidor = Server()
     await servidor.init()
@@ -28,48 +62,100 @@ async def configurar_servidor(endpoint, uri):
     
     for variable in [caudal, estado, hora_variable]:
         await variable.set_writable()
+    estado_carga = await agregar_estado_carga(estacion_aforo, idx)
+    calidad = await estacion_aforo.add_variable(idx, "Calidad", 0, varianttype=ua.VariantType.UInt16)
+
+    return servidor, caudal, estado, hora_variable, estado_carga, calidad
 
-    return servidor, caudal, estado, hora_variable
+async def conectar_servidor_temporal(url=URL_SERVIDOR_TEMPORAL):
+    cliente = (await GESTOR.obtener(url)).cliente
+    nodos = await resolver_nodos(cliente, URI_TEMPORAL, ["HoraSimulada/HoraSimulada"])
+    return cliente, nodos["HoraSimulada/HoraSimulada"]
 
-async def leer_hora_simulada(cliente):
-    nodo_hora_simulada = cliente.get_node("ns=2;i=2")
-    hora_simulada = await nodo_hora_simulada.read_value()
-    return pd.to_datetime(hora_simulada)
+@cronometrar
+async def leer_hora_simulada(nodo_hora_simulada, diagnostico=SIN_DIAGNOSTICO):
+    with diagnostico.medir("lectura_hora"):
+        dato_hora = await nodo_hora_simulada.read_data_value()
+    retraso = segundos_desde(dato_hora.SourceTimestamp)
+    if retraso is not None:
+        diagnostico.registrar("retraso_simulado", retraso)
+    return dato_hora.Value.Value
 
-async def actualizar_variables(caudal_var, estado_var, hora_var, df, hora_simulada):
-    fila = df[df['Fecha'] == hora_simulada.strftime('%Y-%m-%d %H:%M:%S')]
+@cronometrar
+async def buscar_fila_aforo(fuente, hora_simulada):
+    """Filas de la hora simulada, en memoria o en la ventana de bloques, sin bloquear el bucle."""
+    return await fuente.buscar(hora_simulada)
+
+@cronometrar
+async def actualizar_variables(caudal_var, estado_var, hora_var, fuente, hora_simulada, diagnostico=SIN_DIAGNOSTICO, calidad_var=None):
+    with diagnostico.medir("busqueda"):
+        fila = await buscar_fila_aforo(fuente, hora_simulada)
     if not fila.empty:
         caudal_valor = fila['Caudal'].iloc[0]
         estado_valor = fila['Estado'].iloc[0]
+        calidad_valor = int(fila['Calidad'].iloc[0])
 
-        await caudal_var.write_value(caudal_valor)
-        await estado_var.write_value(estado_valor)
-        await hora_var.write_value(hora_simulada.strftime('%H:%M:%S'))
+        with diagnostico.medir("escritura"):
+            await caudal_var.write_value(caudal_valor)
+            await estado_var.write_value(estado_valor)
+            await hora_var.write_value(hora_simulada.strftime('%H:%M:%S'))
+            if calidad_var is not None:
+                await calidad_var.write_value(ua.Variant(calidad_valor, ua.VariantType.UInt16))
 
-        print(f"Hora: {hora_simulada}, Caudal: {caudal_valor}, Estado: {estado_valor}")
+        _logger.debug("Hora: %s, Caudal: %s, Estado: %s, Calidad: %s", hora_simulada, caudal_valor, estado_valor,
+                      describir_calidad(calidad_valor))
     else:
-        print(f"No se encontraron datos para la hora simulada: {hora_simulada}")
+        _logger.warning("No se encontraron datos para la hora simulada: %s", hora_simulada)
 
-async def main():
-    df = cargar_datos_csv(ARCHIVO_CSV)
+async def ciclo_aforo(nodo_hora_simulada, caudal_var, estado_var, hora_var, fuente, intervalo=INTERVALO_LECTURA, diagnostico=SIN_DIAGNOSTICO, calidad_var=None, sincronizacion=SIN_SINCRONIZACION):
+    while True:
+        try:
+            with diagnostico.medir("duracion_ciclo"):
+                hora_simulada = await leer_hora_simulada(nodo_hora_simulada, diagnostico)
+                await actualizar_variables(caudal_var, estado_var, hora_var, fuente, hora_simulada, diagnostico, calidad_var)
+            # Con el reloj en lockstep o libre, el tick no avanza hasta que se confirma
+            await sincronizacion.confirmar()
+        except ERRORES_CONEXION as e:
+            # El gestor de conexiones reconecta por debajo; se reintenta en el siguiente ciclo
+            _logger.warning("Sin conexión con el servidor temporal: %s", e)
+        await sincronizacion.esperar(intervalo)
 
-    servidor, caudal_var, estado_var, hora_var = await configurar_servidor(ENDPOINT_OPC_UA, URI)
+async def main():
+    configurar_logging()
+    await iniciar_perfilado("aforo")
+    servidor, caudal_var, estado_var, hora_var, estado_carga, calidad_var = await configurar_servidor(ENDPOINT_OPC_UA, URI)
     await servidor.start()
-    print(f"Servidor OPC UA iniciado en: {servidor.endpoint}")
-
-    cliente_temporal = Client(URL_SERVIDOR_TEMPORAL)
-    await cliente_temporal.connect()
+    _logger.info("Servidor OPC UA iniciado en: %s", servidor.endpoint)
 
+    fuente = None
+    sincronizacion = None
+    tarea_diagnostico = None
     try:
-        while True:
-            hora_simulada = await leer_hora_simulada(cliente_temporal)
-            await actualizar_variables(caudal_var, estado_var, hora_var, df, hora_simulada)
-            await asyncio.sleep(0.2)
+        # Los datos se cargan en un hilo con el endpoint ya abierto, a la vez que se conecta al
+        # reloj; dentro del try para que un fallo de conexión también detenga el servidor
+        fuente, (cliente_temporal, nodo_hora_simulada) = await asyncio.gather(
+            cargar_en_segundo_plano(estado_carga, abrir_datos_csv, ARCHIVO_CSV),
+            conectar_servidor_temporal(),
+        )
+        sincronizacion = await registrar_consumidor(URL_SERVIDOR_TEMPORAL, "aforo", ETAPA_ESTACIONES)
+
+        diagnostico = Diagnostico(["duracion_ciclo", "lectura_hora", "busqueda", "escritura", "retraso_simulado"])
+        idx = await servidor.get_namespace_index(URI)
+        tarea_diagnostico = asyncio.create_task(publicar_diagnostico(servidor, idx, diagnostico, nombre_servidor="aforo"))
+
+        await ciclo_aforo(nodo_hora_simulada, caudal_var, estado_var, hora_var, fuente,
+                          diagnostico=diagnostico, calidad_var=calidad_var, sincronizacion=sincronizacion)
     except KeyboardInterrupt:
-        print("Servidor detenido por el usuario.")
+        _logger.info("Servidor detenido por el usuario.")
     finally:
-        await cliente_temporal.disconnect()
+        if tarea_diagnostico is not None:
+            tarea_diagnostico.cancel()
+        if sincronizacion is not None:
+            await sincronizacion.cerrar()
+        await GESTOR.liberar(URL_SERVIDOR_TEMPORAL)
         await servidor.stop()
+        if fuente is not None:
+            fuente.cerrar()
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -1,87 +1,256 @@
-from asyncua.sync import Client, Server
-
-def obtener_nodo_por_nombre(nodo, nombre_nodo):
-    for hijo in nodo.get_children():
-        browse_name = hijo.read_browse_name().Name
-        if browse_name == nombre_nodo:
-            return hijo
-    raise Exception(f"Nodo '{nombre_nodo}' no encontrado en el objeto.")
-
-def conectar_cliente(endpoint):
-    cliente = Client(endpoint)
-    cliente.connect()
-    print(f"Conectado a servidor OPC UA en: {endpoint}")
-    return cliente
-
-def configurar_servidor_integracion(endpoint, uri):
+import asyncio
+import logging
+import math
+from datetime import datetime, timedelta, timezone
+from asyncua import Server
+from conexiones import ERRORES_CONEXION, GESTOR
+from diagnostico import SIN_DIAGNOSTICO, Diagnostico, publicar_diagnostico, segundos_desde
+from estado_persistente import PuntoControl, a_texto, cargar_estado, de_texto, ruta_estado
+from exportador import crear_exportador
+from perfilado import configurar_logging, cronometrar, iniciar_perfilado
+from prediccion import ANTICIPACIONES_MIN, cargar_nucleo, configurar_prediccion
+from resolucion_nodos import resolver_nodos
+from sincronizacion import ETAPA_INTEGRACION, SIN_SINCRONIZACION, registrar_consumidor
+
+URL_PLUVIOMETRO = "opc.tcp://localhost:4841/es/upv/epsa/entornos/bla/pluviometro/"
+URL_AFORO = "opc.tcp://localhost:4842/es/upv/epsa/entornos/bla/estacion_aforo/"
+URL_TEMPORAL = "opc.tcp://localhost:4840/es/upv/epsa/entornos/bla/temporal/"
+ENDPOINT_INTEGRACION = "opc.tcp://localhost:4850/integracion/"
+URI_INTEGRACION = "http://www.epsa.upv.es/entornos/integracion"
+URI_ESTACIONES = "http://www.epsa.upv.es/entornos"
+URI_TEMPORAL = "http://www.epsa.upv.es/entornos/temporal"
+INTERVALO_LECTURA = 0.1
+# Tiempo simulado sin datos durante el que la alerta se sigue evaluando con el último valor
+# válido de una fuente; pasado ese tiempo la fuente cuenta como sin datos
+VIGENCIA_ULTIMO_VALIDO = timedelta(minutes=30)
+
+# Una fila por valor publicado distinto, para analizar la serie integrada fuera de línea
+COLUMNAS_EXPORTACION = [
+    ("hora_real", "timestamp"),
+    ("hora_simulada", "timestamp"),
+    ("precipitaciones_mm_h", "float64"),
+    ("caudal_m3_s", "float64"),
+    ("estado_alerta", "bool"),
+    *[(f"caudal_previsto_{minutos}min", "float64") for minutos in ANTICIPACIONES_MIN],
+    ("alerta_prevista", "bool"),
+]
+
+_logger = logging.getLogger("integracion")
+
+async def conectar_cliente(endpoint):
+    # Sesión compartida del gestor: se reconecta sola si el servidor se reinicia
+    return (await GESTOR.obtener(endpoint)).cliente
+
+async def configurar_servidor_integracion(endpoint, uri, estado=None):
     servidor = Server()
+    await servidor.init()
     servidor.set_endpoint(endpoint)
-    idx = servidor.register_namespace(uri)
+    idx = await servidor.register_namespace(uri)
 
-    integracion = servidor.nodes.objects.add_object(idx, "Integracion")
-    precipitaciones = integracion.add_variable(idx, "Precipitaciones_mm_h", 0.0)
-    caudal = integracion.add_variable(idx, "Caudal_m3_s", 0.0)
-    hora_simulada = integracion.add_variable(idx, "HoraSimulada", "")
-    estado_alerta = integracion.add_variable(idx, "EstadoAlerta", False)
+    integracion = await servidor.nodes.objects.add_object(idx, "Integracion")
+    precipitaciones = await integracion.add_variable(idx, "Precipitaciones_mm_h", 0.0)
+    caudal = await integracion.add_variable(idx, "Caudal_m3_s", 0.0)
+    hora_simulada = await integracion.add_variable(idx, "HoraSimulada", "")
+    estado_alerta = await integracion.add_variable(idx, "EstadoAlerta", False)
 
     for var in [precipitaciones, caudal, hora_simulada, estado_alerta]:
-        var.set_writable()
+        await var.set_writable()
+
+    # Caudal previsto a varias anticipaciones, con el núcleo ajustado por prediccion.py
+    prediccion = await configurar_prediccion(integracion, idx, *cargar_nucleo())
+
+    if estado is not None:
+        # Se publican los últimos valores antes de abrir el endpoint: la alerta no se apaga al reiniciar
+        await precipitaciones.write_value(estado["precipitaciones"])
+        await caudal.write_value(estado["caudal"])
+        await hora_simulada.write_value(estado["hora_simulada"])
+        await estado_alerta.write_value(estado["estado_alerta"])
+        if estado.get("prediccion") is not None:
+            await prediccion.restaurar(estado["prediccion"])
+
+    await servidor.start()
+    _logger.info("Servidor de integración iniciado en: %s", endpoint)
+    return servidor, precipitaciones, caudal, hora_simulada, estado_alerta, prediccion
+
+@cronometrar
+async def leer_valores(clientes, nodos, diagnostico=SIN_DIAGNOSTICO):
+    with diagnostico.medir("lectura"):
+        dato_hora = await nodos['hora_simulada'].read_data_value()
+        # El pluviómetro escribe la lluvia antes que su hora: leída después, la lluvia es al
+        # menos tan reciente como la hora que la acompaña
+        hora_lluvia = await nodos['hora_lluvia'].read_value()
+        precipitaciones = await nodos['precipitaciones'].read_value()
+        caudal = await nodos['caudal'].read_value()
+    retraso = segundos_desde(dato_hora.SourceTimestamp)
+    if retraso is not None:
+        diagnostico.registrar("retraso_simulado", retraso)
+    return precipitaciones, caudal, dato_hora.Value.Value, hora_lluvia
+
+def es_valido(valor):
+    return valor is not None and not math.isnan(valor)
+
+class UltimoValido:
+    """Último valor válido de una fuente, con el que se evalúa la alerta mientras falten datos.
+
+    Un hueco (NaN) no debe apagar la alerta, pero un valor antiguo tampoco debe mantenerla
+    indefinidamente: tras `vigencia` de tiempo simulado sin datos, o si el reloj vuelve atrás,
+    se descarta y la fuente cuenta como sin datos (None).
+    """
 
-    servidor.start()
-    print(f"Servidor de integración iniciado en: {endpoint}")
-    return servidor, precipitaciones, caudal, hora_simulada, estado_alerta
+    def __init__(self, vigencia=VIGENCIA_ULTIMO_VALIDO):
+        self.vigencia = vigencia
+        self.valor = None
+        self.hora = None
 
-def leer_valores(clientes, nodos):
-    precipitaciones = nodos['precipitaciones'].get_value()
-    caudal = nodos['caudal'].get_value()
-    hora_simulada = nodos['hora_simulada'].get_value().strftime('%Y-%m-%d %H:%M:%S')
-    return precipitaciones, caudal, hora_simulada
+    def actualizar(self, valor, hora):
+        if es_valido(valor):
+            self.valor, self.hora = valor, hora
+        elif self.hora is not None and not timedelta(0) <= hora - self.hora <= self.vigencia:
+            self.valor, self.hora = None, None
+        return self.valor
+
+    def estado(self):
+        return {"valor": self.valor, "hora": a_texto(self.hora)}
+
+    def restaurar(self, estado):
+        self.valor, self.hora = estado["valor"], de_texto(estado["hora"])
+
+def clave_publicacion(hora_simulada, precipitaciones, caudal, alerta):
+    """Clave para comparar publicaciones: NaN != NaN, así que los huecos se representan con None."""
+    return (hora_simulada, precipitaciones if es_valido(precipitaciones) else None,
+            caudal if es_valido(caudal) else None, alerta)
 
 def calcular_estado_alerta(precipitaciones, caudal):
-    return precipitaciones > 50 or caudal > 150
-
-def configurar_nodos_clientes(clientes):
-    nodos = {}
-    pluviometro = clientes['pluvio'].get_node("ns=2;i=1")
-    aforo = clientes['aforo'].get_node("ns=2;i=1")
-    nodos['precipitaciones'] = obtener_nodo_por_nombre(pluviometro, "Precipitaciones_mm_h")
-    nodos['caudal'] = obtener_nodo_por_nombre(aforo, "Caudal_m3_s")
-    nodos['hora_simulada'] = clientes['temporal'].get_node("ns=2;i=2")
-    return nodos
-
-def main():
+    # None: todavía no ha llegado ningún valor válido de esa fuente
+    return (precipitaciones is not None and precipitaciones > 50) or (caudal is not None and caudal > 150)
+
+async def configurar_nodos_clientes(clientes):
+    # Una única traducción de rutas (o una lectura de validación de la caché) por servidor
+    pluviometro, aforo, temporal = await asyncio.gather(
+        resolver_nodos(clientes['pluvio'], URI_ESTACIONES, ["Pluviometro/Precipitaciones_mm_h", "Pluviometro/Hora"]),
+        resolver_nodos(clientes['aforo'], URI_ESTACIONES, ["EstacionAforo/Caudal_m3_s"]),
+        resolver_nodos(clientes['temporal'], URI_TEMPORAL, ["HoraSimulada/HoraSimulada"]),
+    )
+    return {
+        'precipitaciones': pluviometro["Pluviometro/Precipitaciones_mm_h"],
+        'hora_lluvia': pluviometro["Pluviometro/Hora"],
+        'caudal': aforo["EstacionAforo/Caudal_m3_s"],
+        'hora_simulada': temporal["HoraSimulada/HoraSimulada"],
+    }
+
+async def ciclo_integracion(clientes, nodos, precipitaciones_var, caudal_var, hora_var, alerta_var, intervalo=INTERVALO_LECTURA, diagnostico=SIN_DIAGNOSTICO, prediccion=None, sincronizacion=SIN_SINCRONIZACION, exportador=None, punto_control=None, estado=None):
+    ultima_prevision = [None] * len(ANTICIPACIONES_MIN)
+    ultimo_publicado = None
+    # Últimos valores válidos de cada fuente; se restauran del punto de control para que un
+    # reinicio en mitad de un hueco de datos no apague la alerta
+    validos = {"precipitaciones": UltimoValido(), "caudal": UltimoValido()}
+    if estado is not None and estado.get("ultimos_validos") is not None:
+        for nombre, guardado in estado["ultimos_validos"].items():
+            validos[nombre].restaurar(guardado)
+    while True:
+        try:
+            with diagnostico.medir("duracion_ciclo"):
+                prec, caudal, hora_simulada, hora_lluvia = await leer_valores(clientes, nodos, diagnostico)
+                hora = hora_simulada.strftime('%Y-%m-%d %H:%M:%S')
+                prec_alerta = validos["precipitaciones"].actualizar(prec, hora_simulada)
+                caudal_alerta = validos["caudal"].actualizar(caudal, hora_simulada)
+                if prec_alerta is not prec or caudal_alerta is not caudal:
+                    _logger.debug("Faltan datos a las %s; la alerta se evalúa con los últimos válidos", hora)
+                alerta = calcular_estado_alerta(prec_alerta, caudal_alerta)
+
+                with diagnostico.medir("escritura"):
+                    await precipitaciones_var.write_value(prec)
+                    await caudal_var.write_value(caudal)
+                    await hora_var.write_value(hora)
+                    await alerta_var.write_value(alerta)
+
+                if prediccion is not None:
+                    with diagnostico.medir("prediccion"):
+                        prevision = await prediccion.actualizar(hora_simulada, prec, hora_lluvia)
+                    if prevision is not None:
+                        ultima_prevision = prevision
+                        _logger.debug("Caudal previsto: %s m³/s", ", ".join(f"{v:.1f}" for v in prevision))
+
+                publicado = clave_publicacion(hora_simulada, prec, caudal, alerta)
+                if publicado != ultimo_publicado:
+                    if exportador is not None:
+                        # Sólo encola: la escritura y la compresión van en el hilo del exportador
+                        alerta_prevista = None if ultima_prevision[0] is None else bool(max(ultima_prevision) > prediccion.umbral)
+                        exportador.exportar((datetime.now(timezone.utc), hora_simulada, prec, caudal, alerta,
+                                             *[None if v is None else float(v) for v in ultima_prevision], alerta_prevista))
+                        diagnostico.registrar_cantidad("cola_exportacion", exportador.pendientes())
+                    if punto_control is not None:
+                        punto_control.actualizar({
+                            "precipitaciones": prec, "caudal": caudal, "hora_simulada": hora, "estado_alerta": alerta,
+                            "prediccion": prediccion.estado() if prediccion is not None else None,
+                            "ultimos_validos": {nombre: valido.estado() for nombre, valido in validos.items()},
+                        })
+                    ultimo_publicado = publicado
+
+                _logger.debug("Hora: %s, Precipitaciones: %s mm/h, Caudal: %s m³/s, Alerta: %s",
+                              hora, prec, caudal, 'Activada' if alerta else 'Desactivada')
+            # Con el reloj en lockstep o libre, el tick no avanza hasta que se confirma
+            await sincronizacion.confirmar()
+        except ERRORES_CONEXION as e:
+            # El gestor de conexiones reconecta por debajo; se reintenta en el siguiente ciclo
+            _logger.warning("Sin conexión con alguna de las fuentes: %s", e)
+        await sincronizacion.esperar(intervalo)
+
+async def main():
+    configurar_logging()
+    await iniciar_perfilado("integracion")
     clientes = {
-        'pluvio': conectar_cliente("opc.tcp://localhost:4841/es/upv/epsa/entornos/bla/pluviometro/"),
-        'aforo': conectar_cliente("opc.tcp://localhost:4842/es/upv/epsa/entornos/bla/estacion_aforo/"),
-        'temporal': conectar_cliente("opc.tcp://localhost:4840/es/upv/epsa/entornos/bla/temporal/"),
+        'pluvio': await conectar_cliente(URL_PLUVIOMETRO),
+        'aforo': await conectar_cliente(URL_AFORO),
+        'temporal': await conectar_cliente(URL_TEMPORAL),
     }
 
+    servidor = None
+    tarea_diagnostico = None
+    exportador = None
+    # Últimos valores publicados, alerta y pronóstico, guardados periódicamente
+    ruta = ruta_estado("integracion")
+    punto_control = PuntoControl(ruta)
+    tarea_punto_control = None
+    # Etapa posterior a las estaciones: el reloj no le libera un tick hasta que ellas lo han publicado
+    sincronizacion = await registrar_consumidor(URL_TEMPORAL, "integracion", ETAPA_INTEGRACION)
+    estado = cargar_estado(ruta)
     try:
-        servidor, precipitaciones_var, caudal_var, hora_var, alerta_var = configurar_servidor_integracion(
-            "opc.tcp://localhost:4850/integracion/",
-            "http://www.epsa.upv.es/entornos/integracion"
+        servidor, precipitaciones_var, caudal_var, hora_var, alerta_var, prediccion = await configurar_servidor_integracion(
+            ENDPOINT_INTEGRACION, URI_INTEGRACION, estado
         )
+        tarea_punto_control = asyncio.create_task(punto_control.ejecutar())
 
-        nodos = configurar_nodos_clientes(clientes)
-
-        while True:
-            prec, caudal, hora = leer_valores(clientes, nodos)
+        nodos = await configurar_nodos_clientes(clientes)
 
-            precipitaciones_var.set_value(prec)
-            caudal_var.set_value(caudal)
-            hora_var.set_value(hora)
+        # Directorio con ENTORNOS_EXPORTACION; vacío para no exportar
+        exportador = crear_exportador("integracion", COLUMNAS_EXPORTACION)
 
-            alerta = calcular_estado_alerta(prec, caudal)
-            alerta_var.set_value(alerta)
+        diagnostico = Diagnostico(["duracion_ciclo", "lectura", "escritura", "prediccion", "retraso_simulado"],
+                                  cantidades=["cola_exportacion"])
+        idx = await servidor.get_namespace_index(URI_INTEGRACION)
+        tarea_diagnostico = asyncio.create_task(publicar_diagnostico(servidor, idx, diagnostico, nombre_servidor="integracion"))
 
-            print(f"Hora: {hora}, Precipitaciones: {prec} mm/h, Caudal: {caudal} m³/s, Alerta: {'Activada' if alerta else 'Desactivada'}")
+        await ciclo_integracion(clientes, nodos, precipitaciones_var, caudal_var, hora_var, alerta_var,
+                                diagnostico=diagnostico, prediccion=prediccion, sincronizacion=sincronizacion,
+                                exportador=exportador, punto_control=punto_control, estado=estado)
     except KeyboardInterrupt:
-        print("Servidor detenido por el usuario.")
+        _logger.info("Servidor detenido por el usuario.")
     finally:
-        for cliente in clientes.values():
-            cliente.disconnect()
-        servidor.stop()
-        print("Conexiones cerradas y servidor detenido.")
+        if tarea_diagnostico is not None:
+            tarea_diagnostico.cancel()
+        if tarea_punto_control is not None:
+            tarea_punto_control.cancel()
+            await asyncio.gather(tarea_punto_control, return_exceptions=True)
+            punto_control.cerrar()
+        if exportador is not None:
+            # Escribe el último lote y cierra el archivo sin bloquear el bucle de eventos
+            await asyncio.to_thread(exportador.cerrar)
+        await sincronizacion.cerrar()
+        await GESTOR.cerrar()
+        if servidor is not None:
+            await servidor.stop()
+        _logger.info("Conexiones cerradas y servidor detenido.")
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())
@@ -2,18 +2,54 @@ import asyncio
 import math
 import pandas as pd
 from datetime import datetime, timezone, timedelta
-from asyncua import Server, Client, ua
+from asyncua import Server, ua
 import numpy as np
+import logging
+from conexiones import GESTOR
+from estado_persistente import PuntoControl, a_texto, cargar_estado, de_texto, ruta_estado
+from perfilado import configurar_logging
+from resolucion_nodos import resolver_nodos
+
+_logger = logging.getLogger("integracion")
 
 # Ruta del archivo Excel
 archivo_excel = r"/home/alopalm/entornos/trabajo_final/Pluvi_metroChiva_29octubre2024.xlsx"
 
-# Leer las columnas A (hora) y B (precipitaciones) desde la fila 8
-df = pd.read_excel(archivo_excel, usecols=[0, 1], skiprows=7, nrows=289, engine='openpyxl')
-
-# Convertir la columna B (precipitaciones) en una lista de valores numéricos
-precipitaciones_lista = pd.to_numeric(df.iloc[:, 1], errors='coerce').dropna().tolist()
-precipitaciones_lista = [round(math.ceil(valor * 10) / 10, 1) for valor in precipitaciones_lista]
+def cargar_datos(ruta_excel):
+    """Lee el Excel del pluviómetro; devuelve (df, precipitaciones_lista)."""
+    # Leer las columnas A (hora) y B (precipitaciones) desde la fila 8
+    df = pd.read_excel(ruta_excel, usecols=[0, 1], skiprows=7, nrows=289, engine='openpyxl')
+
+    # Convertir la columna B (precipitaciones) en una lista de valores numéricos; las celdas
+    # vacías quedan como NaN en su posición para que el índice siga siendo el de la fila de df
+    precipitaciones_lista = pd.to_numeric(df.iloc[:, 1], errors='coerce').tolist()
+    precipitaciones_lista = [valor if math.isnan(valor) else round(math.ceil(valor * 10) / 10, 1)
+                             for valor in precipitaciones_lista]
+    return df, precipitaciones_lista
+
+def acumular_precipitacion(acumulado, inicio_ventana, ultima_procesada, hora_simulada, valor_precipitacion):
+    """Acumulado horario tras la muestra de `hora_simulada`.
+
+    Devuelve (acumulado, inicio_ventana, ultima_procesada). Un dato faltante (NaN) no suma,
+    pero la ventana avanza igual; si no, el acumulado sería NaN hasta cerrar la hora.
+    """
+    if math.isnan(valor_precipitacion):
+        valor_precipitacion = 0.0
+    if inicio_ventana is None:
+        inicio_ventana = hora_simulada
+
+    if ultima_procesada is not None and hora_simulada <= ultima_procesada:
+        # Tras reanudar, la suscripción vuelve a entregar la hora ya acumulada; y si el
+        # reloj ha empezado otra simulación anterior, la ventana guardada no vale
+        if hora_simulada < ultima_procesada:
+            acumulado = valor_precipitacion
+            inicio_ventana = hora_simulada
+    elif hora_simulada - inicio_ventana < timedelta(hours=1):
+        acumulado += valor_precipitacion
+    else:
+        acumulado = valor_precipitacion
+        inicio_ventana = hora_simulada
+    return acumulado, inicio_ventana, hora_simulada
 
 # Crear el servidor OPC UA
 servidor = Server()
@@ -24,21 +60,37 @@ async def registrar_espacio_nombres():
     return await servidor.register_namespace(uri)
 
 class SubscriptionHandler:
-    def __init__(self, precipitaciones, hora_variable, precipitacion_hora):
+    def __init__(self, df, precipitaciones_lista, precipitaciones, hora_variable, precipitacion_hora, punto_control=None, estado=None):
+        self.df = df
+        self.precipitaciones_lista = precipitaciones_lista
         self.precipitaciones = precipitaciones
         self.hora_variable = hora_variable
         self.precipitacion_hora = precipitacion_hora
+        self.punto_control = punto_control
         self.acumulacion_precipitaciones = 0.0
         self.ultima_hora_acumulada = None
+        self.ultima_hora_procesada = None
+        if estado is not None:
+            # Arranque en caliente: la ventana horaria sigue donde estaba antes del reinicio
+            self.acumulacion_precipitaciones = estado["acumulacion_precipitaciones"]
+            self.ultima_hora_acumulada = de_texto(estado["ultima_hora_acumulada"])
+            self.ultima_hora_procesada = de_texto(estado["ultima_hora_procesada"])
+
+    def estado(self):
+        return {
+            "acumulacion_precipitaciones": self.acumulacion_precipitaciones,
+            "ultima_hora_acumulada": a_texto(self.ultima_hora_acumulada),
+            "ultima_hora_procesada": a_texto(self.ultima_hora_procesada),
+        }
 
     async def datachange_notification(self, node, val, data):
         """Manejador de cambios de datos."""
-        print(f"Hora simulada recibida: {val}")
+        _logger.debug("Hora simulada recibida: %s", val)
         hora_simulada = val.replace(tzinfo=None)  # Eliminar la zona horaria
 
         # Buscar el valor de precipitaciones correspondiente
         encontrado = False
-        for i, fila in df.iterrows():
+        for i, fila in self.df.iterrows():
             hora_fila = fila.iloc[0]
             if isinstance(hora_fila, pd.Timestamp):
                 hora_fila = hora_fila.replace(second=0, microsecond=0)
@@ -46,27 +98,27 @@ class SubscriptionHandler:
                 hora_fila = pd.to_datetime(hora_fila).replace(second=0, microsecond=0)
 
             if hora_fila == hora_simulada:
-                valor_precipitacion = precipitaciones_lista[i]
-
-                # Actualizar los valores en el servidor
-                await self.precipitaciones.write_value(valor_precipitacion)
-                await self.hora_variable.write_value(val)
+                valor_precipitacion = self.precipitaciones_lista[i]
+                if math.isnan(valor_precipitacion):
+                    # Dato faltante: no se publica; acumular_precipitacion no lo suma
+                    _logger.warning("Dato de precipitaciones faltante para la hora simulada: %s", hora_simulada)
+                    await self.hora_variable.write_value(val)
+                else:
+                    # Actualizar los valores en el servidor
+                    await self.precipitaciones.write_value(valor_precipitacion)
+                    await self.hora_variable.write_value(val)
 
-                print(f"Actualizando precipitaciones a: {valor_precipitacion} mm/h")
-                print(f"Hora actualizada a: {hora_simulada}")
+                    _logger.debug("Actualizando precipitaciones a: %s mm/h, hora: %s", valor_precipitacion, hora_simulada)
 
                 # Actualizar acumulación
-                if self.ultima_hora_acumulada is None:
-                    self.ultima_hora_acumulada = hora_simulada
-
-                if hora_simulada - self.ultima_hora_acumulada < timedelta(hours=1):
-                    self.acumulacion_precipitaciones += valor_precipitacion
-                else:
-                    self.acumulacion_precipitaciones = valor_precipitacion
-                    self.ultima_hora_acumulada = hora_simulada
+                self.acumulacion_precipitaciones, self.ultima_hora_acumulada, self.ultima_hora_procesada = acumular_precipitacion(
+                    self.acumulacion_precipitaciones, self.ultima_hora_acumulada, self.ultima_hora_procesada,
+                    hora_simulada, valor_precipitacion)
+                if self.punto_control is not None:
+                    self.punto_control.actualizar(self.estado())
 
                 await self.precipitacion_hora.write_value(round(self.acumulacion_precipitaciones, 1))
-                print(f"Acumulación de precipitaciones: {round(self.acumulacion_precipitaciones, 1)} mm")
+                _logger.debug("Acumulación de precipitaciones: %s mm", round(self.acumulacion_precipitaciones, 1))
                 encontrado = True
                 break
 
@@ -75,7 +127,7 @@ class SubscriptionHandler:
             await self.precipitaciones.write_value(0.0)
             await self.precipitacion_hora.write_value(0.0)
             await self.hora_variable.write_value(val)
-            print("No se encontró coincidencia para la hora simulada. Valores por defecto enviados.")
+            _logger.warning("No se encontró coincidencia para la hora simulada. Valores por defecto enviados.")
 
 async def iniciar_servidor():
     """Configura e inicia el servidor."""
@@ -96,39 +148,55 @@ async def iniciar_servidor():
     await precipitacion_hora.set_writable()
 
     await servidor.start()
-    print("Servidor OPC UA del Pluviómetro iniciado en:", servidor.endpoint)
+    _logger.info("Servidor OPC UA del Pluviómetro iniciado en: %s", servidor.endpoint)
 
     return precipitaciones, hora_variable, precipitacion_hora
 
 async def main():
+    configurar_logging()
     precipitaciones, hora_variable, precipitacion_hora = await iniciar_servidor()
 
+    # Acumulado horario guardado periódicamente para sobrevivir a un reinicio
+    ruta = ruta_estado("integracion_acumulado")
+    estado = cargar_estado(ruta)
+    punto_control = PuntoControl(ruta)
+    tarea_punto_control = asyncio.create_task(punto_control.ejecutar())
+    if estado is not None:
+        await precipitacion_hora.write_value(round(estado["acumulacion_precipitaciones"], 1))
+
     # Conectar al servidor temporal como cliente
     url_servidor_temporal = "opc.tcp://localhost:4840/"
-    cliente_temporal = Client(url_servidor_temporal)
 
     try:
-        async with cliente_temporal:
-            print("Conectado al servidor temporal.")
+        # El Excel se lee aquí y no al importar el módulo (lo importa también el benchmark)
+        df, precipitaciones_lista = await asyncio.to_thread(cargar_datos, archivo_excel)
+
+        # Sesión gestionada: si el servidor temporal se reinicia, el gestor reconecta y
+        # vuelve a crear la suscripción
+        conexion = await GESTOR.obtener(url_servidor_temporal)
+        _logger.info("Conectado al servidor temporal.")
 
-            # Obtener el nodo de hora simulada
-            nodo_hora_simulada = cliente_temporal.get_node("ns=2;i=2")
-            print(f"Nodo de hora simulada obtenido: {nodo_hora_simulada}")
+        # Obtener el nodo de hora simulada por su ruta
+        nodos = await resolver_nodos(conexion.cliente, "http://www.epsa.upv.es/entornos/temporal", ["HoraSimulada/HoraSimulada"])
+        nodo_hora_simulada = nodos["HoraSimulada/HoraSimulada"]
+        _logger.info("Nodo de hora simulada obtenido: %s", nodo_hora_simulada)
 
-            # Crear manejador de suscripciones
-            handler = SubscriptionHandler(precipitaciones, hora_variable, precipitacion_hora)
+        # Crear manejador de suscripciones
+        handler = SubscriptionHandler(df, precipitaciones_lista, precipitaciones, hora_variable, precipitacion_hora, punto_control, estado)
 
-            # Crear suscripción
-            subscription = await cliente_temporal.create_subscription(100, handler)
-            await subscription.subscribe_data_change(nodo_hora_simulada)
-            await asyncio.Future()  # Mantener el servidor en ejecución
+        # Crear suscripción (según ENTORNOS_PERFIL_SUSCRIPCION)
+        await conexion.suscribir(handler, [nodo_hora_simulada])
+        await asyncio.Future()  # Mantener el servidor en ejecución
 
     except KeyboardInterrupt:
-        print("Servidor detenido.")
+        _logger.info("Servidor detenido.")
     finally:
-        await cliente_temporal.disconnect()
+        tarea_punto_control.cancel()
+        await asyncio.gather(tarea_punto_control, return_exceptions=True)
+        punto_control.cerrar()
+        await GESTOR.cerrar()
         await servidor.stop()
-        print("Servidor del Pluviómetro detenido.")
+        _logger.info("Servidor del Pluviómetro detenido.")
 
 # Corre el código solo si es el archivo principal
 if __name__ == "__main__":
@@ -1,31 +1,76 @@
 import time
-import pandas as pd
-import math
 import asyncio
-from asyncua import Server, Client
+import logging
+from asyncua import Server, ua
+from carga_streaming import CargadorVentana, FuenteEnMemoria, LectorExcel, agregar_estado_carga, cargar_en_segundo_plano
+from conexiones import ERRORES_CONEXION, GESTOR
+from control_calidad import MUESTRAS_PLANO, describir_calidad, evaluar_calidad, resumen_calidad
+from diagnostico import SIN_DIAGNOSTICO, Diagnostico, publicar_diagnostico, segundos_desde
+from perfilado import configurar_logging, cronometrar, iniciar_perfilado
+from resolucion_nodos import resolver_nodos
+from sincronizacion import ETAPA_ESTACIONES, SIN_SINCRONIZACION, registrar_consumidor
 
 EXCEL_PATH = "/home/alopalm/entornos/trabajo_final/Pluvi_metroChiva_29octubre2024.xlsx"
 TEMPORAL_SERVER_URL = "opc.tcp://localhost:4840/es/upv/epsa/entornos/bla/temporal/"
 PLUVIOMETRO_SERVER_URL = "opc.tcp://localhost:4841/es/upv/epsa/entornos/bla/pluviometro/"
 NAMESPACE_URI = "http://www.epsa.upv.es/entornos"
+TEMPORAL_NAMESPACE_URI = "http://www.epsa.upv.es/entornos/temporal"
 SLEEP_INTERVAL = 1
+# Saltos mayores que éste respecto a las dos muestras vecinas se marcan como pico
+UMBRAL_PICO_PRECIPITACION = 60.0
+# Filas que lee la estación del Excel: un día de muestras cincominutales, de 00:00 a 24:00
+FILAS_EXCEL = 289
 
-def cargar_datos_excel(ruta_excel):
-    df = pd.read_excel(ruta_excel, usecols=[0, 1], skiprows=7, nrows=289, engine='openpyxl')
-    precipitaciones_lista = pd.to_numeric(df.iloc[:, 1], errors='coerce').dropna().tolist()
-    precipitaciones_lista = [round(math.ceil(valor * 10) / 10, 1) for valor in precipitaciones_lista]
-    return df, precipitaciones_lista
+_logger = logging.getLogger("pluviometro")
 
-def buscar_precipitacion_por_hora(df, precipitaciones, hora_simulada):
-    for i, fila in df.iterrows():
-        hora_fila = pd.to_datetime(fila.iloc[0]).replace(second=0, microsecond=0)
-        if hora_fila.time() == hora_simulada.time():
-            return precipitaciones[i]
-    return None
+# pandas y numpy se importan al usarse, para que el servidor escuche cuanto antes
 
-async def iniciar_servidor_pluviometro():
+def cargar_datos_excel(ruta_excel, filas=FILAS_EXCEL):
+    """Carga el Excel del pluviómetro en memoria; con filas=None, la hoja completa."""
+    import pandas as pd
+
+    df = preparar_datos_excel(pd.read_excel(ruta_excel, usecols=[0, 1], skiprows=7, nrows=filas, engine='openpyxl'))
+    _logger.info("Control de calidad: %s", resumen_calidad(df['Calidad']))
+    return df
+
+def fuente_en_memoria(df):
+    """Consulta por hora de un DataFrame ya cargado (cargar_datos_excel o datos sintéticos)."""
+    return FuenteEnMemoria(df, 0)
+
+def preparar_datos_excel(df):
+    import numpy as np
+    import pandas as pd
+
+    precipitaciones = pd.to_numeric(df.iloc[:, 1], errors='coerce')
+    df['Precipitacion'] = (np.ceil(precipitaciones * 10) / 10).round(1)
+    # Sin lluvia el pluviómetro marca 0 durante horas: no es un sensor bloqueado
+    df['Calidad'] = evaluar_calidad(precipitaciones.to_numpy(), pd.to_datetime(df.iloc[:, 0], errors='coerce').to_numpy(),
+                                    umbral_pico=UMBRAL_PICO_PRECIPITACION, valores_planos_validos=(0.0,))
+    return df
+
+def abrir_datos_excel(ruta_excel):
+    # La hoja completa (sin límite de filas) con sólo una ventana de bloques en memoria; el
+    # contexto da al control de calidad las muestras vecinas de cada bloque
+    return CargadorVentana(LectorExcel(ruta_excel, preparar=preparar_datos_excel, skiprows=7, usecols=[0, 1],
+                                       contexto=MUESTRAS_PLANO))
+
+def precipitacion_de(filas):
+    """(precipitación, código de calidad) de la primera fila, o None si no hay ninguna."""
+    if filas.empty:
+        return None
+    return float(filas['Precipitacion'].iloc[0]), int(filas['Calidad'].iloc[0])
+
+@cronometrar
+async def buscar_precipitacion_por_hora(fuente, hora_simulada):
+    """Devuelve (precipitación, código de calidad) para la hora simulada, o None si no hay fila.
+
+    Se busca por fecha y hora completas, en memoria o en la ventana de bloques (CargadorVentana).
+    """
+    return precipitacion_de(await fuente.buscar(hora_simulada.replace(second=0, microsecond=0)))
+
+async def iniciar_servidor_pluviometro(endpoint=PLUVIOMETRO_SERVER_URL):
     servidor = Server()
-    servidor.set_endpoint(PLUVIOMETRO_SERVER_URL)
+    servidor.set_endpoint(endpoint)
     await servidor.init()
     idx = await servidor.register_namespace(NAMESPACE_URI)
 
@@ -34,45 +79,88 @@ async def iniciar_servidor_pluviometro():
     await precipitaciones.set_writable()
     hora_variable = await pluviometro.add_variable(idx, "Hora", "")
     await hora_variable.set_writable()
+    estado_carga = await agregar_estado_carga(pluviometro, idx)
+    calidad = await pluviometro.add_variable(idx, "Calidad", 0, varianttype=ua.VariantType.UInt16)
 
     await servidor.start()
-    print(f"Servidor OPC UA del Pluviómetro iniciado en {PLUVIOMETRO_SERVER_URL}")
-    return servidor, precipitaciones, hora_variable
-
-async def conectar_servidor_temporal():
-    cliente = Client(TEMPORAL_SERVER_URL)
-    await cliente.connect()
-    nodo_hora_simulada = cliente.get_node("ns=2;i=2")
-    print(f"Conectado al servidor temporal en {TEMPORAL_SERVER_URL}")
+    _logger.info("Servidor OPC UA del Pluviómetro iniciado en %s", endpoint)
+    return servidor, precipitaciones, hora_variable, estado_carga, calidad
+
+async def conectar_servidor_temporal(url=TEMPORAL_SERVER_URL):
+    cliente = (await GESTOR.obtener(url)).cliente
+    nodos = await resolver_nodos(cliente, TEMPORAL_NAMESPACE_URI, ["HoraSimulada/HoraSimulada"])
+    nodo_hora_simulada = nodos["HoraSimulada/HoraSimulada"]
+    _logger.info("Conectado al servidor temporal en %s", url)
     return cliente, nodo_hora_simulada
 
-async def main():
-    df, precipitaciones_lista = cargar_datos_excel(EXCEL_PATH)
-    servidor, nodo_precipitaciones, nodo_hora = await iniciar_servidor_pluviometro()
-    cliente_temporal, nodo_hora_simulada = await conectar_servidor_temporal()
+async def ciclo_pluviometro(fuente, nodo_hora_simulada, nodo_precipitaciones, nodo_hora, intervalo=SLEEP_INTERVAL, diagnostico=SIN_DIAGNOSTICO, nodo_calidad=None, sincronizacion=SIN_SINCRONIZACION):
+    while True:
+        try:
+            with diagnostico.medir("duracion_ciclo"):
+                with diagnostico.medir("lectura_hora"):
+                    dato_hora = await nodo_hora_simulada.read_data_value()
+                retraso = segundos_desde(dato_hora.SourceTimestamp)
+                if retraso is not None:
+                    diagnostico.registrar("retraso_simulado", retraso)
+                hora_simulada = dato_hora.Value.Value.replace(tzinfo=None)
 
-    try:
-        while True:
-            hora_simulada = await nodo_hora_simulada.read_value()
-            hora_simulada = hora_simulada.replace(tzinfo=None)
+                with diagnostico.medir("busqueda"):
+                    resultado = await buscar_precipitacion_por_hora(fuente, hora_simulada)
 
-            valor_precipitacion = buscar_precipitacion_por_hora(df, precipitaciones_lista, hora_simulada)
+                if resultado is not None:
+                    valor_precipitacion, calidad = resultado
+                    with diagnostico.medir("escritura"):
+                        await nodo_precipitaciones.write_value(valor_precipitacion)
+                        await nodo_hora.write_value(hora_simulada.strftime('%H:%M:%S'))
+                        if nodo_calidad is not None:
+                            await nodo_calidad.write_value(ua.Variant(calidad, ua.VariantType.UInt16))
+                    _logger.debug("Precipitaciones: %s mm/h | Hora: %s | Calidad: %s",
+                                  valor_precipitacion, hora_simulada, describir_calidad(calidad))
+                else:
+                    _logger.warning("No se encontró una coincidencia para la hora simulada: %s", hora_simulada)
+            # Con el reloj en lockstep o libre, el tick no avanza hasta que se confirma
+            await sincronizacion.confirmar()
+        except ERRORES_CONEXION as e:
+            # El gestor de conexiones reconecta por debajo; se reintenta en el siguiente ciclo
+            _logger.warning("Sin conexión con el servidor temporal: %s", e)
 
-            if valor_precipitacion is not None:
-                await nodo_precipitaciones.write_value(valor_precipitacion)
-                await nodo_hora.write_value(hora_simulada.strftime('%H:%M:%S'))
-                print(f"Precipitaciones: {valor_precipitacion} mm/h | Hora: {hora_simulada.strftime('%H:%M:%S')}")
-            else:
-                print(f"No se encontró una coincidencia para la hora simulada: {hora_simulada}")
+        await sincronizacion.esperar(intervalo)
+
+async def main():
+    configurar_logging()
+    await iniciar_perfilado("pluviometro")
+    # El endpoint se abre antes de cargar los datos; la carga corre en un hilo a la vez que
+    # la conexión con el servidor temporal, y se publica en cuanto ambas terminan
+    servidor, nodo_precipitaciones, nodo_hora, estado_carga, nodo_calidad = await iniciar_servidor_pluviometro()
+    fuente = None
+    sincronizacion = None
+    tarea_diagnostico = None
+    try:
+        # Dentro del try: si falla la conexión, el servidor ya iniciado también se detiene
+        fuente, (cliente_temporal, nodo_hora_simulada) = await asyncio.gather(
+            cargar_en_segundo_plano(estado_carga, abrir_datos_excel, EXCEL_PATH),
+            conectar_servidor_temporal(),
+        )
+        sincronizacion = await registrar_consumidor(TEMPORAL_SERVER_URL, "pluviometro", ETAPA_ESTACIONES)
 
-            await asyncio.sleep(SLEEP_INTERVAL)
+        diagnostico = Diagnostico(["duracion_ciclo", "lectura_hora", "busqueda", "escritura", "retraso_simulado"])
+        idx = await servidor.get_namespace_index(NAMESPACE_URI)
+        tarea_diagnostico = asyncio.create_task(publicar_diagnostico(servidor, idx, diagnostico, nombre_servidor="pluviometro"))
 
+        await ciclo_pluviometro(fuente, nodo_hora_simulada, nodo_precipitaciones, nodo_hora,
+                                diagnostico=diagnostico, nodo_calidad=nodo_calidad, sincronizacion=sincronizacion)
     except KeyboardInterrupt:
-        print("Servidor detenido manualmente.")
+        _logger.info("Servidor detenido manualmente.")
     finally:
-        await cliente_temporal.disconnect()
+        if tarea_diagnostico is not None:
+            tarea_diagnostico.cancel()
+        if sincronizacion is not None:
+            await sincronizacion.cerrar()
+        await GESTOR.liberar(TEMPORAL_SERVER_URL)
         await servidor.stop()
-        print("Servidor OPC UA del Pluviómetro detenido.")
+        if fuente is not None:
+            fuente.cerrar()
+        _logger.info("Servidor OPC UA del Pluviómetro detenido.")
 
 if __name__ == "__main__":
     asyncio.run(main())
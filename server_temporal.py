@@ -1,27 +1,41 @@
 import asyncio
+import logging
 from asyncua import Server
+from estado_persistente import PuntoControl, a_texto, cargar_estado, de_texto, ruta_estado
+from perfilado import configurar_logging
 from datetime import datetime, timedelta
 
+_logger = logging.getLogger("temporal")
+
 # Función principal para ejecutar el servidor OPC UA
 async def main():
-    # Pedir la fecha y hora de inicio al usuario
-    fecha_hora_str = input("Introduce la fecha y hora de inicio de la simulación (formato DD/MM/YYYY HH:MM:SS): ")
-    try:
-        # Convertir la fecha y hora de inicio en un objeto datetime
-        hora_inicio = datetime.strptime(fecha_hora_str, "%d/%m/%Y %H:%M:%S")
-    except ValueError:
-        print("Formato de fecha y hora inválido. Usando la fecha y hora actual como valor predeterminado.")
-        hora_inicio = datetime.now().replace(second=0, microsecond=0)  # Usar la fecha y hora actual si el formato es incorrecto
-
-    print(f"Hora de inicio de la simulación: {hora_inicio}")
-
-    # Pedir la velocidad de simulación (número de minutos de simulación por cada minuto real)
-    velocidad_str = input("Introduce la velocidad de simulación (número de minutos simulados por minuto real): ")
-    try:
-        velocidad = int(velocidad_str)
-    except ValueError:
-        print("Valor inválido para la velocidad. Usando velocidad 1 por defecto.")
-        velocidad = 1  # Si la entrada no es válida, usar velocidad 1 como predeterminado
+    configurar_logging()
+    # Si hay punto de control de una ejecución anterior, se reanuda sin preguntar
+    ruta = ruta_estado("temporal")
+    estado = cargar_estado(ruta)
+    if estado is not None:
+        hora_inicio = de_texto(estado["hora_actual"])
+        velocidad = estado["velocidad"]
+        _logger.info("Reanudando la simulación en %s con velocidad %s", hora_inicio, velocidad)
+    else:
+        # Pedir la fecha y hora de inicio al usuario
+        fecha_hora_str = input("Introduce la fecha y hora de inicio de la simulación (formato DD/MM/YYYY HH:MM:SS): ")
+        try:
+            # Convertir la fecha y hora de inicio en un objeto datetime
+            hora_inicio = datetime.strptime(fecha_hora_str, "%d/%m/%Y %H:%M:%S")
+        except ValueError:
+            _logger.warning("Formato de fecha y hora inválido. Usando la fecha y hora actual como valor predeterminado.")
+            hora_inicio = datetime.now().replace(second=0, microsecond=0)  # Usar la fecha y hora actual si el formato es incorrecto
+
+        _logger.info("Hora de inicio de la simulación: %s", hora_inicio)
+
+        # Pedir la velocidad de simulación (número de minutos de simulación por cada minuto real)
+        velocidad_str = input("Introduce la velocidad de simulación (número de minutos simulados por minuto real): ")
+        try:
+            velocidad = int(velocidad_str)
+        except ValueError:
+            _logger.warning("Valor inválido para la velocidad. Usando velocidad 1 por defecto.")
+            velocidad = 1  # Si la entrada no es válida, usar velocidad 1 como predeterminado
 
     # Crear el servidor OPC UA
     servidor = Server()
@@ -43,7 +57,11 @@ async def main():
 
     # Iniciar el servidor
     await servidor.start()
-    print(f"Servidor OPC UA iniciado en {servidor.endpoint}")
+    _logger.info("Servidor OPC UA iniciado en %s", servidor.endpoint)
+
+    # Guardar periódicamente la posición del reloj (borrar el archivo para empezar de cero)
+    punto_control = PuntoControl(ruta)
+    tarea_punto_control = asyncio.create_task(punto_control.ejecutar())
 
     try:
         # Inicializar la hora simulada
@@ -55,20 +73,24 @@ async def main():
 
             # Escribir el nuevo valor en la variable
             await hora_simulada.write_value(hora_actual)
+            punto_control.actualizar({"hora_actual": a_texto(hora_actual), "velocidad": velocidad})
 
-            # Imprimir la hora simulada en consola
-            print(f"Hora simulada: {hora_actual.strftime('%Y-%m-%d %H:%M:%S')}")
+            # Registrar la hora simulada (nivel DEBUG, limitado en frecuencia)
+            _logger.debug("Hora simulada: %s", hora_actual)
 
             # Esperar 1 segundo en tiempo real antes de actualizar la hora simulada
             await asyncio.sleep(1)
 
     except Exception as e:
-        print(f"Ocurrió un error: {e}")
+        _logger.exception("Ocurrió un error: %s", e)
 
     finally:
         # Detener el servidor cuando se interrumpe el ciclo
+        tarea_punto_control.cancel()
+        await asyncio.gather(tarea_punto_control, return_exceptions=True)
+        punto_control.cerrar()
         await servidor.stop()
-        print("Servidor detenido")
+        _logger.info("Servidor detenido")
 
 # Ejecutar la función principal
 if __name__ == "__main__":
@@ -1,13 +1,24 @@
 import asyncio
+import logging
+import time
 from asyncua import Server
+from diagnostico import SIN_DIAGNOSTICO, Diagnostico, publicar_diagnostico
+from estado_persistente import PuntoControl, a_texto, cargar_estado, de_texto, ruta_estado
+from perfilado import configurar_logging, iniciar_perfilado
+from sincronizacion import MODO_LIBRE, MODO_LOCKSTEP, MODO_RELOJ, SincronizacionTicks
 from datetime import datetime, timedelta
 
+_logger = logging.getLogger("temporal")
+
+# Segundos reales entre ticks en los modos tiempo_real y lockstep
+PERIODO_TICK = 1
+
 def obtener_hora_inicio():
     fecha_hora_str = input("Introduce la fecha y hora de inicio de la simulación (formato DD/MM/YYYY HH:MM:SS): ")
     try:
         return datetime.strptime(fecha_hora_str, "%d/%m/%Y %H:%M:%S")
     except ValueError:
-        print("Formato de fecha y hora inválido. Usando la fecha y hora actual como valor predeterminado.")
+        _logger.warning("Formato de fecha y hora inválido. Usando la fecha y hora actual como valor predeterminado.")
         return datetime.now().replace(second=0, microsecond=0)
 
 def obtener_velocidad_simulacion():
@@ -15,7 +26,7 @@ def obtener_velocidad_simulacion():
     try:
         return int(velocidad_str)
     except ValueError:
-        print("Valor inválido para la velocidad. Usando velocidad 1 por defecto.")
+        _logger.warning("Valor inválido para la velocidad. Usando velocidad 1 por defecto.")
         return 1
 
 async def configurar_servidor(endpoint, uri):
@@ -31,35 +42,90 @@ async def agregar_variable_hora_simulada(servidor, idx, hora_inicio):
     await hora_simulada.set_writable()
     return hora_simulada
 
-async def iniciar_simulacion(servidor, hora_simulada, hora_inicio, velocidad):
+async def esperar_siguiente_tick(modo, inicio_tick):
+    if modo == MODO_LIBRE:
+        # Sin pausa: el ritmo lo marca el consumidor más lento; sólo se cede el bucle
+        await asyncio.sleep(0)
+    elif modo == MODO_LOCKSTEP:
+        # Lo que se haya tardado en confirmar el tick cuenta dentro del periodo
+        await asyncio.sleep(max(0.0, inicio_tick + PERIODO_TICK - time.monotonic()))
+    else:
+        await asyncio.sleep(PERIODO_TICK)
+
+def estado_reloj(hora_actual, velocidad, tick):
+    return {"hora_actual": a_texto(hora_actual), "velocidad": velocidad, "tick": tick}
+
+async def iniciar_simulacion(servidor, hora_simulada, hora_inicio, velocidad, diagnostico=SIN_DIAGNOSTICO, sincronizacion=None,
+                             punto_control=None, tick_inicial=0):
     hora_actual = hora_inicio
+    inicio_real = time.monotonic()
+    ticks = 0
     try:
         while True:
-            hora_actual += timedelta(minutes=5 * velocidad)
-            await hora_simulada.write_value(hora_actual)
-            print(f"Hora simulada: {hora_actual.strftime('%Y-%m-%d %H:%M:%S')}")
-            await asyncio.sleep(1)
+            inicio_tick = time.monotonic()
+            with diagnostico.medir("duracion_tick"):
+                hora_actual += timedelta(minutes=5 * velocidad)
+                with diagnostico.medir("escritura"):
+                    await hora_simulada.write_value(hora_actual)
+                if sincronizacion is None or sincronizacion.modo != MODO_LIBRE:
+                    # Desfase entre el reloj simulado y el real: cada tick debería caer en un segundo exacto
+                    diagnostico.registrar("retraso_simulado", time.monotonic() - inicio_real - ticks)
+                ticks += 1
+                if sincronizacion is not None:
+                    # La hora ya está escrita: los consumidores que despierten con el tick la leen nueva
+                    with diagnostico.medir("espera_consumidores"):
+                        await sincronizacion.publicar(tick_inicial + ticks)
+                if punto_control is not None:
+                    punto_control.actualizar(estado_reloj(hora_actual, velocidad, tick_inicial + ticks))
+                _logger.debug("Hora simulada: %s", hora_actual)
+            await esperar_siguiente_tick(sincronizacion.modo if sincronizacion is not None else None, inicio_tick)
     except Exception as e:
-        print(f"Ocurrió un error: {e}")
+        _logger.error("Ocurrió un error: %s", e)
     finally:
         await servidor.stop()
-        print("Servidor detenido")
+        _logger.info("Servidor detenido")
 
 async def main():
-    hora_inicio = obtener_hora_inicio()
-    print(f"Hora de inicio de la simulación: {hora_inicio}")
+    configurar_logging()
+    # Tras un reinicio se sigue donde se quedó el reloj, sin volver a preguntar
+    ruta = ruta_estado("temporal")
+    estado = cargar_estado(ruta)
+    if estado is not None:
+        hora_inicio, velocidad, tick_inicial = de_texto(estado["hora_actual"]), estado["velocidad"], estado.get("tick", 0)
+        _logger.info("Reanudando la simulación en %s (velocidad %s, tick %d)", hora_inicio, velocidad, tick_inicial)
+    else:
+        hora_inicio = obtener_hora_inicio()
+        _logger.info("Hora de inicio de la simulación: %s", hora_inicio)
+        velocidad = obtener_velocidad_simulacion()
+        tick_inicial = 0
 
-    velocidad = obtener_velocidad_simulacion()
-    
     endpoint = "opc.tcp://localhost:4841/freeopcua/server/"
     uri = "http://www.epsa.upv.es/entornos/temporal"
 
     servidor, idx = await configurar_servidor(endpoint, uri)
     hora_simulada = await agregar_variable_hora_simulada(servidor, idx, hora_inicio)
+    # Modo del reloj con ENTORNOS_MODO_RELOJ (tiempo_real, lockstep o libre)
+    sincronizacion = SincronizacionTicks(MODO_RELOJ, tick_inicial=tick_inicial)
+    await sincronizacion.configurar(servidor, idx)
 
     await servidor.start()
-    print(f"Servidor OPC UA iniciado en {servidor.endpoint}")
-    await iniciar_simulacion(servidor, hora_simulada, hora_inicio, velocidad)
+    _logger.info("Servidor OPC UA iniciado en %s (reloj en modo %s)", servidor.endpoint, sincronizacion.modo)
+    await iniciar_perfilado("temporal")
+
+    diagnostico = Diagnostico(["duracion_tick", "escritura", "espera_consumidores", "retraso_simulado"])
+    tarea_diagnostico = asyncio.create_task(publicar_diagnostico(servidor, idx, diagnostico, nombre_servidor="temporal"))
+    # Para empezar una simulación nueva basta con borrar el archivo de estado
+    punto_control = PuntoControl(ruta)
+    tarea_punto_control = asyncio.create_task(punto_control.ejecutar())
+    try:
+        await iniciar_simulacion(servidor, hora_simulada, hora_inicio, velocidad, diagnostico, sincronizacion,
+                                 punto_control, tick_inicial)
+    finally:
+        tarea_diagnostico.cancel()
+        # Como en los demás servicios: la tarea termina antes del último guardado
+        tarea_punto_control.cancel()
+        await asyncio.gather(tarea_punto_control, return_exceptions=True)
+        punto_control.cerrar()
 
 if __name__ == "__main__":
     asyncio.run(main())
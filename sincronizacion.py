@@ -0,0 +1,289 @@
+import asyncio
+import logging
+import os
+from asyncua import ua, uamethod
+from conexiones import ERRORES_CONEXION, GESTOR
+from perfiles_suscripcion import PerfilSuscripcion
+from resolucion_nodos import resolver_nodos
+
+# Modos del reloj simulado:
+#   tiempo_real: un tick por segundo real, sin esperar a nadie (comportamiento original)
+#   lockstep:    un tick por segundo como máximo, pero no avanza hasta que lo confirman los consumidores
+#   libre:       avanza en cuanto lo confirman los consumidores, tan rápido como el más lento
+MODO_TIEMPO_REAL = "tiempo_real"
+MODO_LOCKSTEP = "lockstep"
+MODO_LIBRE = "libre"
+MODOS = (MODO_TIEMPO_REAL, MODO_LOCKSTEP, MODO_LIBRE)
+
+MODO_RELOJ = os.environ.get("ENTORNOS_MODO_RELOJ", MODO_TIEMPO_REAL)
+# Segundos que el reloj espera la confirmación de una etapa antes de seguir sin ella
+TIEMPO_MAXIMO_CONFIRMACION = float(os.environ.get("ENTORNOS_TIEMPO_MAXIMO_TICK", "5.0"))
+# Un consumidor que deja vencer tantos ticks seguidos se da de baja
+VENCIMIENTOS_PARA_BAJA = 3
+
+# Las etapas se liberan en orden: la integración lee lo que publican las estaciones,
+# así que no debe ver un tick hasta que las estaciones lo han confirmado.
+ETAPA_ESTACIONES = 0
+ETAPA_INTEGRACION = 1
+ETAPAS_MAXIMAS = 4
+
+URI_TEMPORAL = "http://www.epsa.upv.es/entornos/temporal"
+OBJETO_SINCRONIZACION = "Sincronizacion"
+# El canal de control del reloj no sigue el perfil de suscripción del despliegue: con una
+# publicación más lenta, en lockstep y en modo libre cada tick esperaría lo mismo que ella
+PERFIL_SINCRONIZACION = PerfilSuscripcion(10, 0, 1, True, None, 0.0)
+
+_logger = logging.getLogger("sincronizacion")
+
+
+class _Consumidor:
+    __slots__ = ("nombre", "etapa", "confirmado", "vencimientos")
+
+    def __init__(self, nombre, etapa, confirmado):
+        self.nombre = nombre
+        self.etapa = etapa
+        self.confirmado = confirmado
+        self.vencimientos = 0
+
+
+class SincronizacionTicks:
+    """Lado del servidor temporal: anuncia cada tick y espera a que lo confirmen los consumidores.
+
+    Publica bajo Objects/Sincronizacion las variables Modo, Tick y TicksLiberados (el último
+    tick liberado para cada etapa, en un único valor para que un consumidor nunca vea un
+    tick nuevo con la etapa de otro) y los métodos RegistrarConsumidor(nombre, etapa),
+    ConfirmarTick(nombre, tick) y DarDeBaja(nombre).
+    """
+
+    def __init__(self, modo=MODO_RELOJ, tiempo_maximo=TIEMPO_MAXIMO_CONFIRMACION, tick_inicial=0):
+        if modo not in MODOS:
+            raise ValueError(f"Modo de reloj desconocido '{modo}', debe ser uno de {MODOS}")
+        self.modo = modo
+        self.tiempo_maximo = tiempo_maximo
+        self.consumidores = {}
+        # Un reloj reanudado desde su punto de control sigue numerando donde lo dejó
+        self.tick = tick_inicial
+        self.liberados = [tick_inicial] * ETAPAS_MAXIMAS
+        self._cambio = asyncio.Condition()
+
+    async def configurar(self, servidor, idx):
+        objeto = await servidor.nodes.objects.add_object(idx, OBJETO_SINCRONIZACION)
+        self.nodo_modo = await objeto.add_variable(idx, "Modo", self.modo)
+        self.nodo_tick = await objeto.add_variable(idx, "Tick", self.tick, varianttype=ua.VariantType.UInt64)
+        self.nodo_liberados = await objeto.add_variable(idx, "TicksLiberados", self.liberados,
+                                                        varianttype=ua.VariantType.UInt64)
+        await objeto.add_method(idx, "RegistrarConsumidor", self._registrar,
+                                [ua.VariantType.String, ua.VariantType.UInt32], [ua.VariantType.UInt64])
+        await objeto.add_method(idx, "ConfirmarTick", self._confirmar,
+                                [ua.VariantType.String, ua.VariantType.UInt64], [ua.VariantType.Boolean])
+        await objeto.add_method(idx, "DarDeBaja", self._dar_de_baja, [ua.VariantType.String], [])
+        # asyncua registra cada llamada a método a nivel INFO: sería una línea por consumidor y tick
+        logging.getLogger("asyncua.server.address_space").setLevel(logging.WARNING)
+
+    async def cambiar_modo(self, modo):
+        if modo not in MODOS:
+            raise ValueError(f"Modo de reloj desconocido '{modo}', debe ser uno de {MODOS}")
+        self.modo = modo
+        await self.nodo_modo.write_value(modo)
+        _logger.info("Reloj en modo %s", modo)
+
+    @uamethod
+    async def _registrar(self, parent, nombre, etapa):
+        etapa = min(etapa, ETAPAS_MAXIMAS - 1)
+        async with self._cambio:
+            # Empieza a contar desde el tick en curso: no bloquea uno que ya estaba en marcha
+            self.consumidores[nombre] = _Consumidor(nombre, etapa, self.tick)
+            self._cambio.notify_all()
+        _logger.info("Consumidor '%s' registrado en la etapa %d", nombre, etapa)
+        return ua.Variant(self.tick, ua.VariantType.UInt64)
+
+    @uamethod
+    async def _confirmar(self, parent, nombre, tick):
+        consumidor = self.consumidores.get(nombre)
+        if consumidor is None:
+            # Dado de baja por vencimientos o el servidor se ha reiniciado: debe volver a registrarse
+            return False
+        async with self._cambio:
+            consumidor.confirmado = max(consumidor.confirmado, tick)
+            consumidor.vencimientos = 0
+            self._cambio.notify_all()
+        return True
+
+    @uamethod
+    async def _dar_de_baja(self, parent, nombre):
+        async with self._cambio:
+            if self.consumidores.pop(nombre, None) is not None:
+                _logger.info("Consumidor '%s' dado de baja", nombre)
+            self._cambio.notify_all()
+
+    async def _liberar(self, hasta_etapa, tick):
+        for etapa in range(hasta_etapa + 1):
+            self.liberados[etapa] = tick
+        await self.nodo_liberados.write_value(ua.Variant(list(self.liberados), ua.VariantType.UInt64))
+
+    async def _esperar_etapa(self, etapa, tick):
+        def confirmada():
+            return all(c.confirmado >= tick for c in self.consumidores.values() if c.etapa == etapa)
+
+        async with self._cambio:
+            await self._cambio.wait_for(confirmada)
+
+    def _vencer(self, etapa, tick):
+        for consumidor in [c for c in self.consumidores.values() if c.etapa == etapa and c.confirmado < tick]:
+            consumidor.vencimientos += 1
+            if consumidor.vencimientos >= VENCIMIENTOS_PARA_BAJA:
+                del self.consumidores[consumidor.nombre]
+                _logger.warning("Consumidor '%s' dado de baja tras %d ticks sin confirmar",
+                                consumidor.nombre, consumidor.vencimientos)
+            else:
+                _logger.warning("Consumidor '%s' no confirmó el tick %d en %.1f s",
+                                consumidor.nombre, tick, self.tiempo_maximo)
+
+    async def publicar(self, tick):
+        """Anuncia `tick` (la hora simulada ya debe estar escrita) y espera sus confirmaciones.
+
+        En tiempo real se liberan todas las etapas a la vez y no se espera a nadie. En los
+        otros modos se libera cada etapa cuando la anterior ha confirmado o ha vencido el plazo.
+        """
+        self.tick = tick
+        await self.nodo_tick.write_value(ua.Variant(tick, ua.VariantType.UInt64))
+        if self.modo != MODO_TIEMPO_REAL:
+            for etapa in sorted({c.etapa for c in self.consumidores.values()}):
+                await self._liberar(etapa, tick)
+                try:
+                    await asyncio.wait_for(self._esperar_etapa(etapa, tick), self.tiempo_maximo)
+                except asyncio.TimeoutError:
+                    self._vencer(etapa, tick)
+        await self._liberar(ETAPAS_MAXIMAS - 1, tick)
+
+
+class ConsumidorTicks:
+    """Lado del consumidor: espera un tick liberado para su etapa y lo confirma al terminarlo.
+
+    Sustituye al asyncio.sleep(intervalo) de los bucles: en tiempo real se comporta igual;
+    en lockstep y libre despierta en cuanto el reloj libera un tick nuevo para su etapa.
+    Sigue los cambios de modo del reloj mediante una suscripción del gestor de conexiones.
+    """
+
+    def __init__(self, nombre, etapa=ETAPA_ESTACIONES):
+        self.nombre = nombre
+        self.etapa = etapa
+        self.modo = MODO_TIEMPO_REAL
+        self.liberado = 0
+        self.en_curso = 0
+        self.confirmado = 0
+        self.url = None
+        self._reinicio_reloj = False
+        self._aviso = asyncio.Event()
+
+    async def registrar(self, url):
+        conexion = await GESTOR.obtener(url)
+        try:
+            rutas = {nombre: f"{OBJETO_SINCRONIZACION}/{nombre}"
+                     for nombre in ["Modo", "TicksLiberados", "RegistrarConsumidor", "ConfirmarTick", "DarDeBaja"]}
+            nodos = await resolver_nodos(conexion.cliente, URI_TEMPORAL, [OBJETO_SINCRONIZACION, *rutas.values()])
+            self._objeto = nodos[OBJETO_SINCRONIZACION]
+            self._nodos = {nombre: nodos[ruta] for nombre, ruta in rutas.items()}
+            self.modo = await self._nodos["Modo"].read_value()
+            self.liberado = self._liberado_de(await self._nodos["TicksLiberados"].read_value())
+            await self._registrarse()
+            await conexion.suscribir(self, [self._nodos["Modo"], self._nodos["TicksLiberados"]], PERFIL_SINCRONIZACION)
+        except BaseException:
+            await GESTOR.liberar(url)
+            raise
+        self.url = url
+        _logger.info("'%s' sincronizado con el reloj de %s (modo %s, etapa %d)", self.nombre, url, self.modo, self.etapa)
+
+    async def _registrarse(self):
+        tick = await self._objeto.call_method(self._nodos["RegistrarConsumidor"].nodeid, ua.Variant(self.nombre, ua.VariantType.String),
+                                              ua.Variant(self.etapa, ua.VariantType.UInt32))
+        # Si el reloj ha vuelto a empezar, la numeración de ticks anterior ya no vale
+        self.confirmado = tick
+
+    def _liberado_de(self, liberados):
+        return liberados[self.etapa] if liberados and self.etapa < len(liberados) else 0
+
+    def datachange_notification(self, node, val, data):
+        if node.nodeid == self._nodos["Modo"].nodeid:
+            self.modo = val
+        else:
+            self.liberado = self._liberado_de(val)
+            if self.liberado < self.confirmado:
+                # Reloj reiniciado sin punto de control: hay que volver a registrarse
+                self._reinicio_reloj = True
+        self._aviso.set()
+
+    async def esperar(self, intervalo):
+        """Espera al siguiente tick de esta etapa; como mucho `intervalo` segundos."""
+        if self._reinicio_reloj:
+            self._reinicio_reloj = False
+            try:
+                await self._registrarse()
+            except ERRORES_CONEXION:
+                self._reinicio_reloj = True
+        if self.modo == MODO_TIEMPO_REAL:
+            await asyncio.sleep(intervalo)
+        elif self.liberado <= self.confirmado:
+            self._aviso.clear()
+            try:
+                await asyncio.wait_for(self._aviso.wait(), intervalo)
+            except asyncio.TimeoutError:
+                # Por si se ha perdido una notificación (p. ej. durante una reconexión)
+                try:
+                    self.liberado = self._liberado_de(await self._nodos["TicksLiberados"].read_value())
+                except ERRORES_CONEXION:
+                    pass
+        self.en_curso = self.liberado
+
+    async def confirmar(self):
+        """Confirma el tick con el que empezó la última vuelta del bucle, si no estaba confirmado."""
+        if self.modo == MODO_TIEMPO_REAL or self.en_curso <= self.confirmado:
+            return
+        tick = self.en_curso
+        registrado = await self._objeto.call_method(self._nodos["ConfirmarTick"].nodeid, ua.Variant(self.nombre, ua.VariantType.String),
+                                                    ua.Variant(tick, ua.VariantType.UInt64))
+        self.confirmado = tick
+        if not registrado:
+            _logger.warning("'%s' no estaba registrado en el reloj, se vuelve a registrar", self.nombre)
+            await self._registrarse()
+
+    async def cerrar(self):
+        if self.url is None:
+            return
+        try:
+            await self._objeto.call_method(self._nodos["DarDeBaja"].nodeid, ua.Variant(self.nombre, ua.VariantType.String))
+        except ERRORES_CONEXION:
+            pass
+        await GESTOR.liberar(self.url)
+        self.url = None
+
+
+class _SincronizacionInactiva(ConsumidorTicks):
+    """Consumidor sin reloj sincronizado; valor por defecto de los parámetros `sincronizacion`."""
+
+    def __init__(self):
+        super().__init__("")
+
+    async def esperar(self, intervalo):
+        await asyncio.sleep(intervalo)
+
+    async def confirmar(self):
+        pass
+
+    async def cerrar(self):
+        pass
+
+
+SIN_SINCRONIZACION = _SincronizacionInactiva()
+
+
+async def registrar_consumidor(url, nombre, etapa=ETAPA_ESTACIONES):
+    """ConsumidorTicks registrado en el reloj de `url`, o SIN_SINCRONIZACION si el reloj no lo admite."""
+    consumidor = ConsumidorTicks(nombre, etapa)
+    try:
+        await consumidor.registrar(url)
+    except Exception as e:
+        # resolver_nodos lanza Exception si el reloj no publica el objeto Sincronizacion
+        _logger.info("El reloj de %s no admite sincronización (%s); '%s' sigue en tiempo real", url, e, nombre)
+        return SIN_SINCRONIZACION
+    return consumidor